@@ -0,0 +1,177 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+from io import BytesIO
+
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+from cache import TTLCache
+from objectstore import object_storage, resolve_url
+
+# Scan images with their detection boxes drawn in, as used by the PDF report
+# and GET /api/v1/history/{id}/annotated. Each is rendered once and stored in
+# the storage backend under annotated/<scan id>/<model version>-<digest>.jpg,
+# where the digest covers the detections, so a scan whose detections change
+# gets a new rendering instead of a stale one; the scan's older renderings
+# are deleted then, and all of them with the scan. Recently used renderings
+# are also kept in memory, since admins download the same reports repeatedly.
+ANNOTATED_QUALITY = int(os.getenv("ANNOTATED_QUALITY", "90"))
+ANNOTATED_MEMORY_ENTRIES = int(os.getenv("ANNOTATED_MEMORY_ENTRIES", "32"))
+ANNOTATED_MEMORY_TTL_SECONDS = int(os.getenv("ANNOTATED_MEMORY_TTL_SECONDS", "600"))
+
+ANNOTATED_PREFIX = "annotated"
+BOX_COLOR = "#ef4444"
+
+
+def detections_digest(detections):
+    canonical = json.dumps(detections or [], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:16]
+
+
+def annotated_prefix(scan_id):
+    """Directory holding every rendering of one scan."""
+    return f"{ANNOTATED_PREFIX}/{scan_id}/"
+
+
+def annotated_key(scan_data):
+    version = scan_data.get("model_version") or "unversioned"
+    return f"{annotated_prefix(scan_data['id'])}{version}-{detections_digest(scan_data.get('detections'))}.jpg"
+
+
+@functools.lru_cache(maxsize=1)
+def _label_font():
+    try:
+        return ImageFont.truetype("arial.ttf", 36)
+    except IOError:
+        return ImageFont.load_default()
+
+
+def load_image(image_url):
+    """Opens a stored image from the backend that holds it, else over HTTP, else as a local path."""
+    if image_url.startswith("http"):
+        backend, key = resolve_url(image_url)
+        if backend is not None:
+            try:
+                return Image.open(BytesIO(backend.read(key)))
+            except FileNotFoundError:
+                print(f"Image not found in {backend.name} storage: {key}")
+        response = requests.get(image_url, stream=True, timeout=30)
+        response.raise_for_status()
+        return Image.open(response.raw)
+    return Image.open(image_url)
+
+
+def draw_detections(img, detections):
+    """Draws each detection's box and label onto img (RGB) in place."""
+    draw = ImageDraw.Draw(img)
+    font = _label_font()
+    for det in detections:
+        # Support 'bbox' (from backend) and 'box' (legacy/frontend)
+        box = det.get("bbox") or det.get("box") or []
+        if not box or len(box) != 4:
+            continue
+        box = [int(c) for c in box]
+        label = det.get("class") or det.get("label") or "Defect"
+        text = f"{label.upper()} ({det.get('confidence', 0):.0%})"
+
+        draw.rectangle(box, outline=BOX_COLOR, width=5)
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        text_w, text_h = right - left, bottom - top
+        draw.rectangle([box[0], box[1] - text_h - 10, box[0] + text_w + 20, box[1]], fill=BOX_COLOR)
+        draw.text((box[0] + 10, box[1] - text_h - 5), text, fill="white", font=font)
+    return img
+
+
+def render_annotated(image_url, detections, quality=ANNOTATED_QUALITY):
+    """JPEG bytes of the image at image_url with detections drawn on it."""
+    with load_image(image_url) as source:
+        img = draw_detections(source.convert("RGB"), detections)
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class AnnotatedImageCache:
+    """
+    Renders each scan's annotated image once and serves it from storage (and
+    a small in-memory LRU) afterwards. Concurrent requests for the same
+    rendering wait for the first one instead of drawing it again.
+    """
+
+    def __init__(self, backend=object_storage, memory_entries=ANNOTATED_MEMORY_ENTRIES,
+                 memory_ttl=ANNOTATED_MEMORY_TTL_SECONDS):
+        self.backend = backend
+        self._memory = TTLCache(max_entries=memory_entries, ttl_seconds=memory_ttl)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+        self.rendered = 0
+        self.stored_hits = 0
+        self.failed = 0
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, scan_data):
+        """
+        (key, JPEG bytes) of a history record's annotated image; bytes is
+        None when the record has no image or it cannot be loaded. Blocking.
+        """
+        key = annotated_key(scan_data)
+        data = self._memory.get(key)
+        if data is not None:
+            return key, data
+        if not scan_data.get("image_url"):
+            return key, None
+
+        lock = self._lock_for(key)
+        try:
+            with lock:
+                data = self._memory.get(key)
+                if data is None:
+                    data = self._load_or_render(key, scan_data)
+                    if data is not None:
+                        self._memory.set(key, data)
+        finally:
+            with self._locks_lock:
+                self._locks.pop(key, None)
+        return key, data
+
+    def _load_or_render(self, key, scan_data):
+        try:
+            data = self.backend.read(key)
+            self.stored_hits += 1
+            return data
+        except FileNotFoundError:
+            pass
+        try:
+            data = render_annotated(scan_data["image_url"], scan_data.get("detections") or [])
+        except Exception as e:
+            self.failed += 1
+            print(f"Could not render annotated image for {scan_data['id']}: {e}")
+            return None
+        # Renderings of the scan's earlier detections are stale from now on
+        self.backend.remove_prefix(annotated_prefix(scan_data["id"]))
+        self.backend.write_bytes(key, data)
+        self.rendered += 1
+        return data
+
+    def invalidate(self, scan_data):
+        """Deletes every rendering of the record (e.g. when it is deleted)."""
+        self._memory.pop(annotated_key(scan_data))
+        self.backend.remove_prefix(annotated_prefix(scan_data["id"]))
+
+    def stats(self):
+        return {
+            "rendered": self.rendered,
+            "stored_hits": self.stored_hits,
+            "failed": self.failed,
+            "memory": self._memory.stats(),
+        }
+
+
+annotated_images = AnnotatedImageCache()
@@ -0,0 +1,143 @@
+import os
+import shutil
+import hashlib
+import numpy as np
+
+# Which runtime executes the YOLO graphs:
+#   pytorch  - the .pt weights as-is (default)
+#   onnx     - exported ONNX graph run by ONNX Runtime
+#   openvino - exported OpenVINO IR run by the OpenVINO CPU plugin
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "pytorch").strip().lower()
+
+# Exported artifacts are cached here, keyed by the weights' content hash
+EXPORT_DIR = os.getenv("MODEL_EXPORT_DIR", os.path.join("..", "model", "exported"))
+
+# Max allowed |confidence| and normalized-coordinate difference between the
+# PyTorch model and an exported one on the parity image
+PARITY_TOLERANCE = float(os.getenv("BACKEND_PARITY_TOLERANCE", "0.05"))
+PARITY_IMAGE = os.getenv("BACKEND_PARITY_IMAGE", os.path.join(os.path.dirname(__file__), "bus.jpg"))
+
+SUPPORTED_BACKENDS = ("pytorch", "onnx", "openvino")
+
+
+def _weights_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _artifact_path(weights_path, backend):
+    stem = os.path.splitext(os.path.basename(weights_path))[0]
+    name = f"{stem}-{_weights_hash(weights_path)}"
+    if backend == "onnx":
+        return os.path.join(EXPORT_DIR, f"{name}.onnx")
+    return os.path.join(EXPORT_DIR, f"{name}_openvino_model")
+
+
+def export_model(weights_path, backend, imgsz):
+    """
+    Exports weights_path for the given backend once and returns the cached
+    artifact path. Exports use a dynamic batch/shape so batching and per-request
+    inference sizes keep working.
+    """
+    from ultralytics import YOLO
+
+    target = _artifact_path(weights_path, backend)
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    print(f"Exporting {weights_path} to {backend} (one-time)...")
+    exported = YOLO(weights_path).export(format=backend, imgsz=imgsz, dynamic=True)
+    # Ultralytics writes next to the weights; move the result into the cache
+    shutil.move(str(exported), target)
+    print(f"Exported {backend} model cached at {target}")
+    return target
+
+
+def _parity_input(imgsz):
+    import cv2
+    img = cv2.imread(PARITY_IMAGE) if os.path.exists(PARITY_IMAGE) else None
+    if img is None:
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 255, size=(imgsz, imgsz, 3), dtype=np.uint8)
+    return img
+
+
+def _outputs(model, img, imgsz):
+    result = model(img, imgsz=imgsz, verbose=False)[0]
+    return [
+        (int(c), float(p), b)
+        for c, p, b in zip(
+            result.boxes.cls.tolist(), result.boxes.conf.tolist(), result.boxes.xyxyn.tolist()
+        )
+    ]
+
+
+def check_parity(reference, candidate, imgsz, tolerance=PARITY_TOLERANCE):
+    """
+    Runs both models on the parity image and checks every reference detection
+    has a same-class candidate detection within tolerance (and vice versa).
+    Returns (ok, message).
+    """
+    img = _parity_input(imgsz)
+    expected = sorted(_outputs(reference, img, imgsz), key=lambda d: -d[1])
+    actual = sorted(_outputs(candidate, img, imgsz), key=lambda d: -d[1])
+    if len(expected) != len(actual):
+        return False, f"detection count differs ({len(expected)} vs {len(actual)})"
+
+    unmatched = list(actual)
+    for cls, conf, box in expected:
+        match = None
+        for other in unmatched:
+            if other[0] != cls or abs(other[1] - conf) > tolerance:
+                continue
+            if max(abs(a - b) for a, b in zip(box, other[2])) <= tolerance:
+                match = other
+                break
+        if match is None:
+            return False, f"no match within {tolerance} for class {cls} at {conf:.2f}"
+        unmatched.remove(match)
+    return True, f"{len(expected)} detections matched within {tolerance}"
+
+
+def load_model(weights_path, backend=None, imgsz=640):
+    """
+    Loads weights_path on the configured backend, exporting it first if needed.
+    Exported graphs must reproduce the PyTorch outputs on the parity image;
+    if export, loading or the parity check fails, the PyTorch model is used.
+    Returns (model, backend_actually_used).
+    """
+    # Imported here so importing this module (and detect.py) stays cheap
+    from ultralytics import YOLO
+
+    backend = (backend or INFERENCE_BACKEND).lower()
+    if backend not in SUPPORTED_BACKENDS:
+        print(f"Unknown INFERENCE_BACKEND {backend!r}; using pytorch.")
+        backend = "pytorch"
+
+    if not weights_path.endswith(".pt"):
+        # Already an exported artifact (e.g. a quantized ONNX graph); serve as-is
+        exported_as = "onnx" if weights_path.endswith(".onnx") else "openvino"
+        return YOLO(weights_path, task="detect"), exported_as
+
+    reference = YOLO(weights_path)
+    if backend == "pytorch":
+        return reference, "pytorch"
+
+    try:
+        artifact = export_model(weights_path, backend, imgsz)
+        candidate = YOLO(artifact, task=reference.task)
+        ok, message = check_parity(reference, candidate, imgsz)
+    except Exception as e:
+        print(f"Could not load {backend} backend for {weights_path}: {e}; using pytorch.")
+        return reference, "pytorch"
+
+    if not ok:
+        print(f"{backend} export of {weights_path} failed the parity check ({message}); using pytorch.")
+        return reference, "pytorch"
+
+    print(f"Loaded {weights_path} on {backend} ({message}).")
+    return candidate, backend
@@ -0,0 +1,175 @@
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+
+from objectstore import object_storage
+
+# Content-addressed image store. Each image is kept once, under the key
+# blobs/<aa>/<bb>/<sha256>.<ext> of the storage backend (see objectstore.py),
+# however many history records point at it; a SQLite table lists which
+# records reference which blob and a blob is deleted when its last reference
+# is released. API replicas sharing an S3 bucket must share BLOB_DB_PATH too.
+BLOB_PREFIX = "blobs"
+BLOB_DB_PATH = os.getenv("BLOB_DB_PATH", "blobs.sqlite3")
+
+# Extension per ingest.sniff_format name, so the blob is served with the right content type
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "bmp": "bmp", "tiff": "tiff"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blob_refs (
+    key TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (key, ref)
+);
+CREATE INDEX IF NOT EXISTS blob_refs_ref ON blob_refs (ref);
+"""
+
+
+_BLOB_KEY = re.compile(rf"^{BLOB_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/[0-9a-f]{{64}}\.[a-z]+$")
+
+
+def blob_key(sha256, image_format):
+    """Sharded relative path of a blob: two levels of two hex digits each."""
+    ext = EXTENSIONS.get(image_format, "bin")
+    return f"{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}.{ext}"
+
+
+def is_blob_key(key):
+    """Whether key has the exact shape blob_key produces."""
+    return bool(key and _BLOB_KEY.match(key))
+
+
+class BlobStore:
+    """
+    Stores blobs in a storage backend and counts references to them in SQLite.
+
+    put_file/put_bytes add a reference (a history doc id) to a blob, storing
+    the blob if it is not there yet, and release drops one, deleting the
+    blob when none remain. A reference is recorded before the blob is
+    uploaded, so a concurrent release of the last other reference cannot
+    delete the object under the upload, also across API processes sharing
+    BLOB_DB_PATH; the upload itself runs without the SQLite write lock.
+    """
+
+    def __init__(self, backend=object_storage, db_path=BLOB_DB_PATH, companions=None):
+        self.backend = backend
+        # companions(key) lists keys derived from a blob, deleted along with it
+        self.companions = companions or (lambda key: [])
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+        self.stored = 0
+        self.deduplicated = 0
+        self.unlinked = 0
+
+    def _connect(self):
+        # Autocommit; each operation opens its own transaction
+        return sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+
+    def _add(self, key, ref, size, place):
+        """
+        Records ref for key, calling place() if the blob is not stored yet.
+        Returns True if place() was called.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR IGNORE INTO blob_refs (key, ref, created_at) VALUES (?, ?, ?)",
+                    (key, ref, time.time()),
+                )
+                exists = conn.execute("SELECT 1 FROM blobs WHERE key = ?", (key,)).fetchone() is not None
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if exists:
+                self.deduplicated += 1
+                return False
+
+            # Keys are content hashes, so a concurrent upload of the same blob
+            # writes the same bytes and either one may win
+            try:
+                place()
+            except BaseException:
+                self.release(key, ref)
+                raise
+            conn.execute(
+                "INSERT OR IGNORE INTO blobs (key, size, created_at) VALUES (?, ?, ?)",
+                (key, size, time.time()),
+            )
+        self.stored += 1
+        return True
+
+    def put_file(self, src_path, sha256, image_format, ref):
+        """
+        Moves an already-written file (e.g. an ingest spool file) into the
+        store and references it from ref. If the blob exists, src_path is
+        removed instead. Returns the key.
+        """
+        key = blob_key(sha256, image_format)
+        size = os.path.getsize(src_path)
+        placed = self._add(key, ref, size, lambda: self.backend.write_file(key, src_path))
+        if not placed:
+            os.remove(src_path)
+        return key
+
+    def put_bytes(self, contents, sha256, image_format, ref):
+        """Writes contents into the store (unless already there) and references it from ref. Returns the key."""
+        key = blob_key(sha256, image_format)
+        self._add(key, ref, len(contents), lambda: self.backend.write_bytes(key, contents))
+        return key
+
+    def release(self, key, ref):
+        """Drops ref's reference to key; deletes the blob if it was the last one. Returns True if deleted."""
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM blob_refs WHERE key = ? AND ref = ?", (key, ref))
+                remaining = conn.execute("SELECT COUNT(*) FROM blob_refs WHERE key = ?", (key,)).fetchone()[0]
+                unlinked = False
+                if remaining == 0:
+                    # Without a blobs row the upload never finished; remove whatever it left
+                    unlinked = conn.execute("DELETE FROM blobs WHERE key = ?", (key,)).rowcount > 0
+                    self.backend.remove(key)
+                    for companion in self.companions(key):
+                        self.backend.remove(companion)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if unlinked:
+            self.unlinked += 1
+        return unlinked
+
+    def references(self, key):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM blob_refs WHERE key = ?", (key,)).fetchone()[0]
+
+    def refs(self, key):
+        """The refs (history doc ids) holding key."""
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT ref FROM blob_refs WHERE key = ?", (key,))]
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            refs = conn.execute("SELECT COUNT(*) FROM blob_refs").fetchone()[0]
+        return {
+            "blobs": blobs,
+            "bytes": size,
+            "references": refs,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "unlinked": self.unlinked,
+        }
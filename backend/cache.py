@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache bounded by entry count, with per-entry expiry.
+    The least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl_seconds
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class InferenceCache:
+    """
+    Content-addressed cache of inference results.
+
+    Keys combine the SHA-256 of the image bytes with a signature of everything
+    that affects the output (model versions, input size, thresholds), so a
+    model swap or config change never serves stale results. Entries live in an
+    in-memory LRU tier and, if a directory is configured, an on-disk JSON tier
+    that survives restarts and is shared by workers on the same host.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600, disk_dir=None):
+        self.memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.ttl = ttl_seconds
+        self.disk_dir = disk_dir or None
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(content_hash, signature):
+        return hashlib.sha256(f"{content_hash}|{signature}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        # Two levels of sharding keep directories small
+        return os.path.join(self.disk_dir, key[:2], key[2:4], f"{key}.json")
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                if time.time() - os.path.getmtime(path) <= self.ttl:
+                    with open(path, "r", encoding="utf-8") as f:
+                        value = json.load(f)
+                    self.memory.set(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(f"Inference cache read error for {key}: {e}")
+
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Inference cache write error for {key}: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk_dir": self.disk_dir,
+        }
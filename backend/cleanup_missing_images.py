@@ -1,6 +1,6 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-import os
+from objectstore import resolve_url
 
 if not firebase_admin._apps:
     cred = credentials.Certificate("serviceAccountKey.json")
@@ -10,20 +10,18 @@ db = firestore.client()
 history_ref = db.collection("history")
 docs = history_ref.stream()
 
-UPLOAD_DIR = "uploads"
 deleted_count = 0
 
-print(f"Cleaning up missing local images in '{UPLOAD_DIR}'...")
+print("Cleaning up history records whose image is missing from storage...")
 
 for doc in docs:
     data = doc.to_dict()
     image_url = data.get("image_url")
     
-    if image_url and "localhost" in image_url:
-        filename = image_url.split("/")[-1]
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        if not os.path.exists(file_path):
+    # Checked in whichever storage backend holds the image
+    backend, key = resolve_url(image_url)
+    if backend is not None:
+        if not backend.exists(key):
             try:
                 print(f"[DELETING] Doc ID: {doc.id} | URL: {image_url}")
                 db.collection("history").document(doc.id).delete()
@@ -0,0 +1,80 @@
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from objectstore import PUBLIC_API_URL, STORAGE_ROUTE
+
+# Downscaled copies of scan images for list and detail views. They are
+# rendered when a scan is saved (and on first request for older records, see
+# the /api/v1/derivatives route) and stored, once the original's reference
+# is recorded so a concurrent release cannot remove them, under
+# derived/<variant>/<original key without extension>.<format>.
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "320"))
+MEDIUM_SIZE = int(os.getenv("MEDIUM_SIZE", "1280"))
+# webp or jpeg
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "webp").strip().lower()
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+
+DERIVED_PREFIX = "derived"
+# Renders missing derivatives, and serves those of backends without a public
+# URL, since the storage route only serves originals (see main.py)
+DERIVATIVES_ROUTE = "/api/v1/derivatives/"
+# Variant -> longest side in pixels, largest first so each is resized from the previous one
+VARIANTS = {"medium": MEDIUM_SIZE, "thumbnail": THUMBNAIL_SIZE}
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+
+
+def derivative_key(source_key, variant, image_format=DERIVATIVE_FORMAT):
+    stem = os.path.splitext(source_key)[0]
+    return f"{DERIVED_PREFIX}/{variant}/{stem}.{_EXTENSIONS.get(image_format, 'jpg')}"
+
+
+def derivative_url(backend, source_key, variant):
+    url = backend.url(derivative_key(source_key, variant))
+    if url.startswith(f"{PUBLIC_API_URL}{STORAGE_ROUTE}"):
+        return f"{PUBLIC_API_URL}{DERIVATIVES_ROUTE}{variant}/{source_key}"
+    return url
+
+
+def derived_keys(source_key):
+    """Every derivative key an original can have, in any format (for deletion)."""
+    return [derivative_key(source_key, variant, fmt) for variant in VARIANTS for fmt in _EXTENSIONS]
+
+
+def render_derivatives(source, image_format=DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY):
+    """
+    Decodes source (a path or bytes) once and returns {variant: encoded bytes}.
+    JPEG sources are decoded straight at a reduced scale (draft mode), so a
+    12 MP phone photo is never expanded to full size for a 1280 px copy.
+    """
+    with Image.open(source if isinstance(source, str) else BytesIO(source)) as img:
+        largest = max(VARIANTS.values())
+        img.draft("RGB", (largest, largest))
+        # Phone photos are often stored sideways with an EXIF rotation tag
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+        rendered = {}
+        for variant, size in VARIANTS.items():
+            img.thumbnail((size, size), Image.LANCZOS)
+            buffer = BytesIO()
+            if image_format == "webp":
+                img.save(buffer, format="WEBP", quality=quality, method=4)
+            else:
+                img.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+            rendered[variant] = buffer.getvalue()
+    return rendered
+
+
+def store_derivatives(backend, source_key, rendered):
+    """Stores render_derivatives output for source_key; returns {"<variant>_url": url}."""
+    urls = {}
+    for variant, data in rendered.items():
+        backend.write_bytes(derivative_key(source_key, variant), data)
+        urls[f"{variant}_url"] = derivative_url(backend, source_key, variant)
+    return urls
+
+
+def derivative_urls(backend, source_key):
+    """{"<variant>_url": url} of already stored variants."""
+    return {f"{variant}_url": derivative_url(backend, source_key, variant) for variant in VARIANTS}
@@ -1,113 +1,849 @@
-from ultralytics import YOLO
+from backends import load_model, export_model, INFERENCE_BACKEND
 from PIL import Image
 import cv2
 import numpy as np
 import os
+import time
+import hashlib
+import threading
+import functools
+from io import BytesIO
+from concurrent.futures import Future
+from scheduler import BatchScheduler
+from workers import InferenceWorkerPool, PoolClosed, worker_count_from_env, is_worker_process
+from registry import registry
+import tiling
 
-# Load model
-MODEL_PATH = "../model/defect_model.pt"
-try:
-    model = YOLO(MODEL_PATH)
+# Square input size fed to both YOLO models. 640 is what they were trained at;
+# larger sizes trade latency for small-defect recall. Requests may override it
+# within [MIN_INFERENCE_SIZE, MAX_INFERENCE_SIZE] (see resolve_inference_size).
+INFERENCE_SIZE = int(os.getenv("INFERENCE_SIZE", "640"))
+MIN_INFERENCE_SIZE = 320
+MAX_INFERENCE_SIZE = 1920
 
-except Exception as e:
-    print(f"Error loading model from {MODEL_PATH}: {e}")
-    model = None
+# JPEG DCT scaling factors cv2 can decode at directly
+_REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
-def predict_image(image_bytes):
+# Micro-batching of concurrent requests (see scheduler.py)
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+# Cascade mode: run the defect model first and only run the COCO vehicle gate
+# when it found nothing at or above CASCADE_CONFIDENCE (see inspect_image).
+CASCADE_ENABLED = os.getenv("INFERENCE_CASCADE", "true").lower() in ("1", "true", "yes")
+CASCADE_CONFIDENCE = float(os.getenv("CASCADE_CONFIDENCE", "0.25"))
+
+# Multi-process mode (see workers.py): the API process hands frames to worker
+# processes over shared memory and does not load the models itself.
+INFERENCE_WORKERS = worker_count_from_env()
+USE_WORKER_PROCESSES = INFERENCE_WORKERS > 0 and not is_worker_process()
+
+# Models are loaded by load_models(): from main.py's lifespan hook at startup,
+# or on first use by anything else (scripts, tests), never at import time.
+# DEFECT_MODEL_PATH can point at a promoted variant, e.g. the INT8 ONNX graph
+# written by quantize_model.py. A version activated in the model registry
+# (registry.py) takes precedence, so hot reloads survive a restart.
+MODEL_PATH = os.getenv("DEFECT_MODEL_PATH", "../model/defect_model.pt")
+VEHICLE_MODEL_PATH = "yolov8n.pt"
+model = None
+MODEL_BACKEND = None
+vehicle_model = None
+VEHICLE_MODEL_BACKEND = None
+MODEL_VERSION = None
+VEHICLE_MODEL_VERSION = None
+models_loaded = False
+_load_lock = threading.Lock()
+
+# The defect model and its version, swapped together as one tuple by
+# reload_defect_model. A batch reads it once, so it finishes on the model it
+# started with and its results carry that model's version.
+_served_defect = (None, None)
+
+def _file_fingerprint(path):
+    """Short content hash of a weights file, used as its model version."""
+    try:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()[:12]
+    except OSError:
+        return "unavailable"
+
+def resolve_inference_size(size):
+    """Validates a requested inference size; None means the deployment default."""
+    if size is None:
+        return INFERENCE_SIZE
+    size = int(size)
+    if size % 32 != 0 or not MIN_INFERENCE_SIZE <= size <= MAX_INFERENCE_SIZE:
+        raise ValueError(
+            f"Inference size must be a multiple of 32 between {MIN_INFERENCE_SIZE} and {MAX_INFERENCE_SIZE}"
+        )
+    return size
+
+
+class DecodedFrame:
+    """
+    An uploaded image decoded once per request and shared by every model.
+
+    Large JPEGs are decoded at a reduced scale straight from the DCT
+    coefficients (1/2, 1/4 or 1/8) as long as the result still covers the
+    inference size, so a 12 MP photo never pays for a full-resolution decode
+    and resize. Boxes are mapped back to original-image coordinates by
+    scale_boxes. The letterboxed input tensor is built on first use and cached
+    per size.
+    """
+
+    def __init__(self, image_bytes, inference_size=None, full_resolution=False):
+        self.image_bytes = image_bytes
+        self.inference_size = inference_size or INFERENCE_SIZE
+        # Tiled inference needs every source pixel, so it opts out of DCT scaling
+        self.full_resolution = full_resolution
+        self.decode_scale = 1.0
+        self._original_shape = None
+        self._image = None
+        self._decoded = False
+        self._letterboxed = {}
+
+    @classmethod
+    def from_array(cls, image, original_shape=None, inference_size=None):
+        """Wraps an already decoded BGR array (e.g. a shared-memory view in a worker)."""
+        frame = cls(None, inference_size=inference_size)
+        frame._image = image
+        frame._decoded = True
+        if original_shape is not None:
+            frame._original_shape = tuple(original_shape)
+            frame.decode_scale = max(original_shape) / max(image.shape[:2])
+        return frame
+
+    def _dct_factor(self):
+        """Largest JPEG reduction factor that keeps the long side >= the inference size."""
+        if self.full_resolution:
+            return 1
+        try:
+            # Only parses the header; no pixels are decoded here
+            with Image.open(BytesIO(self.image_bytes)) as header:
+                if header.format != "JPEG":
+                    return 1
+                long_side = max(header.size)
+        except Exception:
+            return 1
+        factor = 1
+        for candidate in sorted(_REDUCED_DECODE_FLAGS):
+            if long_side / candidate >= self.inference_size:
+                factor = candidate
+        return factor
+
+    @property
+    def image(self):
+        """BGR numpy array, or None if the bytes are not a decodable image."""
+        if not self._decoded:
+            nparr = np.frombuffer(self.image_bytes, np.uint8)
+            factor = self._dct_factor()
+            self._image = cv2.imdecode(nparr, _REDUCED_DECODE_FLAGS.get(factor, cv2.IMREAD_COLOR))
+            if self._image is not None and factor > 1:
+                # Derive the original size from the decoded one so EXIF rotation is respected
+                h, w = self._image.shape[:2]
+                self.decode_scale = float(factor)
+                self._original_shape = (int(round(h * factor)), int(round(w * factor)))
+            self._decoded = True
+        return self._image
+
+    @property
+    def shape(self):
+        """(height, width) of the decoded array."""
+        return self.image.shape[:2]
+
+    @property
+    def original_shape(self):
+        """(height, width) of the uploaded image; boxes are reported in this space."""
+        return self._original_shape or self.shape
+
+    def letterbox(self, size=None):
+        """
+        Returns (tensor, ratio, (pad_x, pad_y)) where tensor is a 1x3xHxW RGB
+        float tensor in [0, 1], padded to size x size like YOLO's own letterbox.
+        size defaults to the frame's inference size.
+        """
+        size = size or self.inference_size
+        if size not in self._letterboxed:
+            import torch
+            img = self.image
+            h, w = img.shape[:2]
+            ratio = min(size / h, size / w)
+            new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+            pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+
+            if (new_w, new_h) != (w, h):
+                img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+            left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+            img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+            # BGR HWC uint8 -> RGB CHW float
+            chw = np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))
+            tensor = torch.from_numpy(chw).float().div_(255.0).unsqueeze(0)
+            self._letterboxed[size] = (tensor, ratio, (pad_x, pad_y))
+        return self._letterboxed[size]
+
+    def scale_boxes(self, boxes, ratio, pad):
+        """Maps an N x 4 array of x1, y1, x2, y2 boxes from letterbox space back to the original image."""
+        h, w = self.original_shape
+        scale = self.decode_scale / ratio
+        out = (np.asarray(boxes, dtype=np.float64) - (pad[0], pad[1], pad[0], pad[1])) * scale
+        np.clip(out[:, 0::2], 0, w, out=out[:, 0::2])
+        np.clip(out[:, 1::2], 0, h, out=out[:, 1::2])
+        return out
+
+
+def decode_image(image_bytes, inference_size=None, full_resolution=False):
+    return DecodedFrame(image_bytes, inference_size=inference_size, full_resolution=full_resolution)
+
+
+def _as_frame(image):
+    """Accepts raw upload bytes or an already decoded frame."""
+    if isinstance(image, DecodedFrame):
+        return image
+    return DecodedFrame(image)
+
+
+class Detections(list):
+    """A detection list that remembers which defect model version produced it."""
+
+    def __init__(self, items=(), model_version=None):
+        super().__init__(items)
+        self.model_version = model_version
+
+
+def _box_arrays(results):
+    """
+    Copies the boxes of a whole batch of YOLO results to the host in one
+    transfer. Returns one N x 6 float array (x1, y1, x2, y2, conf, cls) per
+    result; conf and cls are always the last two columns.
+    """
+    import torch
+    data = [result.boxes.data for result in results]
+    counts = [len(d) for d in data]
+    if not sum(counts):
+        return [np.zeros((0, 6), dtype=np.float32) for _ in results]
+    stacked = torch.cat(data).cpu().numpy()
+    return np.split(stacked, np.cumsum(counts)[:-1])
+
+
+def _defect_detections(boxes, frame, ratio, pad, names):
+    """Converts one result's N x 6 box array for a letterboxed frame into the API detection format."""
+    if not len(boxes):
+        return []
+    h, w = frame.original_shape
+    b = frame.scale_boxes(boxes[:, :4], ratio, pad) # x1, y1, x2, y2
+    bn = b / (w, h, w, h) # x1, y1, x2, y2 (normalized)
+    rounded = np.round(b).astype(np.int64)
+    classes = boxes[:, -1].astype(np.int64)
+
+    return [
+        {
+            "class": names[cls],
+            "confidence": round(conf, 2),
+            "bbox": bbox,
+            "normalized_bbox": nbox,
+        }
+        for cls, conf, bbox, nbox in zip(classes.tolist(), boxes[:, -2].tolist(), rounded.tolist(), bn.tolist())
+    ]
+
+
+def _group_by_size(frames):
+    """Yields (size, indices) so each forward pass stacks same-sized tensors."""
+    groups = {}
+    for i, frame in enumerate(frames):
+        groups.setdefault(frame.inference_size, []).append(i)
+    return groups.items()
+
+
+def _run_defect_batch(frames, defect_model):
+    """One forward pass of the defect model per inference size over decodable frames."""
+    import torch
+    outputs = [None] * len(frames)
+    for size, indices in _group_by_size(frames):
+        letterboxed = [frames[i].letterbox(size) for i in indices]
+        batch = torch.cat([tensor for tensor, _ratio, _pad in letterboxed])
+        results = defect_model(batch, imgsz=size)
+        for i, boxes, (_tensor, ratio, pad) in zip(indices, _box_arrays(results), letterboxed):
+            outputs[i] = _defect_detections(boxes, frames[i], ratio, pad, defect_model.names)
+    return outputs
+
+
+def predict_images(images, defect_model=None):
+    """
+    Batched predict_image: returns one detection list (or error dict) per image.
+    defect_model overrides the served model, e.g. to evaluate a candidate with
+    exactly the serving pre- and post-processing.
+    """
+    version = None
+    if defect_model is None:
+        _ensure_loaded()
+        defect_model, version = _served_defect
+    if defect_model is None:
+        return [{"error": "Model not loaded"} for _ in images]
+
+    frames = [_as_frame(image) for image in images]
+    outputs = [{"error": "Could not decode image"} for _ in frames]
+    valid = [i for i, frame in enumerate(frames) if frame.image is not None]
+    if valid:
+        for i, detections in zip(valid, _run_defect_batch([frames[i] for i in valid], defect_model)):
+            outputs[i] = Detections(detections, model_version=version)
+    return outputs
+
+
+def _completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def submit_prediction(image):
+    """
+    Queues an image on the defect model's batch scheduler and returns a
+    concurrent.futures.Future; async handlers await it with asyncio.wrap_future.
+    """
+    _ensure_loaded()
+    if worker_pool is not None:
+        frame = _as_frame(image)
+        if frame.image is None:
+            return _completed({"error": "Could not decode image"})
+        return _submit_to_workers("prediction", frame)
     if model is None:
-        return {"error": "Model not loaded"}
-    
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Inference
-    results = model(img)
-    
-    # Process results
-    detections = []
-    for result in results:
-        for box in result.boxes:
-            b = box.xyxy[0].tolist() # x1, y1, x2, y2
-            bn = box.xyxyn[0].tolist() # x1, y1, x2, y2 (normalized)
-            conf = float(box.conf)
-            cls = int(box.cls)
-            class_name = model.names[cls]
-            
-            # Debug logging
-            # print(f"DEBUG: Detection - Class ID: {cls}, Label: {class_name}")
-
-            detections.append({
-                "class": class_name,
-                "confidence": round(conf, 2),
-                "bbox": [round(x) for x in b],
-                "normalized_bbox": bn
-            })
-            
-    return detections
+        return _completed({"error": "Model not loaded"})
+    return defect_scheduler.submit(_as_frame(image))
+
+
+def _submit_to_workers(kind, frame):
+    pool = worker_pool
+    try:
+        return pool.submit(kind, frame)
+    except PoolClosed:
+        # The pool was swapped out by a hot reload between the read and the submit
+        return worker_pool.submit(kind, frame)
+
+
+def predict_image(image):
+    return submit_prediction(image).result()
 
-# Load vehicle detection model (YOLOv8n is small and fast)
-try:
-    vehicle_model = YOLO("yolov8n.pt")
-except Exception as e:
-    print(f"Error loading vehicle model: {e}")
-    vehicle_model = None
 
-def analyze_image_content(image_bytes):
+def needs_tiling(frame):
+    """True when the image is larger than one tile, i.e. slicing can add detail."""
+    return frame.image is not None and max(frame.original_shape) > tiling.TILE_SIZE
+
+
+def predict_tiled(image):
     """
-    Analyze image content to check for vehicles and forbidden objects.
-    Returns a dict with analysis results.
+    Sliced inference for large images; same output format as predict_image.
+
+    The frame should be decoded with full_resolution=True. It is cut into
+    overlapping tiles (views, not copies) that are all queued at once, so the
+    batch scheduler (or worker pool) runs them as full batches; with
+    TILE_FULL_FRAME the whole frame joins the same queue at the normal
+    inference size. Tile detections are shifted into image coordinates and
+    merged across tiles with tiling.merge_boxes.
     """
-    if vehicle_model is None:
-        print("Vehicle model not loaded, skipping check.")
-        return {"is_vehicle": True, "has_forbidden": False, "confidence": 0.0} 
-    
-    # Convert bytes to numpy array
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    # Perform inference
-    results = vehicle_model(img)
-    
-    # Vehicle class IDs (COCO): car(2), motorcycle(3), bus(5), truck(7)
-    vehicle_ids = [2, 3, 5, 7]
-    
-    # Forbidden class IDs (COCO) - People, Animals, Indoor/Household items
-    # 0: person
-    # 14-23: bird, cat, dog, horse, sheep, cow, elephant, bear, zebra, giraffe
-    # 24-28: backpack, umbrella, handbag, tie, suitcase
-    # 56-62: chair, couch, potted plant, bed, dining table, toilet, tv
-    forbidden_ids = [0] + list(range(14, 24)) + list(range(24, 29)) + list(range(56, 63))
-    
-    max_vehicle_conf = 0.0
-    is_vehicle_detected = False
-    
-    forbidden_found = False
+    frame = _as_frame(image)
+    if frame.image is None:
+        return {"error": "Could not decode image"}
+    if not needs_tiling(frame):
+        return submit_prediction(frame).result()
+
+    img = frame.image
+    h, w = img.shape[:2]
+    windows = tiling.tile_grid(h, w)
+    futures = [
+        submit_prediction(DecodedFrame.from_array(img[y0:y1, x0:x1], inference_size=tiling.TILE_SIZE))
+        for x0, y0, x1, y1 in windows
+    ]
+    if tiling.TILE_FULL_FRAME:
+        futures.append(submit_prediction(frame))
+        windows.append(None)
+
+    boxes, scores, classes = [], [], []
+    version = None
+    for window, future in zip(windows, futures):
+        detections = future.result()
+        if not isinstance(detections, list):
+            return detections
+        version = version or getattr(detections, "model_version", None)
+        for det in detections:
+            x1, y1, x2, y2 = det["normalized_bbox"]
+            if window is None:
+                boxes.append((x1 * w, y1 * h, x2 * w, y2 * h))
+            else:
+                x0, y0, wx1, wy1 = window
+                tw, th = wx1 - x0, wy1 - y0
+                boxes.append((x0 + x1 * tw, y0 + y1 * th, x0 + x2 * tw, y0 + y2 * th))
+            scores.append(det["confidence"])
+            classes.append(det["class"])
+    if not boxes:
+        return Detections(model_version=version)
+
+    merged, merged_scores, merged_classes = tiling.merge_boxes(boxes, scores, classes)
+    # Boxes are in decoded-pixel space; full_resolution frames have decode_scale 1
+    oh, ow = frame.original_shape
+    merged *= frame.decode_scale
+    normalized = merged / (ow, oh, ow, oh)
+    rounded = np.round(merged).astype(np.int64)
+    return Detections(
+        (
+            {
+                "class": cls,
+                "confidence": round(conf, 2),
+                "bbox": bbox,
+                "normalized_bbox": nbox,
+            }
+            for cls, conf, bbox, nbox in zip(
+                merged_classes.tolist(), merged_scores.tolist(), rounded.tolist(), normalized.tolist()
+            )
+        ),
+        model_version=version,
+    )
+
+# Vehicle class IDs (COCO): car(2), motorcycle(3), bus(5), truck(7)
+VEHICLE_IDS = [2, 3, 5, 7]
+
+# Forbidden class IDs (COCO) - People, Animals, Indoor/Household items
+# 0: person
+# 14-23: bird, cat, dog, horse, sheep, cow, elephant, bear, zebra, giraffe
+# 24-28: backpack, umbrella, handbag, tie, suitcase
+# 56-62: chair, couch, potted plant, bed, dining table, toilet, tv
+FORBIDDEN_IDS = [0] + list(range(14, 24)) + list(range(24, 29)) + list(range(56, 63))
+
+
+def _content_analysis(boxes, names):
+    """Reduces one COCO result's N x 6 box array to the vehicle / forbidden-object verdict."""
+    conf = boxes[:, -2]
+    classes = boxes[:, -1].astype(np.int64)
+
+    vehicle_conf = conf[np.isin(classes, VEHICLE_IDS)]
+    max_vehicle_conf = float(vehicle_conf.max()) if vehicle_conf.size else 0.0
+    is_vehicle_detected = max_vehicle_conf > 0.4
+
+    # Higher threshold for rejecting
+    forbidden = np.flatnonzero(np.isin(classes, FORBIDDEN_IDS) & (conf > 0.5))
+    forbidden_found = forbidden.size > 0
     forbidden_label = None
     max_forbidden_conf = 0.0
-    
-    for result in results:
-        for box in result.boxes:
-            cls = int(box.cls)
-            conf = float(box.conf)
-            
-            if cls in vehicle_ids:
-                if conf > max_vehicle_conf:
-                    max_vehicle_conf = conf
-                if conf > 0.4:
-                    is_vehicle_detected = True
-            
-            elif cls in forbidden_ids:
-                if conf > 0.5: # Higher threshold for rejecting
-                    if conf > max_forbidden_conf:
-                        max_forbidden_conf = conf
-                        forbidden_found = True
-                        forbidden_label = vehicle_model.names[cls]
-                
+    if forbidden_found:
+        best = forbidden[np.argmax(conf[forbidden])]
+        max_forbidden_conf = float(conf[best])
+        forbidden_label = names[int(classes[best])]
+
     return {
-        "is_vehicle": is_vehicle_detected,
+        "is_vehicle": bool(is_vehicle_detected),
         "vehicle_confidence": max_vehicle_conf,
-        "has_forbidden": forbidden_found,
+        "has_forbidden": bool(forbidden_found),
         "forbidden_label": forbidden_label,
         "forbidden_confidence": max_forbidden_conf
     }
+
+
+def _undecodable_analysis():
+    return {
+        "is_vehicle": False,
+        "vehicle_confidence": 0.0,
+        "has_forbidden": False,
+        "forbidden_label": None,
+        "forbidden_confidence": 0.0
+    }
+
+
+def _run_vehicle_batch(frames):
+    """One forward pass of the vehicle model per size, reusing each frame's letterboxed tensor."""
+    import torch
+    outputs = [None] * len(frames)
+    for size, indices in _group_by_size(frames):
+        batch = torch.cat([frames[i].letterbox(size)[0] for i in indices])
+        results = vehicle_model(batch, imgsz=size)
+        for i, boxes in zip(indices, _box_arrays(results)):
+            outputs[i] = _content_analysis(boxes, vehicle_model.names)
+    return outputs
+
+
+def analyze_images(images):
+    """Batched analyze_image_content: returns one analysis dict per image."""
+    _ensure_loaded()
+    if vehicle_model is None:
+        print("Vehicle model not loaded, skipping check.")
+        return [{"is_vehicle": True, "has_forbidden": False, "confidence": 0.0} for _ in images]
+
+    frames = [_as_frame(image) for image in images]
+    outputs = [_undecodable_analysis() for _ in frames]
+    valid = [i for i, frame in enumerate(frames) if frame.image is not None]
+    if valid:
+        for i, analysis in zip(valid, _run_vehicle_batch([frames[i] for i in valid])):
+            outputs[i] = analysis
+    return outputs
+
+
+def submit_analysis(image):
+    """Queues an image on the vehicle model's batch scheduler; returns a Future."""
+    _ensure_loaded()
+    if worker_pool is not None:
+        frame = _as_frame(image)
+        if frame.image is None:
+            return _completed(_undecodable_analysis())
+        return _submit_to_workers("analysis", frame)
+    if vehicle_model is None:
+        print("Vehicle model not loaded, skipping check.")
+        return _completed({"is_vehicle": True, "has_forbidden": False, "confidence": 0.0})
+    return vehicle_scheduler.submit(_as_frame(image))
+
+
+def analyze_image_content(image):
+    """
+    Analyze image content to check for vehicles and forbidden objects.
+    Accepts raw bytes or a DecodedFrame shared with predict_image.
+    Returns a dict with analysis results.
+    """
+    return submit_analysis(image).result()
+
+
+def inspect_image(image, cascade=None, tiled=False):
+    """
+    Runs the defect model and, when needed, the vehicle gate on one image.
+
+    With cascade on, the defect model runs first and the vehicle gate is skipped
+    if any detection reaches CASCADE_CONFIDENCE, since the validation in
+    main.py ignores the gate whenever defects are found. With cascade off both
+    models are queued together. tiled runs the defect stage with
+    predict_tiled (decode the frame with full_resolution=True).
+
+    Returns {"detections": ..., "analysis": dict or None, "stages": [...],
+    "model_version": defect model version that produced the detections,
+    "defect_ms": time spent waiting for the defect model}.
+    """
+    if cascade is None:
+        cascade = CASCADE_ENABLED
+    frame = _as_frame(image)
+
+    def defect_stage():
+        if tiled:
+            return predict_tiled(frame)
+        return submit_prediction(frame).result()
+
+    if not cascade:
+        analysis_future = submit_analysis(frame)
+        started = time.perf_counter()
+        detections = defect_stage()
+        defect_ms = round((time.perf_counter() - started) * 1000, 1)
+        return {
+            "detections": detections,
+            "analysis": analysis_future.result(),
+            "stages": ["defect", "vehicle_gate"],
+            "model_version": _version_of(detections),
+            "defect_ms": defect_ms,
+        }
+
+    started = time.perf_counter()
+    detections = defect_stage()
+    defect_ms = round((time.perf_counter() - started) * 1000, 1)
+    confident = isinstance(detections, list) and any(
+        d["confidence"] >= CASCADE_CONFIDENCE for d in detections
+    )
+    if confident:
+        return {
+            "detections": detections,
+            "analysis": None,
+            "stages": ["defect"],
+            "model_version": _version_of(detections),
+            "defect_ms": defect_ms,
+        }
+
+    return {
+        "detections": detections,
+        "analysis": submit_analysis(frame).result(),
+        "stages": ["defect", "vehicle_gate"],
+        "model_version": _version_of(detections),
+        "defect_ms": defect_ms,
+    }
+
+
+def _version_of(detections):
+    # Error dicts carry no version; report whatever is being served
+    return getattr(detections, "model_version", None) or MODEL_VERSION
+
+
+def inference_signature(inference_size=None, tiled=False):
+    """Everything besides the image bytes that determines inspect_image's output."""
+    _ensure_loaded()
+    parts = [
+        MODEL_VERSION,
+        VEHICLE_MODEL_VERSION,
+        # Exported graphs are parity-checked, but not bit-identical to PyTorch
+        f"backend={MODEL_BACKEND or INFERENCE_BACKEND}",
+        str(inference_size or INFERENCE_SIZE),
+        f"cascade={CASCADE_ENABLED}",
+        f"cascade_conf={CASCADE_CONFIDENCE}",
+    ]
+    if tiled:
+        parts.append(
+            f"tiles={tiling.TILE_SIZE}/{tiling.TILE_OVERLAP}/{tiling.TILE_FULL_FRAME}/"
+            f"{tiling.TILE_MERGE}/{tiling.TILE_MATCH_METRIC}/{tiling.TILE_MATCH_THRESHOLD}"
+        )
+    return "|".join(parts)
+
+
+# Micro-batching: concurrent requests are grouped into one forward pass per model.
+# INFERENCE_MAX_BATCH_SIZE=1 turns batching off (each request runs on its own).
+defect_scheduler = BatchScheduler(
+    "defect",
+    predict_images,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+)
+vehicle_scheduler = BatchScheduler(
+    "vehicle",
+    analyze_images,
+    max_batch_size=MAX_BATCH_SIZE,
+    max_wait_ms=MAX_BATCH_WAIT_MS,
+)
+
+# Worker processes batch on their own (greedily, up to MAX_BATCH_SIZE), so the
+# in-process schedulers above are bypassed when this pool exists.
+worker_pool = None
+
+
+def load_models():
+    """
+    Loads both models, or in multi-process mode starts the worker pool that
+    loads them. Safe to call from any thread, any number of times.
+    """
+    global model, MODEL_BACKEND, vehicle_model, VEHICLE_MODEL_BACKEND, MODEL_PATH
+    global MODEL_VERSION, VEHICLE_MODEL_VERSION, worker_pool, models_loaded, _served_defect
+
+    with _load_lock:
+        if models_loaded:
+            return
+        started = time.perf_counter()
+        if not is_worker_process():
+            # Workers are always told which path to load by the pool
+            MODEL_PATH = _resolve_model_path()
+
+        if USE_WORKER_PROCESSES:
+            if INFERENCE_BACKEND != "pytorch":
+                # Export once here so the workers don't race to write the same artifact
+                for weights in (MODEL_PATH, VEHICLE_MODEL_PATH):
+                    try:
+                        export_model(weights, INFERENCE_BACKEND, INFERENCE_SIZE)
+                    except Exception as e:
+                        print(f"Pre-export of {weights} to {INFERENCE_BACKEND} failed: {e}")
+            worker_pool = InferenceWorkerPool(INFERENCE_WORKERS, max_batch_size=MAX_BATCH_SIZE, model_path=MODEL_PATH)
+        else:
+            # Load model (on the runtime chosen by INFERENCE_BACKEND, see backends.py)
+            try:
+                model, MODEL_BACKEND = load_model(MODEL_PATH, imgsz=INFERENCE_SIZE)
+
+            except Exception as e:
+                print(f"Error loading model from {MODEL_PATH}: {e}")
+                model = None
+
+            # Load vehicle detection model (YOLOv8n is small and fast)
+            try:
+                vehicle_model, VEHICLE_MODEL_BACKEND = load_model(VEHICLE_MODEL_PATH, imgsz=INFERENCE_SIZE)
+            except Exception as e:
+                print(f"Error loading vehicle model: {e}")
+                vehicle_model = None
+
+        MODEL_VERSION = _file_fingerprint(MODEL_PATH)
+        _served_defect = (model, MODEL_VERSION)
+        # Fingerprinted after loading, since YOLO downloads yolov8n.pt on first use
+        VEHICLE_MODEL_VERSION = _file_fingerprint(VEHICLE_MODEL_PATH)
+        models_loaded = True
+        print(f"Models loaded in {time.perf_counter() - started:.1f}s")
+
+
+def _resolve_model_path():
+    """The registry's active version if one is set, else DEFECT_MODEL_PATH."""
+    version = registry.active_version()
+    path = registry.path(version) if version else None
+    if path and os.path.exists(path):
+        print(f"Serving defect model version {version} from the registry")
+        return path
+    return MODEL_PATH
+
+
+def _ensure_loaded():
+    if not models_loaded:
+        load_models()
+
+
+# Hot reload (see reload_defect_model). A new worker pool must report ready
+# within MODEL_RELOAD_TIMEOUT_SECONDS; the old one gets
+# MODEL_DRAIN_TIMEOUT_SECONDS to finish what it was given.
+MODEL_RELOAD_TIMEOUT = float(os.getenv("MODEL_RELOAD_TIMEOUT_SECONDS", "600"))
+MODEL_DRAIN_TIMEOUT = float(os.getenv("MODEL_DRAIN_TIMEOUT_SECONDS", "60"))
+reload_status = {"state": "idle"}
+_reload_lock = threading.Lock()
+
+
+def start_reload(version):
+    """
+    Starts loading registry version `version` in a background thread and
+    returns the reload status. Raises KeyError for an unknown version,
+    ValueError for an invalid version name and RuntimeError if a reload is
+    already running.
+    """
+    path = registry.path(version)
+    if path is None or not os.path.exists(path):
+        raise KeyError(version)
+    if not _reload_lock.acquire(blocking=False):
+        raise RuntimeError("A model reload is already in progress")
+    reload_status.clear()
+    reload_status.update({
+        "state": "loading",
+        "version": version,
+        "previous_version": MODEL_VERSION,
+        "started_at": time.time(),
+    })
+    threading.Thread(target=_reload, args=(version, path), name="model-reload", daemon=True).start()
+    return dict(reload_status)
+
+
+def _reload(version, path):
+    started = time.perf_counter()
+    try:
+        reload_defect_model(path)
+        registry.set_active(version)
+        reload_status.update({"state": "active", "seconds": round(time.perf_counter() - started, 1)})
+        print(f"Defect model version {version} is now serving")
+    except Exception as e:
+        reload_status.update({"state": "failed", "error": f"{type(e).__name__}: {e}"})
+        print(f"Reload of defect model version {version} failed: {e}; still serving {MODEL_VERSION}")
+    finally:
+        _reload_lock.release()
+
+
+def reload_defect_model(path):
+    """
+    Loads and warms up the defect model at path next to the one being served,
+    then switches traffic to it in one assignment. Requests already batched
+    on the old model finish on it; in multi-process mode a fresh worker pool
+    is started and the old pool is drained before it shuts down. Nothing is
+    swapped if loading fails, so the old model keeps serving.
+    """
+    global model, MODEL_BACKEND, MODEL_VERSION, MODEL_PATH, worker_pool, _served_defect
+    _ensure_loaded()
+    version = _file_fingerprint(path)
+
+    if worker_pool is not None:
+        if INFERENCE_BACKEND != "pytorch" and path.endswith(".pt"):
+            export_model(path, INFERENCE_BACKEND, INFERENCE_SIZE)
+        new_pool = InferenceWorkerPool(INFERENCE_WORKERS, max_batch_size=MAX_BATCH_SIZE, model_path=path)
+        deadline = time.monotonic() + MODEL_RELOAD_TIMEOUT
+        while not new_pool.is_ready():
+            if time.monotonic() > deadline:
+                new_pool.shutdown()
+                raise TimeoutError(f"New inference workers not ready after {MODEL_RELOAD_TIMEOUT:.0f}s")
+            time.sleep(0.5)
+        with _load_lock:
+            old_pool, worker_pool = worker_pool, new_pool
+            MODEL_PATH, MODEL_VERSION = path, version
+        left = old_pool.drain(MODEL_DRAIN_TIMEOUT)
+        if left:
+            print(f"{left} requests still pending on the old workers after {MODEL_DRAIN_TIMEOUT:.0f}s")
+        old_pool.shutdown()
+        return
+
+    new_model, backend = load_model(path, imgsz=INFERENCE_SIZE)
+    _warm_up_shapes("defect", functools.partial(predict_images, defect_model=new_model), version)
+    with _load_lock:
+        model, MODEL_BACKEND, MODEL_VERSION, MODEL_PATH = new_model, backend, version, path
+        _served_defect = (new_model, version)
+
+
+def _parse_sizes(value, default):
+    sizes = []
+    for part in (value or "").split(","):
+        part = part.strip()
+        if part:
+            try:
+                sizes.append(int(part))
+            except ValueError:
+                print(f"Ignoring invalid warm-up size {part!r}")
+    return sizes or default
+
+
+# Warm-up runs dummy batches through both models at every configured input
+# size and batch size, so PyTorch's first-use allocation and per-shape tuning
+# happen before /ready turns green instead of on a live request.
+WARMUP_SIZES = _parse_sizes(os.getenv("WARMUP_SIZES"), [INFERENCE_SIZE])
+WARMUP_BATCH_SIZES = _parse_sizes(os.getenv("WARMUP_BATCH_SIZES"), sorted({1, MAX_BATCH_SIZE}))
+warmup_timings = []
+
+
+def warm_up():
+    """
+    Runs dummy batches through both models for every (size, batch size) pair,
+    twice each: the first ("cold") run pays for allocation and tuning, the
+    second ("warm") shows steady state. Timings are logged with the model
+    versions and kept in warmup_timings for the readiness endpoint.
+    """
+    _ensure_loaded()
+    if worker_pool is not None:
+        # Each worker process warms itself up before reporting ready
+        return
+
+    started = time.perf_counter()
+    timings = _warm_up_shapes("defect", predict_images, MODEL_VERSION)
+    timings += _warm_up_shapes("vehicle", analyze_images, VEHICLE_MODEL_VERSION)
+    warmup_timings[:] = timings
+    print(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+
+
+def _warm_up_shapes(name, run, version):
+    """Times run(frames) cold and warm for every configured size and batch size."""
+    rng = np.random.default_rng(0)
+    timings = []
+    for size in WARMUP_SIZES:
+        try:
+            size = resolve_inference_size(size)
+        except ValueError as e:
+            print(f"Skipping warm-up size {size}: {e}")
+            continue
+        dummy = rng.integers(0, 255, size=(size, size, 3), dtype=np.uint8)
+        for batch_size in WARMUP_BATCH_SIZES:
+            entry = {"model": name, "version": version, "size": size, "batch": batch_size}
+            for phase in ("cold_ms", "warm_ms"):
+                # Fresh frames each run so no cached letterbox tensor is reused
+                frames = [DecodedFrame.from_array(dummy, inference_size=size) for _ in range(batch_size)]
+                t0 = time.perf_counter()
+                run(frames)
+                entry[phase] = round((time.perf_counter() - t0) * 1000, 1)
+            timings.append(entry)
+            print(
+                f"Warm-up {name} model {version} size={size} batch={batch_size}: "
+                f"cold {entry['cold_ms']} ms, warm {entry['warm_ms']} ms"
+            )
+    return timings
+
+
+def models_ready():
+    """True once inference can be served without loading anything first."""
+    if not models_loaded:
+        return False
+    return worker_pool.is_ready() if worker_pool is not None else True
+
+
+def readiness():
+    """Model status for the readiness probe."""
+    return {
+        "ready": models_ready(),
+        "models_loaded": models_loaded,
+        "defect_model": MODEL_PATH if (model is not None or worker_pool is not None) else None,
+        "defect_model_version": MODEL_VERSION,
+        "defect_backend": MODEL_BACKEND,
+        "vehicle_model_version": VEHICLE_MODEL_VERSION,
+        "vehicle_backend": VEHICLE_MODEL_BACKEND,
+        "worker_processes": INFERENCE_WORKERS if USE_WORKER_PROCESSES else 0,
+        "warmup": warmup_timings,
+        "reload": dict(reload_status),
+    }
@@ -0,0 +1,205 @@
+"""
+Accuracy comparison of a candidate defect model against the reference (FP32)
+model on a held-out image folder.
+
+If a YOLO-format labels folder is given (one <image stem>.txt per image with
+"class cx cy w h" rows, normalized), both models are scored against it and the
+candidate is judged on how much it drops. Without labels the reference model's
+own detections are used as ground truth, so the report measures how faithfully
+the candidate reproduces them.
+
+Usage:
+    python evaluate_model.py --candidate ../model/defect_model_int8.onnx --images ../data/holdout
+"""
+import argparse
+import json
+import os
+from backends import load_model
+from detect import predict_images, decode_image, INFERENCE_SIZE
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+IOU_THRESHOLD = 0.5
+
+
+def list_images(folder):
+    return sorted(
+        os.path.join(folder, name)
+        for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def collect_detections(defect_model, paths, inference_size=INFERENCE_SIZE, batch_size=8):
+    """Runs the model through the serving pipeline; returns {path: detections}."""
+    outputs = {}
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        frames = []
+        for path in chunk:
+            with open(path, "rb") as f:
+                frames.append(decode_image(f.read(), inference_size))
+        for path, detections in zip(chunk, predict_images(frames, defect_model=defect_model)):
+            outputs[path] = detections if isinstance(detections, list) else []
+    return outputs
+
+
+def load_labels(labels_dir, paths, names):
+    """Reads YOLO txt labels into the detection format (normalized boxes only)."""
+    labels = {}
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        label_path = os.path.join(labels_dir, f"{stem}.txt")
+        rows = []
+        if os.path.exists(label_path):
+            with open(label_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) < 5:
+                        continue
+                    cls, cx, cy, w, h = int(parts[0]), *map(float, parts[1:5])
+                    rows.append({
+                        "class": names[cls],
+                        "confidence": 1.0,
+                        "normalized_bbox": [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2],
+                    })
+        labels[path] = rows
+    return labels
+
+
+def box_iou(a, b):
+    """Intersection over union of two [x1, y1, x2, y2] boxes."""
+    ix1, iy1 = max(a[0], b[0]), max(a[1], b[1])
+    ix2, iy2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, ix2 - ix1) * max(0.0, iy2 - iy1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def score(predictions, ground_truth, class_names):
+    """
+    Per-class AP@0.5 (all-point interpolated) and recall of predictions against
+    ground truth, both given as {path: detections}. Returns a report dict.
+    """
+    per_class = {}
+    for cls in class_names:
+        gt_boxes = {
+            path: [d["normalized_bbox"] for d in dets if d["class"] == cls]
+            for path, dets in ground_truth.items()
+        }
+        total_gt = sum(len(boxes) for boxes in gt_boxes.values())
+        if total_gt == 0:
+            continue
+
+        ranked = sorted(
+            (
+                (d["confidence"], path, d["normalized_bbox"])
+                for path, dets in predictions.items()
+                for d in dets
+                if d["class"] == cls
+            ),
+            key=lambda item: -item[0],
+        )
+        matched = {path: [False] * len(boxes) for path, boxes in gt_boxes.items()}
+        tp, fp = [], []
+        for _conf, path, box in ranked:
+            best, best_iou = None, IOU_THRESHOLD
+            for j, gt in enumerate(gt_boxes.get(path, [])):
+                iou = box_iou(box, gt)
+                if iou >= best_iou and not matched[path][j]:
+                    best, best_iou = j, iou
+            if best is None:
+                tp.append(0)
+                fp.append(1)
+            else:
+                matched[path][best] = True
+                tp.append(1)
+                fp.append(0)
+
+        # Precision/recall curve and all-point interpolated AP
+        ap, cum_tp, cum_fp = 0.0, 0, 0
+        precisions, recalls = [], []
+        for t, f in zip(tp, fp):
+            cum_tp += t
+            cum_fp += f
+            precisions.append(cum_tp / (cum_tp + cum_fp))
+            recalls.append(cum_tp / total_gt)
+        for i in range(len(precisions) - 2, -1, -1):
+            precisions[i] = max(precisions[i], precisions[i + 1])
+        previous_recall = 0.0
+        for p, r in zip(precisions, recalls):
+            ap += (r - previous_recall) * p
+            previous_recall = r
+
+        per_class[cls] = {
+            "ap50": ap,
+            "recall": (cum_tp / total_gt) if total_gt else 0.0,
+            "ground_truth": total_gt,
+            "predictions": len(ranked),
+        }
+
+    m_ap = sum(c["ap50"] for c in per_class.values()) / len(per_class) if per_class else 0.0
+    return {"map50": m_ap, "per_class": per_class}
+
+
+def evaluate(reference_model, candidate_model, images_dir, labels_dir=None, inference_size=INFERENCE_SIZE):
+    paths = list_images(images_dir)
+    if not paths:
+        raise ValueError(f"No images found in {images_dir}")
+    class_names = list(reference_model.names.values())
+
+    reference = collect_detections(reference_model, paths, inference_size)
+    candidate = collect_detections(candidate_model, paths, inference_size)
+
+    if labels_dir:
+        ground_truth = load_labels(labels_dir, paths, reference_model.names)
+        reference_report = score(reference, ground_truth, class_names)
+    else:
+        # The reference reproduces itself perfectly by definition
+        ground_truth = reference
+        reference_report = score(reference, reference, class_names)
+
+    return {
+        "images": len(paths),
+        "ground_truth": "labels" if labels_dir else "reference_model",
+        "reference": reference_report,
+        "candidate": score(candidate, ground_truth, class_names),
+    }
+
+
+def passes_gate(report, max_map_drop=0.02, max_recall_drop=0.05):
+    """
+    The candidate may not lose more than max_map_drop mAP@0.5 overall or more
+    than max_recall_drop recall on any class. Returns (ok, reasons).
+    """
+    reasons = []
+    map_drop = report["reference"]["map50"] - report["candidate"]["map50"]
+    if map_drop > max_map_drop:
+        reasons.append(f"mAP50 dropped by {map_drop:.3f} (limit {max_map_drop})")
+
+    for cls, ref in report["reference"]["per_class"].items():
+        cand = report["candidate"]["per_class"].get(cls, {"recall": 0.0})
+        recall_drop = ref["recall"] - cand["recall"]
+        if recall_drop > max_recall_drop:
+            reasons.append(f"{cls} recall dropped by {recall_drop:.3f} (limit {max_recall_drop})")
+    return not reasons, reasons
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a candidate defect model with the reference model.")
+    parser.add_argument("--reference", default="../model/defect_model.pt")
+    parser.add_argument("--candidate", required=True)
+    parser.add_argument("--images", required=True, help="Held-out image folder")
+    parser.add_argument("--labels", default=None, help="Optional YOLO-format labels folder")
+    parser.add_argument("--imgsz", type=int, default=INFERENCE_SIZE)
+    parser.add_argument("--max-map-drop", type=float, default=0.02)
+    parser.add_argument("--max-recall-drop", type=float, default=0.05)
+    args = parser.parse_args()
+
+    reference_model, _ = load_model(args.reference, backend="pytorch", imgsz=args.imgsz)
+    candidate_model, _ = load_model(args.candidate, backend="pytorch", imgsz=args.imgsz)
+    report = evaluate(reference_model, candidate_model, args.images, args.labels, args.imgsz)
+    ok, reasons = passes_gate(report, args.max_map_drop, args.max_recall_drop)
+    report["passed"] = ok
+    report["reasons"] = reasons
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,120 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+# Retry-After (seconds) sent to clients when a pool is saturated
+RETRY_AFTER_SECONDS = int(os.getenv("POOL_RETRY_AFTER_SECONDS", "1"))
+
+
+class PoolSaturated(HTTPException):
+    """Raised when a pool's queue is full. FastAPI turns it into a 503 with Retry-After."""
+
+    def __init__(self, pool_name, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(
+            status_code=503,
+            detail={
+                "error": "Server Busy",
+                "message": "The server is handling too many requests. Please retry shortly.",
+                "pool": pool_name,
+            },
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+class BoundedExecutor:
+    """
+    A thread pool with a bounded backlog.
+
+    Async handlers use `await pool.run(fn, *args)` to move blocking work off
+    the event loop. At most max_workers jobs run at once and at most max_queue
+    more may wait; anything beyond that is rejected immediately with
+    PoolSaturated instead of piling up behind a slow job.
+    """
+
+    def __init__(self, name, max_workers, max_queue, retry_after=RETRY_AFTER_SECONDS):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.retry_after = retry_after
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-pool")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Returns a concurrent.futures.Future, or raises PoolSaturated if the backlog is full."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise PoolSaturated(self.name, self.retry_after)
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def is_busy(self):
+        """True once every worker is occupied and jobs have started to queue."""
+        return self.queue_depth() > 0
+
+    def queue_depth(self):
+        return max(0, self._pending - self.max_workers)
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._pending,
+            "queue_depth": self.queue_depth(),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+            if future is not None:
+                self.completed += 1
+
+
+# Model pool threads decode an upload and then wait on the batch schedulers
+# (see detect.py) for its results, one request each. With fewer threads than
+# INFERENCE_MAX_BATCH_SIZE a batch could never fill, and every batch would
+# wait out INFERENCE_MAX_WAIT_MS for requests that cannot arrive.
+MODEL_POOL_MIN_WORKERS = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+
+
+def _model_pool_workers():
+    workers = int(os.getenv("MODEL_POOL_WORKERS", str(max(os.cpu_count() or 2, MODEL_POOL_MIN_WORKERS))))
+    if workers < MODEL_POOL_MIN_WORKERS:
+        print(f"MODEL_POOL_WORKERS={workers} is below INFERENCE_MAX_BATCH_SIZE; using {MODEL_POOL_MIN_WORKERS}")
+        return MODEL_POOL_MIN_WORKERS
+    return workers
+
+
+# Model work (decode, preprocessing, inference) and I/O (Firestore, disk, PDF)
+# get separate pools so a burst of one cannot starve the other.
+model_pool = BoundedExecutor(
+    "model",
+    max_workers=_model_pool_workers(),
+    max_queue=int(os.getenv("MODEL_POOL_QUEUE", "32")),
+)
+io_pool = BoundedExecutor(
+    "io",
+    max_workers=int(os.getenv("IO_POOL_WORKERS", "16")),
+    max_queue=int(os.getenv("IO_POOL_QUEUE", "128")),
+)
@@ -1,6 +1,7 @@
 import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import os
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -36,21 +37,44 @@ def initialize_firebase():
         traceback.print_exc()
         return False
 
-firebase_initialized = initialize_firebase()
+# Firebase Admin and the Firestore client are created on first use (get_db /
+# ensure_firebase, or main.py's lifespan hook), not at import, so scripts and
+# tests that never touch Firestore don't pay for credential and network setup.
+_init_lock = threading.Lock()
+_firebase_initialized = None
+_db = None
 
-# Only initialize Firestore client if Firebase is properly initialized
-if firebase_initialized:
-    try:
-        db = firestore.client()
-        print("Firestore client initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing Firestore client: {e}")
-        import traceback
-        traceback.print_exc()
-        db = None
-else:
-    print("Firestore client not initialized - Firebase Admin setup failed.")
-    db = None
+def ensure_firebase():
+    """Initializes Firebase Admin once; returns whether it succeeded."""
+    global _firebase_initialized
+    if _firebase_initialized is None:
+        with _init_lock:
+            if _firebase_initialized is None:
+                _firebase_initialized = initialize_firebase()
+    return _firebase_initialized
+
+def get_db():
+    """Returns the Firestore client, creating it on first call (None if setup failed)."""
+    global _db
+    if _db is None and ensure_firebase():
+        with _init_lock:
+            if _db is None:
+                try:
+                    _db = firestore.client()
+                    print("Firestore client initialized successfully.")
+                except Exception as e:
+                    print(f"Error initializing Firestore client: {e}")
+                    import traceback
+                    traceback.print_exc()
+    return _db
+
+def __getattr__(name):
+    # Keeps `from firebase_config import db` working for the maintenance scripts
+    if name == "db":
+        return get_db()
+    if name == "firebase_initialized":
+        return ensure_firebase()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 try:
     from firebase_admin import storage
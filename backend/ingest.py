@@ -0,0 +1,255 @@
+import hashlib
+import os
+import uuid
+from io import BytesIO
+
+import aiofiles
+from fastapi import HTTPException
+from PIL import Image
+
+# Upload limits. A body is rejected as soon as it crosses MAX_UPLOAD_BYTES or
+# its header declares more than MAX_IMAGE_PIXELS, without reading the rest.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Image dimensions are read from at most this many leading bytes (JPEG EXIF
+# blocks can push the frame header well past the first few KB)
+HEADER_PROBE_BYTES = 512 * 1024
+PART_SUFFIX = ".part"
+
+# Formats OpenCV can decode, by their leading bytes
+_MAGIC = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"BM", "bmp"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+)
+
+
+def sniff_format(head):
+    """Image format from the first bytes, or None if it is not one we can decode."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, name in _MAGIC:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def _header_dimensions(head):
+    """
+    (width, height) parsed from a partial file, or None if the header isn't
+    complete yet. Pillow's own bomb check (DecompressionBombError) is left to
+    propagate: it means the image is far too large, not that the header is short.
+    """
+    try:
+        # Image.open only parses the header; no pixels are decoded
+        with Image.open(BytesIO(head)) as header:
+            return header.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+
+def _too_many_pixels(detail):
+    return HTTPException(status_code=413, detail=detail)
+
+
+class IngestedUpload:
+    """
+    One upload read by ingest_upload: its hash, size, format and dimensions,
+    plus the bytes (keep_contents) and/or a spooled file on disk (spool_dir).
+    A spooled file is moved into place with commit() or removed with discard().
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.basename(filename or "upload")
+        self.sha256 = None
+        self.size = 0
+        self.format = None
+        self.width = None
+        self.height = None
+        self.contents = None
+        self.path = None
+
+    async def read(self):
+        """The upload's bytes, from memory or the spooled file."""
+        if self.contents is not None:
+            return self.contents
+        async with aiofiles.open(self.path, "rb") as f:
+            return await f.read()
+
+    def commit(self, final_path):
+        os.replace(self.path, final_path)
+        self.path = final_path
+        return final_path
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+async def ingest_upload(file, keep_contents=True, spool_dir=None,
+                        max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS):
+    """
+    Reads an UploadFile in UPLOAD_CHUNK_BYTES chunks, hashing it on the fly.
+    The format is sniffed from the first chunk (415 if not a decodable image)
+    and the dimensions from the header (413 above max_pixels, or if the
+    header does not give them within HEADER_PROBE_BYTES); the body is
+    abandoned as soon as it exceeds max_bytes (413). With spool_dir each
+    chunk is appended to a temporary file there as it arrives; keep_contents
+    also keeps the bytes in memory for inference.
+    """
+    upload = IngestedUpload(file.filename)
+    digest = hashlib.sha256()
+    head = b""
+    chunks = [] if keep_contents else None
+    out = None
+    if spool_dir:
+        upload.path = os.path.join(spool_dir, f".{uuid.uuid4().hex}{PART_SUFFIX}")
+        out = await aiofiles.open(upload.path, "wb")
+
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            upload.size += len(chunk)
+            if upload.size > max_bytes:
+                raise HTTPException(
+                    status_code=413, detail=f"File is larger than {max_bytes // (1024 * 1024)} MB"
+                )
+
+            if upload.width is None and len(head) < HEADER_PROBE_BYTES:
+                head += chunk[:HEADER_PROBE_BYTES - len(head)]
+                if upload.format is None and len(head) >= 12:
+                    upload.format = sniff_format(head)
+                    if upload.format is None:
+                        raise HTTPException(status_code=415, detail="File must be a JPEG, PNG, WebP, BMP or TIFF image")
+                try:
+                    dimensions = _header_dimensions(head)
+                except Image.DecompressionBombError:
+                    raise _too_many_pixels(f"Image is larger than the limit of {max_pixels} pixels")
+                if dimensions is not None:
+                    upload.width, upload.height = dimensions
+                    if upload.width * upload.height > max_pixels:
+                        raise _too_many_pixels(
+                            f"Image is {upload.width}x{upload.height}; the limit is {max_pixels} pixels"
+                        )
+
+            digest.update(chunk)
+            if out is not None:
+                await out.write(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+
+        if upload.size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+        if upload.format is None:
+            upload.format = sniff_format(head)
+            if upload.format is None:
+                raise HTTPException(status_code=415, detail="File must be a JPEG, PNG, WebP, BMP or TIFF image")
+        if upload.width is None:
+            # Without dimensions the pixel limit can't be enforced, so don't let it through
+            raise _too_many_pixels(
+                f"Image dimensions must be readable from its first {HEADER_PROBE_BYTES // 1024} KB"
+            )
+    except BaseException:
+        if out is not None:
+            await out.close()
+            out = None
+        upload.discard()
+        raise
+    finally:
+        if out is not None:
+            await out.close()
+
+    upload.sha256 = digest.hexdigest()
+    if chunks is not None:
+        upload.contents = b"".join(chunks)
+    return upload
+
+
+def remove_partial_uploads(directory):
+    """Deletes spool files ingest_upload left behind (e.g. when the process was killed mid-upload)."""
+    for name in os.listdir(directory):
+        if name.startswith(".") and name.endswith(PART_SUFFIX):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware that answers 413 for request bodies over the limit before
+    they are parsed: from Content-Length when the client sends one, otherwise
+    as soon as the streamed body crosses it. limits maps path prefixes to
+    byte limits; other requests get default_limit.
+    """
+
+    def __init__(self, app, default_limit, limits=None):
+        self.app = app
+        self.default_limit = default_limit
+        self.limits = sorted((limits or {}).items(), key=lambda item: -len(item[0]))
+
+    def _limit_for(self, path):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return self.default_limit
+
+    async def _reject(self, send, limit):
+        body = f'{{"detail":"Request body is larger than {limit} bytes"}}'.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+
+        limit = self._limit_for(scope["path"])
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        state = {"too_large": False, "rejected": False}
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    state["too_large"] = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            if not state["too_large"]:
+                return await send(message)
+            # The body parser turns our exception into its own error response;
+            # answer with the 413 instead
+            if message["type"] == "http.response.start" and not state["rejected"]:
+                state["rejected"] = True
+                await self._reject(send, limit)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            if not state["rejected"]:
+                state["rejected"] = True
+                await self._reject(send, limit)
+
+
+class _BodyTooLarge(Exception):
+    pass
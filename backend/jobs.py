@@ -0,0 +1,285 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+# Bulk / offline inspections. Jobs and their images live in a SQLite file so
+# queued work survives restarts; JobRunner threads drain it at a fixed
+# concurrency. Uploaded images are kept under JOB_DIR/inputs/<job id>/.
+JOB_DIR = os.getenv("JOB_DIR", "jobs")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", os.path.join(JOB_DIR, "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+
+# Lower value = served first. Interactive jobs are small ones a user is
+# waiting on; bulk jobs are yard audits and folder imports.
+LANES = {"interactive": 0, "bulk": 1}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT,
+    lane TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    source TEXT,
+    inference_size INTEGER,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status, job_id, idx);
+"""
+
+# Job status: queued -> running -> done, or cancelled at any point before done.
+# Item status: queued -> running -> done | failed, or queued -> cancelled.
+
+
+class JobStore:
+    """SQLite persistence for jobs and their per-image items."""
+
+    def __init__(self, path=JOB_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(_SCHEMA)
+
+    def requeue_interrupted(self):
+        """
+        Puts items a previous process was working on when it stopped back in
+        the queue. Only the process that runs the jobs may call this (see
+        JobRunner.start), or items still being worked on would run twice.
+        """
+        with closing(self._connect()) as conn:
+            return conn.execute("UPDATE job_items SET status = 'queued' WHERE status = 'running'").rowcount
+
+    def _connect(self):
+        # Autocommit; multi-statement updates open their own transaction
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, user_id, items, lane="bulk", source=None, inference_size=None, job_id=None):
+        """items is a list of (filename, path). Returns the job id."""
+        job_id = job_id or new_job_id()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, lane, priority, status, source, inference_size, total, created_at)"
+                " VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, user_id, lane, LANES[lane], source, inference_size, len(items), time.time()),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, path, filename, status) VALUES (?, ?, ?, ?, 'queued')",
+                [(job_id, i, path, filename) for i, (filename, path) in enumerate(items)],
+            )
+            conn.execute("COMMIT")
+        return job_id
+
+    def claim(self, lanes):
+        """
+        Atomically takes the next queued item from the given lanes: highest
+        priority lane first, then oldest job, then image order. Returns a dict
+        or None when there is nothing to do.
+        """
+        placeholders = ",".join("?" for _ in lanes)
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT i.job_id, i.idx, i.path, i.filename, j.inference_size FROM job_items i"
+                " JOIN jobs j ON j.id = i.job_id"
+                f" WHERE i.status = 'queued' AND j.status IN ('queued', 'running') AND j.lane IN ({placeholders})"
+                " ORDER BY j.priority, j.created_at, i.idx LIMIT 1",
+                list(lanes),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE job_items SET status = 'running' WHERE job_id = ? AND idx = ?",
+                (row["job_id"], row["idx"]),
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?)"
+                " WHERE id = ? AND status = 'queued'",
+                (time.time(), row["job_id"]),
+            )
+            conn.execute("COMMIT")
+        return dict(row)
+
+    def finish_item(self, job_id, idx, result=None, error=None):
+        status = "failed" if error is not None else "done"
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            updated = conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ? WHERE job_id = ? AND idx = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, job_id, idx),
+            ).rowcount
+            if updated:
+                counter = "failed" if error is not None else "completed"
+                conn.execute(f"UPDATE jobs SET {counter} = {counter} + 1 WHERE id = ?", (job_id,))
+                conn.execute(
+                    "UPDATE jobs SET status = 'done', finished_at = ?"
+                    " WHERE id = ? AND status = 'running' AND completed + failed >= total",
+                    (time.time(), job_id),
+                )
+            conn.execute("COMMIT")
+
+    def cancel(self, job_id):
+        """
+        Cancels a job's queued items; items already running still finish.
+        Returns how many are still running.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (time.time(), job_id),
+            )
+            conn.execute("UPDATE job_items SET status = 'cancelled' WHERE job_id = ? AND status = 'queued'", (job_id,))
+            running = conn.execute(
+                "SELECT COUNT(*) FROM job_items WHERE job_id = ? AND status = 'running'", (job_id,)
+            ).fetchone()[0]
+            conn.execute("COMMIT")
+        return running
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def items(self, job_id, offset=0, limit=100):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT idx, filename, status, result, error FROM job_items WHERE job_id = ?"
+                " ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return [
+            {
+                "index": row["idx"],
+                "filename": row["filename"],
+                "status": row["status"],
+                "result": json.loads(row["result"]) if row["result"] else None,
+                "error": row["error"],
+            }
+            for row in rows
+        ]
+
+    def queue_depth(self):
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT j.lane, COUNT(*) FROM job_items i JOIN jobs j ON j.id = i.job_id"
+                " WHERE i.status = 'queued' AND j.status IN ('queued', 'running') GROUP BY j.lane"
+            ).fetchall()
+        return {lane: count for lane, count in rows}
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def job_input_dir(job_id):
+    return os.path.join(JOB_DIR, "inputs", job_id)
+
+
+def remove_job_inputs(job_id):
+    shutil.rmtree(job_input_dir(job_id), ignore_errors=True)
+
+
+class JobRunner:
+    """
+    Drains a JobStore with a fixed number of threads.
+
+    process(path, inference_size) runs one image and returns a JSON-safe
+    result; exceptions mark the item failed. While interactive_busy() is true
+    (the /predict path has work queued) the runners only take items from the
+    interactive lane, so bulk jobs soak up idle capacity instead of
+    competing with users.
+    """
+
+    def __init__(self, store, process, interactive_busy, workers=JOB_WORKERS, poll_seconds=JOB_POLL_SECONDS):
+        self.store = store
+        self.process = process
+        self.interactive_busy = interactive_busy
+        self.workers = max(1, workers)
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+
+        self.processed = 0
+        self.failed = 0
+        self.bulk_deferrals = 0
+
+    def start(self):
+        requeued = self.store.requeue_interrupted()
+        if requeued:
+            print(f"Requeued {requeued} job item(s) interrupted by the last shutdown.")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"job-runner-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wakes idle runners after a job is submitted."""
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            lanes = tuple(LANES)
+            if self.interactive_busy():
+                lanes = ("interactive",)
+                self.bulk_deferrals += 1
+            try:
+                item = self.store.claim(lanes)
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                item = None
+            if item is None:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+                continue
+
+            try:
+                result = self.process(item["path"], item["inference_size"])
+                self.store.finish_item(item["job_id"], item["idx"], result=result)
+                self.processed += 1
+            except Exception as e:
+                self.store.finish_item(item["job_id"], item["idx"], error=f"{type(e).__name__}: {e}")
+                self.failed += 1
+
+            # Uploaded inputs are only needed until their job stops
+            job = self.store.get(item["job_id"])
+            if job and job["status"] in ("done", "cancelled") and job["source"] == "upload":
+                remove_job_inputs(item["job_id"])
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "bulk_deferrals": self.bulk_deferrals,
+            "queued": self.store.queue_depth(),
+        }
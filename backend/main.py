@@ -1,16 +1,43 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import File, UploadFile, HTTPException, Form, Header, Query
-from detect import predict_image, analyze_image_content
+from fastapi.responses import JSONResponse, StreamingResponse, RedirectResponse, Response
+from fastapi import File, UploadFile, HTTPException, Form, Header, Query, WebSocket, WebSocketDisconnect
+import detect
+from detect import decode_image, inspect_image, inference_signature, resolve_inference_size, defect_scheduler, vehicle_scheduler
+from executor import model_pool, io_pool
+from cache import TTLCache, InferenceCache
+from tracking import StreamTracker, STREAM_TRACKING, STREAM_KEYFRAME_INTERVAL, STREAM_CHANGE_THRESHOLD
+from registry import registry
+from shadow import shadow
+from tiling import TILED_INFERENCE
+from jobs import JobStore, JobRunner, LANES, new_job_id, job_input_dir, remove_job_inputs
+from evaluate_model import list_images
+from ingest import ingest_upload, remove_partial_uploads, UploadSizeLimit, MAX_UPLOAD_BYTES
+from blobstore import BlobStore, BLOB_PREFIX, blob_key, is_blob_key
+from objectstore import object_storage, resolve_url, sign_url, url_signature_valid, LOCAL_STORAGE_DIR, PUBLIC_API_URL, STORAGE_ROUTE
+from derivatives import VARIANTS, DERIVATIVES_ROUTE, derivative_key, derived_keys, derivative_urls, render_derivatives, store_derivatives
+from annotated import annotated_images, annotated_key
+import tempfile
+import shutil
 import uvicorn
+import os
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+import functools
+import time
 import json
-from firebase_config import db, storage
+from firebase_config import get_db, ensure_firebase
 from datetime import datetime
 import uuid
+import hashlib
+import secrets
 import logging
 from google.api_core import exceptions as google_exceptions
 from firebase_admin import auth as admin_auth
 
+# Blocking (Firebase initialisation and token verification); async handlers
+# call it through io_pool so it stays off the event loop.
 def _require_user_from_bearer(authorization: str | None):
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(
@@ -21,6 +48,7 @@ def _require_user_from_bearer(authorization: str | None):
             },
         )
     token = authorization.split(" ", 1)[1].strip()
+    ensure_firebase()
     if not token:
         raise HTTPException(
             status_code=401,
@@ -46,6 +74,71 @@ def _require_user_from_bearer(authorization: str | None):
             },
         )
 
+# Model admin endpoints (registry, hot reload) are deployment-wide, so they are
+# guarded by a shared secret rather than a company admin role. Unset = disabled.
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+
+def _require_model_admin(x_admin_token: str | None):
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model admin endpoints are disabled (MODEL_ADMIN_TOKEN not set)")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Repeat submissions of the same bytes (retries, re-submits, a still camera)
+# are answered from here without decoding or running either model.
+inference_cache = InferenceCache(
+    max_entries=int(os.getenv("INFERENCE_CACHE_ENTRIES", "1024")),
+    ttl_seconds=int(os.getenv("INFERENCE_CACHE_TTL_SECONDS", "3600")),
+    disk_dir=os.getenv("INFERENCE_CACHE_DIR") or None,
+)
+
+def _run_models(contents, content_hash=None, inference_size=None, shadow_sample=False, tiled=None):
+    """
+    Decodes an upload once and runs the defect model plus, unless the cascade
+    skips it, the vehicle gate. Runs on the model pool.
+    With shadow_sample, a fresh (uncached) result may also be handed to the
+    shadow evaluator, which runs the candidate model on its own thread.
+    tiled selects sliced inference for large images (default TILED_INFERENCE).
+    Returns the inspect_image dict, or None if the bytes are not an image.
+    """
+    tiled = TILED_INFERENCE if tiled is None else tiled
+    content_hash = content_hash or hashlib.sha256(contents).hexdigest()
+    cache_key = InferenceCache.key(content_hash, inference_signature(inference_size, tiled))
+    cached = inference_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Tiles need every source pixel, so tiled mode skips the reduced JPEG decode
+    frame = decode_image(contents, inference_size, full_resolution=tiled)
+    if frame.image is None:
+        return None
+    inspection = inspect_image(frame, tiled=tiled)
+    if "error" not in inspection["detections"]:
+        inference_cache.set(cache_key, inspection)
+        # The candidate runs untiled, so only untiled results are comparable
+        if shadow_sample and not tiled:
+            busy = model_pool.is_busy() or defect_scheduler.queue_depth() > 0
+            shadow.maybe_submit(frame, inspection, content_hash, busy)
+    return inspection
+
+# Server-computed /predict results, handed back to /save_scan by a short-lived
+# token so the save neither re-runs the models nor trusts client detections.
+scan_tokens = TTLCache(
+    max_entries=int(os.getenv("SCAN_TOKEN_MAX_ENTRIES", "2048")),
+    ttl_seconds=int(os.getenv("SCAN_TOKEN_TTL_SECONDS", "600")),
+)
+
+def _inference_size_or_400(imgsz):
+    try:
+        return resolve_inference_size(imgsz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _issue_scan_token(content_hash, inspection):
+    token = secrets.token_urlsafe(16)
+    scan_tokens.set(token, {"content_hash": content_hash, **inspection})
+    return token
+
 def _json_safe(value):
     if isinstance(value, datetime):
         return value.isoformat()
@@ -61,18 +154,146 @@ logger = logging.getLogger(__name__)
 
 
 from fastapi.staticfiles import StaticFiles
-import os
 
 # Create uploads directory
-UPLOAD_DIR = "uploads"
+# Local storage backend directory, also used to spool incoming uploads
+UPLOAD_DIR = LOCAL_STORAGE_DIR
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
-app = FastAPI(title="Car Defect Detection API", version="1.0.0")
+# Images go to the configured storage backend (see objectstore.py). Scan
+# images are stored once per content hash (see blobstore.py) and
+# reference-counted by the history records that use them.
+blob_store = BlobStore(object_storage, companions=derived_keys)
+
+def _blob_key(url):
+    """Blob key of an image URL, or None for legacy per-upload files and other URLs."""
+    key = object_storage.key_for_url(url)
+    return key if key and key.startswith(f"{BLOB_PREFIX}/") else None
+
+def _store_scan_image(upload, ref):
+    """
+    Puts an ingested scan image in the blob store, referenced by ref, with
+    its thumbnail and medium derivatives. Returns (key, {"<variant>_url": url}).
+    Runs on the I/O pool.
+    """
+    key = blob_key(upload.sha256, upload.format)
+    thumbnail = derivative_key(key, "thumbnail")
+    # A re-uploaded image already has its derivatives. Otherwise they are
+    # rendered while the upload is still at hand, but only written once ref
+    # holds the blob: written earlier, a concurrent release of the blob's
+    # last other reference could delete them (and the blob) in between.
+    rendered = None
+    if not object_storage.exists(thumbnail):
+        try:
+            rendered = render_derivatives(upload.path or upload.contents)
+        except Exception as e:
+            logger.warning(f"Could not render derivatives for {key}: {e}")
+    if upload.contents is not None:
+        blob_store.put_bytes(upload.contents, upload.sha256, upload.format, ref)
+    else:
+        blob_store.put_file(upload.path, upload.sha256, upload.format, ref)
+        upload.path = None
+
+    # With no URLs, history views fall back to the lazy /api/v1/derivatives route
+    if rendered is not None:
+        try:
+            return key, store_derivatives(object_storage, key, rendered)
+        except Exception as e:
+            logger.warning(f"Could not store derivatives for {key}: {e}")
+            return key, {}
+    # Existing derivatives may have gone with the blob's last other record before the put
+    return key, derivative_urls(object_storage, key) if object_storage.exists(thumbnail) else {}
+
+DERIVATIVE_URL_FIELDS = tuple(f"{variant}_url" for variant in VARIANTS)
+
+IMAGE_URL_FIELDS = ("image_url", *DERIVATIVE_URL_FIELDS)
+
+def _with_signed_urls(item):
+    """Signs a history item's API-served image URLs (see objectstore.sign_url) before it goes to the client."""
+    for image in [item, *(item.get("images") or [])]:
+        for field in IMAGE_URL_FIELDS:
+            if image.get(field):
+                image[field] = sign_url(image[field])
+    if item.get("image_urls"):
+        item["image_urls"] = [sign_url(url) for url in item["image_urls"]]
+    return item
+
+def _with_derivative_urls(item):
+    """
+    Adds lazily rendered derivative URLs to a history item saved without
+    them. Only blob-store images get them; older per-upload files are shown
+    at full size.
+    """
+    if all(field in item for field in DERIVATIVE_URL_FIELDS):
+        return item
+    key = _blob_key(item.get("image_url"))
+    if key is not None:
+        for variant in VARIANTS:
+            item[f"{variant}_url"] = f"{PUBLIC_API_URL}{DERIVATIVES_ROUTE}{variant}/{key}"
+    return item
+
+# Images per request. Every write of one multi-angle inspection goes into a
+# single Firestore batch, so its cap keeps it under the 500-write limit.
+MAX_INSPECTION_IMAGES = int(os.getenv("MAX_INSPECTION_IMAGES", "30"))
+MAX_JOB_IMAGES = int(os.getenv("MAX_JOB_IMAGES", "5000"))
+# Total body size of an uploaded job; larger audits go through JOB_IMPORT_ROOT
+# folder imports rather than one multi-gigabyte request
+MAX_JOB_UPLOAD_BYTES = int(os.getenv("MAX_JOB_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+# Multipart boundaries and form fields on top of the image bytes themselves
+UPLOAD_FORM_OVERHEAD = 1024 * 1024
+# Model weights uploaded through the admin endpoint are not images
+MAX_MODEL_UPLOAD_BYTES = int(os.getenv("MAX_MODEL_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+
+# Startup work happens in a background thread so the server binds (and /health
+# answers) immediately; /ready turns green once the models are loaded.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "true").lower() in ("1", "true", "yes")
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "true").lower() in ("1", "true", "yes")
+
+_startup_done = threading.Event()
+
+def _startup():
+    try:
+        detect.load_models()
+        if WARMUP_ON_START:
+            detect.warm_up()
+    except Exception as e:
+        logger.error(f"Model startup failed: {e}", exc_info=True)
+    get_db()
+    _startup_done.set()
+
+# Recovery from an unclean stop (spool files, interrupted job items) happens in
+# the lifespan rather than at import: spawned processes (inference workers,
+# uvicorn's reloader) re-import this module and must not touch live state.
+@asynccontextmanager
+async def lifespan(app):
+    # Uploads still being spooled when the previous process stopped
+    remove_partial_uploads(UPLOAD_DIR)
+    if PRELOAD_MODELS:
+        threading.Thread(target=_startup, name="startup", daemon=True).start()
+    job_runner.start()
+    yield
+    job_runner.stop()
+    if detect.worker_pool is not None:
+        detect.worker_pool.shutdown()
+
+app = FastAPI(title="Car Defect Detection API", version="1.0.0", lifespan=lifespan)
 
 # Mount uploads directory to serve static files
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
+# Bodies over the upload limit are refused before they are parsed; inspections
+# carry several images, so they get a multiple of it, and jobs their own cap
+app.add_middleware(
+    UploadSizeLimit,
+    default_limit=MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+    limits={
+        "/api/v1/inspections": MAX_INSPECTION_IMAGES * MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+        "/api/v1/jobs": MAX_JOB_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+        "/api/v1/admin/models": MAX_MODEL_UPLOAD_BYTES,
+    },
+)
+
 # CORS Configuration
 # For local development we allow all origins to avoid CORS/preflight "Failed to fetch"
 # (especially when using Authorization headers).
@@ -93,18 +314,45 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
-@app.post("/api/v1/predict")
-async def predict(file: UploadFile = File(...)):
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="File must be an image")
-    
-    contents = await file.read()
-    
-    # Analyze image content
-    analysis = analyze_image_content(contents)
-    
-    # Run defect detection
-    detections = predict_image(contents)
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until the models are loaded (and warmed up, if enabled)."""
+    status = detect.readiness()
+    if PRELOAD_MODELS and not _startup_done.is_set():
+        status["ready"] = False
+    status["firestore"] = get_db() is not None if status["ready"] else None
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/metrics")
+def metrics():
+    """
+    Queue depth and throughput counters for the worker pools and batch schedulers.
+    A plain def: the job and blob counters are SQLite reads, and FastAPI runs
+    sync routes on its own thread pool, which stays free when io_pool is saturated.
+    """
+    return {
+        "pools": [model_pool.stats(), io_pool.stats()],
+        "schedulers": [defect_scheduler.stats(), vehicle_scheduler.stats()],
+        "workers": detect.worker_pool.stats() if detect.worker_pool is not None else None,
+        "scan_tokens": scan_tokens.stats(),
+        "inference_cache": inference_cache.stats(),
+        "shadow": shadow.stats(),
+        "jobs": job_runner.stats(),
+        "blobs": blob_store.stats(),
+        "storage": object_storage.stats(),
+        "annotated_images": annotated_images.stats(),
+    }
+
+def _validate_inspection(inspection):
+    """
+    Applies the /predict acceptance rules to an inspect_image result.
+    Returns the detections, or raises HTTPException if the image is rejected.
+    """
+    detections = inspection["detections"]
+    # None when the cascade skipped the vehicle gate (confident defects found)
+    analysis = inspection["analysis"]
     
     has_defects = len(detections) > 0 and "error" not in detections
 
@@ -135,19 +383,234 @@ async def predict(file: UploadFile = File(...)):
     
     if "error" in detections:
         raise HTTPException(status_code=500, detail=detections["error"])
+
+    return detections
+
+@app.post("/api/v1/predict")
+async def predict(
+    file: UploadFile = File(...),
+    imgsz: int | None = Query(default=None), # Inference resolution; defaults to INFERENCE_SIZE
+    tiled: bool | None = Query(default=None), # Sliced inference for large images; defaults to TILED_INFERENCE
+):
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    inference_size = _inference_size_or_400(imgsz)
+    
+    # Streamed in chunks: hashed as it arrives, rejected early if too large or not an image
+    upload = await ingest_upload(file)
+
+    # Decode once and run both models off the event loop; the decoded frame and
+    # its letterboxed tensor are shared, and concurrent requests share batches.
+    # Raises 503 with Retry-After when the model pool's queue is full.
+    content_hash = upload.sha256
+    inspection = await model_pool.run(
+        _run_models, upload.contents, content_hash, inference_size, shadow_sample=True, tiled=tiled
+    )
+    if inspection is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    detections = _validate_inspection(inspection)
         
-    return {"detections": detections}
+    scan_token = _issue_scan_token(content_hash, inspection)
+    return {
+        "detections": detections,
+        "stages": inspection["stages"],
+        "model_version": inspection.get("model_version"),
+        "scan_token": scan_token,
+    }
+
+def _register_weights(src, filename, notes):
+    """
+    Copies an uploaded weights file (a file object) to disk under its own
+    name, without reading it into memory, and registers it. Blocking.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="model-upload-")
+    path = os.path.join(tmp_dir, filename)
+    try:
+        with open(path, "wb") as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+        if os.path.getsize(path) == 0:
+            raise HTTPException(status_code=400, detail="Empty model file")
+        return registry.register(path, notes)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+@app.get("/api/v1/admin/models")
+async def list_models(x_admin_token: str | None = Header(default=None)):
+    """Registered defect model versions, the one being served and the last reload."""
+    _require_model_admin(x_admin_token)
+    versions = await io_pool.run(registry.versions)
+    return {
+        "serving": detect.MODEL_VERSION,
+        "registry_active": await io_pool.run(registry.active_version),
+        "versions": versions,
+        "reload": dict(detect.reload_status),
+    }
+
+@app.post("/api/v1/admin/models")
+async def register_model(
+    file: UploadFile = File(...),
+    notes: str = Form(""),
+    x_admin_token: str | None = Header(default=None),
+):
+    """Uploads a weights file (.pt or exported graph) into the registry without serving it."""
+    _require_model_admin(x_admin_token)
+    # The registry keeps the uploaded filename, minus any client-supplied path
+    filename = os.path.basename(file.filename or "")
+    if filename in ("", ".", ".."):
+        filename = "defect_model.pt"
+    manifest = await io_pool.run(_register_weights, file.file, filename, notes)
+    return manifest
+
+@app.post("/api/v1/admin/models/{version}/activate", status_code=202)
+async def activate_model(version: str, x_admin_token: str | None = Header(default=None)):
+    """
+    Loads a registered version in the background and switches traffic to it
+    once it is warm. Poll GET /api/v1/admin/models for the reload state.
+    """
+    _require_model_admin(x_admin_token)
+    try:
+        return detect.start_reload(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model version {version}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/api/v1/admin/shadow")
+async def shadow_summary(
+    since: float | None = Query(default=None), # Unix time; only samples recorded after it
+    x_admin_token: str | None = Header(default=None),
+):
+    """Agreement, latency and confidence comparison of the shadow candidate against the served model."""
+    _require_model_admin(x_admin_token)
+    return await io_pool.run(shadow.summary, since)
+
+@app.post("/api/v1/admin/shadow")
+async def configure_shadow(
+    version: str | None = Query(default=None), # Registry version to shadow
+    sample_rate: float | None = Query(default=None, ge=0.0, le=1.0), # 0 turns shadowing off
+    x_admin_token: str | None = Header(default=None),
+):
+    """Changes the shadow candidate and/or sample rate without a restart."""
+    _require_model_admin(x_admin_token)
+    try:
+        # Looks the version up in the registry on disk
+        await io_pool.run(shadow.configure, sample_rate=sample_rate, version=version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model version {version}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return shadow.stats()
+
+@app.websocket("/api/v1/ws/predict")
+async def predict_stream(websocket: WebSocket):
+    """
+    Live camera stream. The client sends JPEG frames as binary messages and gets
+    one JSON message per processed frame: {"seq", "detections", "stages",
+    "dropped", "latency_ms"}, or {"seq", "error", "status_code"} when a frame is
+    rejected. While a frame is being inferred only the newest incoming frame is
+    kept; older ones are dropped so latency stays bounded when we fall behind.
+
+    With tracking on, only keyframes run the models and the frames in between
+    reuse the keyframe's detections shifted by the measured camera motion.
+    The keyframe_interval and change_threshold query parameters override the
+    deployment defaults, and tracking=false turns it off for the connection.
+    imgsz selects the inference resolution as on /predict.
+    """
+    await websocket.accept()
+
+    params = websocket.query_params
+    try:
+        inference_size = resolve_inference_size(params.get("imgsz"))
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+    # Live frames are never tiled; sliced inference costs several forward passes
+    run_models = functools.partial(_run_models, inference_size=inference_size, tiled=False)
+    tracker = None
+    if params.get("tracking", str(STREAM_TRACKING)).lower() in ("1", "true", "yes"):
+        try:
+            tracker = StreamTracker(
+                keyframe_interval=int(params.get("keyframe_interval", STREAM_KEYFRAME_INTERVAL)),
+                change_threshold=float(params.get("change_threshold", STREAM_CHANGE_THRESHOLD)),
+            )
+        except ValueError:
+            tracker = StreamTracker()
+
+    latest = {"contents": None, "seq": 0}
+    frame_ready = asyncio.Event()
+    state = {"closed": False, "dropped": 0}
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                data = message.get("bytes")
+                if not data:
+                    continue
+                if latest["contents"] is not None:
+                    state["dropped"] += 1
+                latest["seq"] += 1
+                latest["contents"] = data
+                frame_ready.set()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            state["closed"] = True
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if state["closed"]:
+                break
+            contents, seq = latest["contents"], latest["seq"]
+            latest["contents"] = None
+            if contents is None:
+                continue
+
+            started = time.perf_counter()
+            try:
+                if tracker is not None:
+                    inspection = await model_pool.run(tracker.step, contents, run_models)
+                else:
+                    inspection = await model_pool.run(run_models, contents)
+                if inspection is None:
+                    raise HTTPException(status_code=400, detail="Could not decode image")
+                response = {
+                    "seq": seq,
+                    "detections": _validate_inspection(inspection),
+                    "stages": inspection["stages"],
+                    "model_version": inspection.get("model_version"),
+                    "keyframe": inspection.get("keyframe", True),
+                }
+            except HTTPException as e:
+                response = {"seq": seq, "error": e.detail, "status_code": e.status_code}
+            response["dropped"] = state["dropped"]
+            response["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            await websocket.send_json(response)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
 
 @app.post("/api/v1/save_scan")
 async def save_scan(
     file: UploadFile = File(...), 
-    detections: str = Form(""), # Explicitly mark as Form data
+    detections: str = Form(""), # Sent by older clients; ignored, see below
     user_email: str = Form(""),
     user_id: str = Form(""),
     status: str = Form("Pending"),
+    scan_token: str = Form(""), # Token from /predict; detections then come from the server
     authorization: str | None = Header(default=None),
 ):
     # Check if Firestore is initialized
+    db = get_db()
     if db is None:
         raise HTTPException(
             status_code=503,
@@ -161,74 +624,67 @@ async def save_scan(
     if not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
 
-    # Read file content for validation
-    contents = await file.read()
-    
-    # Analyze image content
-    analysis = analyze_image_content(contents)
-    
-    # Check for defects in provided metadata
-    has_defects = False
-    if detections:
-        try:
-            det_list = json.loads(detections)
-            if isinstance(det_list, list) and len(det_list) > 0:
-                has_defects = True
-        except:
-            pass
-            
-    # Validation Logic (Same as /predict)
-    # Validation Logic (Same as /predict)
-    # Only enforce strict checks if NO defects were found
-    if not has_defects:
-        if not analysis["is_vehicle"]:
-            if analysis["has_forbidden"]:
-                 raise HTTPException(
-                    status_code=400, 
-                    detail=f"Invalid image. Detected {analysis['forbidden_label']}. Please upload a vehicle image."
-                )
-            
-            # If no forbidden object but also no vehicle and no defects -> Reject
-            raise HTTPException(
-                status_code=400, 
-                detail="No vehicle detected. Please upload an image of an automobile."
-            )
+    # Streamed straight into uploads/ as a temporary file; the bytes are only
+    # read back when a model has to run on them. The file is moved into place
+    # once the scan is accepted and removed if it is rejected.
+    upload = await ingest_upload(file, keep_contents=False, spool_dir=UPLOAD_DIR)
+    try:
+        # Detections always come from the server: those /predict computed for
+        # these bytes (scan_token), or else a fresh run. Detections sent by
+        # the client, as older frontends still do, are never stored.
+        content_hash = upload.sha256
+        cached = scan_tokens.get(scan_token) if scan_token else None
+        if cached is not None and cached["content_hash"] != content_hash:
+            raise HTTPException(status_code=400, detail="Scan token does not match the uploaded image")
+        if cached is None:
+            # No, expired or unknown token: recompute rather than trust the client
+            cached = await model_pool.run(_run_models, await upload.read(), content_hash)
+            if cached is None:
+                raise HTTPException(status_code=400, detail="Could not decode image")
+        if "error" in cached["detections"]:
+            raise HTTPException(status_code=500, detail=cached["detections"]["error"])
+        # The /predict acceptance rules
+        det_list = _validate_inspection(cached)
+        model_version = cached.get("model_version")
 
-    # Reset file cursor for later saving
-    await file.seek(0)
+        authed_uid, authed_email = await io_pool.run(_require_user_from_bearer, authorization)
+    except BaseException:
+        upload.discard()
+        raise
 
-    authed_uid, authed_email = _require_user_from_bearer(authorization)
     final_user_id = authed_uid
     final_user_email = authed_email or (user_email.strip() if user_email else "") or "guest@example.com"
 
     # Fetch user profile to get company_id
     user_company_id = None
     try:
-        user_doc = db.collection("users").document(final_user_id).get()
+        user_doc = await io_pool.run(db.collection("users").document(final_user_id).get)
         if user_doc.exists:
             user_company_id = user_doc.to_dict().get("company_id")
     except Exception as e:
         logger.warning(f"Failed to fetch user profile for company_id: {e}")
 
+    # The history doc id is allocated up front so the image can be stored
+    # with its reference before the record is written
+    doc_ref = db.collection("history").document()
+
     # 1. Upload Image to Storage
     # 1. Save Image Locally
     try:
-        user_prefix = final_user_id or "guest"
-        filename = f"{uuid.uuid4()}_{file.filename}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-        
-        # Save file to disk
-        with open(file_path, "wb") as f:
-            contents = await file.read()
-            f.write(contents)
+        # The bytes are already on disk; the spooled file is moved into the
+        # blob store, or dropped if the same image is stored already
+        image_key, derivative_image_urls = await io_pool.run(_store_scan_image, upload, doc_ref.id)
             
         # Construct local URL
         # NOTE: In production, use the actual domain/IP. For local, localhost is fine.
         # We'll use the request base URL if available, or fallback to localhost
-        image_url = f"http://localhost:8000/uploads/{filename}"
-        logger.info(f"Image saved locally: {file_path}, URL: {image_url}")
+        image_url = object_storage.url(image_key)
+        logger.info(f"Image saved locally: {image_key}, URL: {image_url}")
         
+    except HTTPException:
+        raise
     except Exception as e:
+        upload.discard()
         logger.error(f"File Save Error: {e}", exc_info=True)
         # Fallback if file save fails
         image_url = None
@@ -236,11 +692,7 @@ async def save_scan(
 
     # 2. Save Metadata to Firestore
     try:
-        if detections:
-            det_data = json.loads(detections)
-            defect_count = len(det_data)
-        else:
-            defect_count = 0
+        defect_count = len(det_list)
             
         # Create Firestore-compatible timestamp
         # Use datetime.now() - Firestore Admin SDK accepts Python datetime objects
@@ -254,12 +706,20 @@ async def save_scan(
             "status": status,
             "defects": defect_count,
             "image_url": image_url,
-            "detections": json.loads(detections) if detections else []
+            **derivative_image_urls,
+            "detections": list(det_list),
+            "model_version": model_version,
         }
         
-        doc_ref = db.collection("history").add(doc_data)
-        logger.info(f"Scan saved to Firestore with ID: {doc_ref[1].id}")
-        return {"message": "Scan saved successfully", "id": doc_ref[1].id, "image_url": image_url}
+        try:
+            await io_pool.run(doc_ref.set, doc_data)
+        except BaseException:
+            await io_pool.run(blob_store.release, image_key, doc_ref.id)
+            raise
+        logger.info(f"Scan saved to Firestore with ID: {doc_ref.id}")
+        return {"message": "Scan saved successfully", "id": doc_ref.id, "image_url": sign_url(image_url)}
+    except HTTPException:
+        raise
     except google_exceptions.NotFound as e:
         error_msg = str(e)
         # Check if it's the database doesn't exist error
@@ -344,11 +804,352 @@ async def save_scan(
             }
         )
 
+# Images of one inspection in flight at once; matching the batch size lets
+# them share forward passes without flooding the model pool's queue.
+INSPECTION_CONCURRENCY = int(os.getenv("INSPECTION_CONCURRENCY", str(detect.MAX_BATCH_SIZE)))
+
+def _save_inspection(db, doc_ref, record, images):
+    """Writes the grouped history record and one images/{index} doc per image in one batch."""
+    batch = db.batch()
+    batch.set(doc_ref, record)
+    for image in images:
+        batch.set(doc_ref.collection("images").document(str(image["index"])), image)
+    batch.commit()
+    return doc_ref.id
+
+def _delete_inspection(db, doc_ref):
+    batch = db.batch()
+    for image_doc in doc_ref.collection("images").stream():
+        batch.delete(image_doc.reference)
+    batch.delete(doc_ref)
+    batch.commit()
+
+@app.post("/api/v1/inspections")
+async def inspect_vehicle(
+    files: list[UploadFile] = File(...),
+    status: str = Form("Pending"),
+    imgsz: int | None = Query(default=None), # As on /predict
+    tiled: bool | None = Query(default=None), # As on /predict
+    authorization: str | None = Header(default=None),
+):
+    """
+    Inspects one vehicle photographed from several angles in a single request:
+    one auth check and profile read, all images inferred concurrently (so
+    they share batches), and one grouped history record written together
+    with a per-image result doc in a single Firestore batch.
+
+    Streams newline-delimited JSON: one {"type": "image", ...} line per image
+    as it finishes (completion order, with its index), then
+    {"type": "complete", "id", ...} once saved, or {"type": "error", ...}.
+    Images rejected by the /predict rules are reported and left out of the record.
+    """
+    db = get_db()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+
+    uid, email = await io_pool.run(_require_user_from_bearer, authorization)
+    if not files:
+        raise HTTPException(status_code=400, detail="No images uploaded")
+    if len(files) > MAX_INSPECTION_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_INSPECTION_IMAGES} images per inspection")
+    inference_size = _inference_size_or_400(imgsz)
+
+    # Each image is spooled to disk and only read back when its turn on the
+    # model pool comes, so at most INSPECTION_CONCURRENCY are held in memory
+    uploads = []
+    try:
+        for file in files:
+            if not (file.content_type or "").startswith("image/"):
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not an image")
+            uploads.append(await ingest_upload(file, keep_contents=False, spool_dir=UPLOAD_DIR))
+    except BaseException:
+        for upload in uploads:
+            upload.discard()
+        raise
+
+    user_company_id = None
+    try:
+        user_doc = await io_pool.run(db.collection("users").document(uid).get)
+        if user_doc.exists:
+            user_company_id = user_doc.to_dict().get("company_id")
+    except Exception as e:
+        logger.warning(f"Failed to fetch user profile for company_id: {e}")
+
+    semaphore = asyncio.Semaphore(max(1, INSPECTION_CONCURRENCY))
+
+    async def run_one(index, upload):
+        async with semaphore:
+            result = {"type": "image", "index": index, "filename": upload.filename}
+            try:
+                inspection = await model_pool.run(
+                    _run_models, await upload.read(), upload.sha256, inference_size, tiled=tiled
+                )
+                if inspection is None:
+                    raise HTTPException(status_code=400, detail="Could not decode image")
+                result.update({
+                    "status": "ok",
+                    "detections": list(_validate_inspection(inspection)),
+                    "stages": inspection["stages"],
+                    "model_version": inspection.get("model_version"),
+                })
+            except HTTPException as e:
+                result.update({"status": "rejected", "error": e.detail, "status_code": e.status_code})
+            return result
+
+    async def progress():
+        tasks = [asyncio.create_task(run_one(i, upload)) for i, upload in enumerate(uploads)]
+        try:
+            results = [None] * len(tasks)
+            for completed, next_done in enumerate(asyncio.as_completed(tasks), start=1):
+                result = await next_done
+                results[result["index"]] = result
+                yield json.dumps({**result, "completed": completed, "total": len(tasks)}) + "\n"
+
+            accepted = [r for r in results if r["status"] == "ok"]
+            if not accepted:
+                yield json.dumps({"type": "error", "message": "No image was accepted"}) + "\n"
+                return
+
+            doc_ref = db.collection("history").document()
+            images = []
+            stored_keys = []
+            saved = False
+            try:
+                for r in accepted:
+                    upload = uploads[r["index"]]
+                    key, urls = await io_pool.run(_store_scan_image, upload, doc_ref.id)
+                    stored_keys.append(key)
+                    images.append({
+                        "index": r["index"],
+                        "filename": r["filename"],
+                        "image_url": object_storage.url(key),
+                        **urls,
+                        "defects": len(r["detections"]),
+                        "detections": r["detections"],
+                        "model_version": r["model_version"],
+                    })
+
+                current_time = datetime.now()
+                record = {
+                    "date": current_time.strftime("%Y-%m-%d"),
+                    "createdAt": current_time,
+                    "user_id": uid,
+                    "user_email": email or "guest@example.com",
+                    "company_id": user_company_id,
+                    "status": status,
+                    "kind": "inspection",
+                    "image_count": len(images),
+                    "defects": sum(image["defects"] for image in images),
+                    # The first image stands in for the inspection in single-image views
+                    "image_url": images[0]["image_url"],
+                    **{k: images[0][k] for k in DERIVATIVE_URL_FIELDS if k in images[0]},
+                    "detections": images[0]["detections"],
+                    "image_urls": [image["image_url"] for image in images],
+                    "images": [
+                        {k: image[k] for k in ("index", "filename", "image_url", "defects", *DERIVATIVE_URL_FIELDS) if k in image}
+                        for image in images
+                    ],
+                    "model_version": images[0]["model_version"],
+                }
+                await io_pool.run(_save_inspection, db, doc_ref, record, images)
+                saved = True
+            finally:
+                # Every reference taken so far goes if any store or the save failed
+                if not saved:
+                    for key in dict.fromkeys(stored_keys):
+                        await io_pool.run(blob_store.release, key, doc_ref.id)
+
+            doc_id = doc_ref.id
+            logger.info(f"Inspection saved to Firestore with ID: {doc_id} ({len(images)} images)")
+            yield json.dumps({
+                "type": "complete",
+                "id": doc_id,
+                "accepted": len(images),
+                "rejected": len(results) - len(images),
+                "defects": record["defects"],
+                "image_urls": [sign_url(url) for url in record["image_urls"]],
+            }) + "\n"
+        except Exception as e:
+            logger.error(f"Inspection failed: {e}", exc_info=True)
+            yield json.dumps({"type": "error", "message": f"Failed to save inspection: {e}"}) + "\n"
+        finally:
+            # Client went away mid-stream: stop waiting on the remaining images
+            for task in tasks:
+                task.cancel()
+            # Spool files of rejected images (stored ones were moved into the
+            # blob store); a stream that never starts leaves them to
+            # remove_partial_uploads at the next start
+            for upload in uploads:
+                upload.discard()
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+# Bulk / offline inspections (see jobs.py). Folder submissions read images
+# already on the server, so they are only allowed under JOB_IMPORT_ROOT.
+JOB_IMPORT_ROOT = os.getenv("JOB_IMPORT_ROOT", "")
+job_store = JobStore()
+
+def _run_job_item(path, inference_size):
+    """Runs one queued job image through the /predict pipeline and rules. Runs on a job runner thread."""
+    with open(path, "rb") as f:
+        contents = f.read()
+    inspection = _run_models(contents, inference_size=inference_size)
+    if inspection is None:
+        raise ValueError("Could not decode image")
+    try:
+        detections = _validate_inspection(inspection)
+    except HTTPException as e:
+        return {"status": "rejected", "error": e.detail}
+    return {
+        "status": "ok",
+        "detections": list(detections),
+        "stages": inspection["stages"],
+        "model_version": inspection.get("model_version"),
+    }
+
+job_runner = JobRunner(
+    job_store,
+    _run_job_item,
+    # Interactive traffic waiting on the model path holds back the bulk lane
+    interactive_busy=lambda: model_pool.is_busy() or defect_scheduler.queue_depth() > 0,
+)
+
+def _job_progress(job):
+    return {
+        "id": job["id"],
+        "status": job["status"],
+        "lane": job["lane"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+async def _owned_job(job_id, authorization):
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
+    job = await io_pool.run(job_store.get, job_id)
+    if job is None or job["user_id"] != uid:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/api/v1/jobs", status_code=202)
+async def submit_job(
+    files: list[UploadFile] | None = File(default=None),
+    folder: str | None = Form(default=None), # Server-side folder under JOB_IMPORT_ROOT
+    lane: str = Form("bulk"), # "interactive" jobs are served before "bulk" ones
+    imgsz: int | None = Query(default=None), # As on /predict
+    authorization: str | None = Header(default=None),
+):
+    """
+    Queues a set of images (uploaded, or a server folder) for inspection and
+    returns the job id at once. Poll GET /api/v1/jobs/{id}, follow
+    /api/v1/jobs/{id}/events, and fetch /api/v1/jobs/{id}/results.
+    """
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
+    if lane not in LANES:
+        raise HTTPException(status_code=400, detail=f"lane must be one of {', '.join(LANES)}")
+    inference_size = _inference_size_or_400(imgsz)
+    if bool(files) == bool(folder):
+        raise HTTPException(status_code=400, detail="Send either files or a folder")
+
+    job_id = new_job_id()
+    if folder:
+        if not JOB_IMPORT_ROOT:
+            raise HTTPException(status_code=403, detail="Folder imports are disabled (JOB_IMPORT_ROOT not set)")
+        root = os.path.realpath(JOB_IMPORT_ROOT)
+        target = os.path.realpath(os.path.join(root, folder))
+        if os.path.commonpath([root, target]) != root or not os.path.isdir(target):
+            raise HTTPException(status_code=400, detail="Folder not found under the import root")
+        paths = await io_pool.run(list_images, target)
+        items = [(os.path.basename(path), path) for path in paths]
+        source = f"folder:{os.path.relpath(target, root)}"
+    else:
+        if len(files) > MAX_JOB_IMAGES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_JOB_IMAGES} images per job")
+        input_dir = job_input_dir(job_id)
+        await io_pool.run(functools.partial(os.makedirs, input_dir, exist_ok=True))
+        items = []
+        for index, file in enumerate(files):
+            if not (file.content_type or "").startswith("image/"):
+                await io_pool.run(remove_job_inputs, job_id)
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not an image")
+            try:
+                upload = await ingest_upload(file, keep_contents=False, spool_dir=input_dir)
+            except HTTPException:
+                await io_pool.run(remove_job_inputs, job_id)
+                raise
+            path = os.path.join(input_dir, f"{index:05d}_{upload.filename}")
+            await io_pool.run(upload.commit, path)
+            items.append((upload.filename, path))
+        source = "upload"
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images to inspect")
+    if lane == "interactive" and len(items) > MAX_INSPECTION_IMAGES:
+        # The priority lane is for single inspections, not audits
+        if source == "upload":
+            await io_pool.run(remove_job_inputs, job_id)
+        raise HTTPException(status_code=400, detail=f"Interactive jobs are limited to {MAX_INSPECTION_IMAGES} images")
+    if len(items) > MAX_JOB_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_JOB_IMAGES} images per job")
+
+    await io_pool.run(job_store.create, uid, items, lane, source, inference_size, job_id)
+    job_runner.notify()
+    return {"id": job_id, "status": "queued", "lane": lane, "total": len(items)}
+
+@app.get("/api/v1/jobs/{job_id}")
+async def get_job(job_id: str, authorization: str | None = Header(default=None)):
+    job = await _owned_job(job_id, authorization)
+    return _job_progress(job)
+
+@app.get("/api/v1/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    offset: int = Query(default=0, ge=0),
+    limit: int = Query(default=100, ge=1, le=1000),
+    authorization: str | None = Header(default=None),
+):
+    job = await _owned_job(job_id, authorization)
+    items = await io_pool.run(job_store.items, job_id, offset, limit)
+    return {**_job_progress(job), "offset": offset, "items": items}
+
+@app.get("/api/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, authorization: str | None = Header(default=None)):
+    """Streams the job's progress as NDJSON, one line per change, until it is done or cancelled."""
+    job = await _owned_job(job_id, authorization)
+
+    async def progress():
+        current = job
+        last = None
+        while True:
+            snapshot = _job_progress(current)
+            if snapshot != last:
+                yield json.dumps(snapshot) + "\n"
+                last = snapshot
+            if current["status"] in ("done", "cancelled"):
+                return
+            await asyncio.sleep(1.0)
+            current = await io_pool.run(job_store.get, job_id)
+
+    return StreamingResponse(progress(), media_type="application/x-ndjson")
+
+@app.delete("/api/v1/jobs/{job_id}")
+async def cancel_job(job_id: str, authorization: str | None = Header(default=None)):
+    """Cancels the job's remaining images; images already being inferred still finish."""
+    job = await _owned_job(job_id, authorization)
+    running = await io_pool.run(job_store.cancel, job_id)
+    if not running and job["source"] == "upload":
+        await io_pool.run(remove_job_inputs, job_id)
+    return _job_progress(await io_pool.run(job_store.get, job_id))
+
 @app.get("/api/v1/history")
 async def get_history(
     limit: int = Query(default=20, ge=1, le=100),
     authorization: str | None = Header(default=None),
 ):
+    db = get_db()
     if db is None:
         raise HTTPException(
             status_code=503,
@@ -358,7 +1159,7 @@ async def get_history(
             },
         )
 
-    uid, _email = _require_user_from_bearer(authorization)
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
         q = (
@@ -367,12 +1168,14 @@ async def get_history(
             .order_by("createdAt", direction="DESCENDING")
             .limit(limit)
         )
-        docs = q.stream()
+        docs = await io_pool.run(lambda: list(q.stream()))
         items = []
         for doc in docs:
             data = doc.to_dict() or {}
-            items.append({"id": doc.id, **_json_safe(data)})
+            items.append(_with_signed_urls(_with_derivative_urls({"id": doc.id, **_json_safe(data)})))
         return {"history": items}
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         logger.error(f"History fetch error: {error_msg}", exc_info=True)
@@ -411,14 +1214,15 @@ async def get_company_history(
     Only accessible by users with role 'admin'.
     Supports filtering by defect_type, date range, and specific user.
     """
+    db = get_db()
     if db is None:
         raise HTTPException(status_code=503, detail="Database not available")
 
-    uid, _ = _require_user_from_bearer(authorization)
+    uid, _ = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
         # 1. Verify User is Admin and get Company ID
-        user_doc = db.collection("users").document(uid).get()
+        user_doc = await io_pool.run(db.collection("users").document(uid).get)
         if not user_doc.exists:
             raise HTTPException(status_code=404, detail="User profile not found")
         
@@ -461,7 +1265,7 @@ async def get_company_history(
         query = query.order_by("createdAt", direction="DESCENDING")
         query = query.limit(limit)
 
-        docs = query.stream()
+        docs = await io_pool.run(lambda: list(query.stream()))
         items = []
         
         # Post-query filtering for defect_type (since array-contains might be needed or complex AND queries)
@@ -487,10 +1291,12 @@ async def get_company_history(
             # Actually, `save_scan` doesn't save user_name. 
             # We can rely on frontend fetching user list or just displaying ID/Email.
             
-            items.append({"id": doc.id, **_json_safe(data)})
+            items.append(_with_signed_urls(_with_derivative_urls({"id": doc.id, **_json_safe(data)})))
             
         return {"history": items}
 
+    except HTTPException:
+        raise
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Company history fetch error: {error_msg}", exc_info=True)
@@ -512,6 +1318,7 @@ async def delete_history_item(
     authorization: str | None = Header(default=None),
 ):
     """Delete a history item by document ID. Only the owner can delete their own scans."""
+    db = get_db()
     if db is None:
         raise HTTPException(
             status_code=503,
@@ -521,12 +1328,12 @@ async def delete_history_item(
             },
         )
 
-    uid, _email = _require_user_from_bearer(authorization)
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
         # Get the document first to verify ownership
         doc_ref = db.collection("history").document(doc_id)
-        doc = doc_ref.get()
+        doc = await io_pool.run(doc_ref.get)
         
         if not doc.exists:
             raise HTTPException(
@@ -539,7 +1346,7 @@ async def delete_history_item(
         # Verify ownership or Admin privileges
         if doc_data.get("user_id") != uid:
             # Check if user is Admin of the same company
-            user_doc = db.collection("users").document(uid).get()
+            user_doc = await io_pool.run(db.collection("users").document(uid).get)
             is_authorized = False
             
             if user_doc.exists:
@@ -560,40 +1367,46 @@ async def delete_history_item(
                     detail={"error": "Forbidden", "message": "You do not have permission to delete this report."},
                 )
         
-        # Try to delete the image from storage if it exists
-        # Try to delete the local image file if it exists
+        # Delete the record's image(s) from whichever backend holds them:
+        # the configured one, or local files / Firebase Storage for records
+        # written before. Grouped inspections list every image in image_urls.
         image_url = doc_data.get("image_url")
-        if image_url and "localhost:8000/uploads" in image_url:
+        for url in dict.fromkeys(doc_data.get("image_urls") or [image_url]):
             try:
-                # Extract filename from URL
-                filename = image_url.split("/")[-1]
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"Local image deleted: {file_path}")
-                else:
-                    logger.warning(f"Local file not found for deletion: {file_path}")
-            except Exception as file_error:
-                # Log but don't fail - the Firestore document is more important
-                logger.warning(f"Could not delete local image file: {file_error}")
-        
-        # Legacy support: Try to delete from Firebase Storage if it was an old record
-        elif image_url and storage and "storage.googleapis.com" in image_url:
-            try:
-                if "storage.googleapis.com" in image_url:
-                    parts = image_url.split("/")
-                    bucket_name = parts[3]
-                    blob_path = "/".join(parts[4:])
-                    bucket = storage.bucket(name=bucket_name)
-                    blob = bucket.blob(blob_path)
-                    blob.delete()
-                    logger.info(f"Legacy image deleted from storage: {blob_path}")
+                # Content-addressed images may be shared with other records;
+                # the blob is only deleted once nothing references it
+                key = _blob_key(url)
+                if key is not None:
+                    if await io_pool.run(blob_store.release, key, doc_id):
+                        logger.info(f"Image deleted: {key}")
+                    continue
+
+                backend, key = resolve_url(url)
+                if backend is None:
+                    if url:
+                        logger.warning(f"No storage backend for image URL: {url}")
+                    continue
+                await backend.delete(key)
+                if backend is object_storage:
+                    # Derivatives rendered on demand for this older record
+                    for derived in derived_keys(key):
+                        await backend.delete(derived)
+                logger.info(f"Image deleted from {backend.name} storage: {key}")
             except Exception as storage_error:
-                 logger.warning(f"Could not delete image from storage: {storage_error}")
+                # Log but don't fail - the Firestore document is more important
+                logger.warning(f"Could not delete image from storage: {storage_error}")
         
-        # Delete the Firestore document
-        doc_ref.delete()
+        # The report / viewer rendering of this record
+        try:
+            await io_pool.run(annotated_images.invalidate, {**doc_data, "id": doc_id})
+        except Exception as storage_error:
+            logger.warning(f"Could not delete annotated image: {storage_error}")
+
+        # Delete the Firestore document (and a grouped inspection's per-image docs)
+        if doc_data.get("kind") == "inspection":
+            await io_pool.run(_delete_inspection, db, doc_ref)
+        else:
+            await io_pool.run(doc_ref.delete)
         logger.info(f"History item deleted: {doc_id}")
         
         return {"message": "Report deleted successfully", "id": doc_id}
@@ -612,6 +1425,97 @@ async def delete_history_item(
             },
         )
 
+async def _require_image_access(path, key, expires, signature, authorization):
+    """
+    Lets a request for a stored scan image through if it carries a valid URL
+    signature (see _with_signed_urls), or a login token whose user may view
+    a history record using the image. Anything else is a 401 / 404.
+    """
+    if url_signature_valid(path, expires, signature):
+        return
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
+    db = get_db()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+    for ref in await io_pool.run(blob_store.refs, key):
+        try:
+            await _load_scan_for_viewer(db, ref, uid)
+            return
+        except HTTPException:
+            continue
+    raise HTTPException(status_code=404, detail="Image not found")
+
+# Profile photos are stored as profile_<uid>_<uuid>_<filename>
+PROFILE_PHOTO_PREFIX = "profile_"
+
+async def _require_profile_photo_access(path, key, expires, signature, authorization):
+    """
+    Lets a request for a profile photo through if it carries a valid URL
+    signature (see get_profile), or its owner's login token.
+    """
+    if url_signature_valid(path, expires, signature):
+        return
+    uid, _email = await io_pool.run(_require_user_from_bearer, authorization)
+    if not key.startswith(f"{PROFILE_PHOTO_PREFIX}{uid}_"):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+@app.get("/api/v1/storage/{key:path}")
+async def storage_object(
+    key: str,
+    expires: int | None = Query(default=None),
+    signature: str | None = Query(default=None),
+    authorization: str | None = Header(default=None),
+):
+    """
+    Stable image URL for backends without a public one (a private S3 bucket):
+    redirects to a short-lived presigned URL, so ranged and cached reads go
+    straight to the object store. Only scan images (blob keys) and profile
+    photos are served.
+    """
+    path = f"{STORAGE_ROUTE}{key}"
+    if is_blob_key(key):
+        await _require_image_access(path, key, expires, signature, authorization)
+    elif key.startswith(PROFILE_PHOTO_PREFIX):
+        await _require_profile_photo_access(path, key, expires, signature, authorization)
+    else:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return RedirectResponse(object_storage.signed_url(key), status_code=307)
+
+@app.get("/api/v1/derivatives/{variant}/{key:path}")
+async def image_derivative(
+    variant: str,
+    key: str,
+    expires: int | None = Query(default=None),
+    signature: str | None = Query(default=None),
+    authorization: str | None = Header(default=None),
+):
+    """
+    Thumbnail or medium copy of a stored scan image, rendered on first
+    request (records saved before derivatives existed) and redirected to
+    afterwards. key must be an original in the blob store, never a
+    derivative, and access is checked as on the storage route.
+    """
+    if variant not in VARIANTS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    if not is_blob_key(key):
+        raise HTTPException(status_code=404, detail="Image not found")
+    await _require_image_access(f"{DERIVATIVES_ROUTE}{variant}/{key}", key, expires, signature, authorization)
+    derived = derivative_key(key, variant)
+    if not await io_pool.run(object_storage.exists, derived):
+        # Existing derivatives are only ever redirected to; rendering is for
+        # blobs some record still references
+        if not await io_pool.run(blob_store.references, key):
+            raise HTTPException(status_code=404, detail="Image not found")
+        try:
+            source = await object_storage.get(key)
+        except (FileNotFoundError, ValueError):
+            raise HTTPException(status_code=404, detail="Image not found")
+        try:
+            await io_pool.run(lambda: store_derivatives(object_storage, key, render_derivatives(source)))
+        except OSError:
+            raise HTTPException(status_code=415, detail="Image could not be decoded")
+    return RedirectResponse(object_storage.signed_url(derived), status_code=307)
+
 @app.post("/api/v1/user/update")
 async def update_profile(
     file: UploadFile | None = None,
@@ -621,13 +1525,14 @@ async def update_profile(
     role: str = Form(None), # Add role
     authorization: str | None = Header(default=None),
 ):
+    db = get_db()
     if db is None:
         raise HTTPException(
             status_code=503,
             detail={"error": "Firestore Not Initialized", "message": "Database not available."}
         )
 
-    uid, email = _require_user_from_bearer(authorization)
+    uid, email = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
         user_ref = db.collection("users").document(uid)
@@ -645,29 +1550,32 @@ async def update_profile(
         # Handle Profile Picture Upload
         if file:
             try:
-                # 1. Save Image Locally
-                filename = f"profile_{uid}_{uuid.uuid4()}_{file.filename}"
-                file_path = os.path.join(UPLOAD_DIR, filename)
-                
-                with open(file_path, "wb") as f:
-                    contents = await file.read()
-                    f.write(contents)
-                
-                # Local URL
-                image_url = f"http://localhost:8000/uploads/{filename}"
+                # 1. Save Image to the storage backend
+                upload = await ingest_upload(file, keep_contents=False, spool_dir=UPLOAD_DIR)
+                filename = f"{PROFILE_PHOTO_PREFIX}{uid}_{uuid.uuid4()}_{upload.filename}"
+                try:
+                    image_url = await object_storage.put_file(filename, upload.path)
+                except BaseException:
+                    upload.discard()
+                    raise
                 update_data["photo_url"] = image_url
                 
                 # Optional: Delete old profile pic logic could go here
                 
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Profile Pic Save Error: {e}", exc_info=True)
                 raise HTTPException(status_code=500, detail="Failed to save profile picture")
 
         # Update Firestore
         # Set merge=True to create if not exists or update existing fields
-        user_ref.set(update_data, merge=True)
+        await io_pool.run(user_ref.set, update_data, merge=True)
         
-        return {"message": "Profile updated successfully", "data": update_data}
+        response_data = dict(update_data)
+        if response_data.get("photo_url"):
+            response_data["photo_url"] = sign_url(response_data["photo_url"])
+        return {"message": "Profile updated successfully", "data": response_data}
 
     except HTTPException:
         raise
@@ -677,24 +1585,54 @@ async def update_profile(
 
 @app.get("/api/v1/user/profile")
 async def get_profile(authorization: str | None = Header(default=None)):
+    db = get_db()
     if db is None:
         raise HTTPException(status_code=503, detail="Database not available")
 
-    uid, _ = _require_user_from_bearer(authorization)
+    uid, _ = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
-        doc = db.collection("users").document(uid).get()
+        doc = await io_pool.run(db.collection("users").document(uid).get)
         if doc.exists:
-            return doc.to_dict()
+            profile = doc.to_dict()
+            # Photos served by the storage route are loaded without the login token
+            if profile.get("photo_url"):
+                profile["photo_url"] = sign_url(profile["photo_url"])
+            return profile
         else:
             return {} # Return empty if no profile yet
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get Profile Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to fetch profile")
 
-from fastapi.responses import StreamingResponse
 from pdf_service import ReportGenerator
 
+async def _load_scan_for_viewer(db, scan_id, uid):
+    """
+    A history record with its id, if uid may view it: the owner, or an admin
+    of the same company. Raises 404 / 403 otherwise.
+    """
+    doc = await io_pool.run(db.collection("history").document(scan_id).get)
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Report not found")
+
+    scan_data = doc.to_dict()
+    scan_data['id'] = doc.id
+
+    if scan_data.get("user_id") != uid:
+        # Check if Admin of same company
+        user_doc = await io_pool.run(db.collection("users").document(uid).get)
+        if not user_doc.exists:
+            raise HTTPException(status_code=403, detail="Access denied.")
+        user_data = user_doc.to_dict()
+        is_admin = user_data.get("role") == "admin"
+        same_company = user_data.get("company_id") == scan_data.get("company_id")
+        if not (is_admin and same_company):
+            raise HTTPException(status_code=403, detail="Access denied. You do not have permission to view this report.")
+    return scan_data
+
 @app.get("/api/v1/report/{scan_id}")
 async def generate_report(
     scan_id: str,
@@ -704,45 +1642,19 @@ async def generate_report(
     Generate and download a PDF report for a specific scan.
     Accessible by the scan owner OR an Admin from the same company.
     """
+    db = get_db()
     if db is None:
         raise HTTPException(status_code=503, detail="Database not available")
 
-    uid, _ = _require_user_from_bearer(authorization)
+    uid, _ = await io_pool.run(_require_user_from_bearer, authorization)
 
     try:
-        # 1. Fetch Scan Data
-        doc_ref = db.collection("history").document(scan_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            raise HTTPException(status_code=404, detail="Report not found")
-            
-        scan_data = doc.to_dict()
-        scan_data['id'] = doc.id
-        
-        # 2. Access Control
-        # access if:
-        # a. User is the owner
-        # b. User is Admin AND same company
-        
-        is_owner = scan_data.get("user_id") == uid
-        
-        if not is_owner:
-            # Check if Admin of same company
-            user_doc = db.collection("users").document(uid).get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                is_admin = user_data.get("role") == "admin"
-                same_company = user_data.get("company_id") == scan_data.get("company_id")
-                
-                if not (is_admin and same_company):
-                     raise HTTPException(status_code=403, detail="Access denied. You do not have permission to view this report.")
-            else:
-                 raise HTTPException(status_code=403, detail="Access denied.")
+        # 1. Fetch Scan Data, 2. Access Control
+        scan_data = await _load_scan_for_viewer(db, scan_id, uid)
 
         # 3. Generate PDF
         generator = ReportGenerator()
-        pdf_buffer = generator.generate(scan_data)
+        pdf_buffer = await io_pool.run(generator.generate, scan_data)
         
         # 4. Return as File Download
         filename = f"Inspection_Report_{scan_id[-6:]}.pdf"
@@ -759,6 +1671,34 @@ async def generate_report(
         logger.error(f"PDF Generation Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to generate report")
 
+@app.get("/api/v1/history/{scan_id}/annotated")
+async def annotated_image(
+    scan_id: str,
+    authorization: str | None = Header(default=None),
+    if_none_match: str | None = Header(default=None),
+):
+    """
+    The scan image with its detections drawn in, as in the PDF report and
+    from the same cache. Same access rules as the report.
+    """
+    db = get_db()
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database not available")
+
+    uid, _ = await io_pool.run(_require_user_from_bearer, authorization)
+    scan_data = await _load_scan_for_viewer(db, scan_id, uid)
+
+    # The key changes with the model version and detections, so it doubles as the ETag
+    etag = f'"{annotated_key(scan_data).rsplit("/", 1)[-1]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=3600"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+
+    _key, data = await io_pool.run(annotated_images.get, scan_data)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image could not be loaded")
+    return Response(content=data, media_type="image/jpeg", headers=headers)
+
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,473 @@
+"""
+Pluggable image storage.
+
+Every backend stores objects under string keys ("blobs/ab/cd/<sha256>.jpg",
+"profiles/...") and exposes the same operations: blocking primitives
+(write_file, write_bytes, read, remove, exists) for code already running on
+a worker thread, and async put/put_file/get/delete that run them on the
+backend's own bounded pool. url(key) is the stable URL stored in Firestore;
+signed_url(key) a directly fetchable one; key_for_url maps a stored URL back.
+
+STORAGE_BACKEND selects the implementation:
+    local  files under LOCAL_STORAGE_DIR, served by the /uploads mount (default)
+    s3     any S3-compatible store (AWS, MinIO, a moto server for tests...) so
+           several API replicas share one image store; needs boto3
+    gcs    the Firebase Storage bucket earlier versions wrote to; needs
+           google-cloud-storage (installed with firebase-admin)
+
+boto3 and google-cloud-storage are optional: each is imported only when its
+backend is created. MemoryStorage is an in-process stand-in for tests.
+"""
+import hashlib
+import hmac
+import mimetypes
+import os
+import secrets
+import shutil
+import threading
+import time
+import uuid
+
+from executor import BoundedExecutor
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+# Base URL clients reach this API on; used for URLs served through the API itself
+PUBLIC_API_URL = os.getenv("PUBLIC_API_URL", "http://localhost:8000").rstrip("/")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "uploads")
+# Concurrent storage calls per backend; for S3 also the size of the HTTP connection pool
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "16"))
+STORAGE_MAX_QUEUE = int(os.getenv("STORAGE_MAX_QUEUE", "256"))
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+# Set for MinIO or another S3-compatible endpoint (e.g. http://localhost:9000)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "") or None
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", "") or None
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", "") or None
+# Public base URL of the bucket (CDN or public-read bucket). When empty,
+# stored URLs point at /api/v1/storage/<key>, which redirects to a presigned URL.
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL", "").rstrip("/")
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", "3600"))
+
+GCS_BUCKET = os.getenv("GCS_BUCKET", "car-defect-total.appspot.com")
+
+# Route that serves keys of backends without a public URL (see main.py)
+STORAGE_ROUTE = "/api/v1/storage/"
+
+# Image URLs served by the API itself are private. <img> tags cannot send the
+# login token, so history responses hand out copies signed with this secret
+# that the routes accept until they expire. Replicas must share it; unset,
+# each process signs with a random key of its own.
+STORAGE_URL_SECRET = os.getenv("STORAGE_URL_SECRET", "")
+STORAGE_URL_TTL_SECONDS = int(os.getenv("STORAGE_URL_TTL_SECONDS", "900"))
+_url_secret = (STORAGE_URL_SECRET or secrets.token_hex(32)).encode()
+
+
+def content_type_for(key):
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def _check_prefix(prefix):
+    # An empty or partial prefix would take unrelated keys (or everything) with it
+    if not prefix.endswith("/") or prefix.startswith("/") or "//" in prefix:
+        raise ValueError(f"Prefix must name a directory, got {prefix!r}")
+    return prefix
+
+
+def _url_signature(path, expires):
+    return hmac.new(_url_secret, f"{path}\n{expires}".encode(), hashlib.sha256).hexdigest()
+
+
+def sign_url(url, ttl=STORAGE_URL_TTL_SECONDS):
+    """
+    url with expires/signature query parameters if the API serves it, else
+    unchanged. The expiry is rounded up to whole ttl periods, so an image
+    keeps the same URL (and its browser cache entry) for ttl to 2 * ttl.
+    """
+    if not url or not url.startswith(f"{PUBLIC_API_URL}/api/"):
+        return url
+    path = url[len(PUBLIC_API_URL):]
+    expires = (int(time.time()) // ttl + 2) * ttl
+    return f"{url}?expires={expires}&signature={_url_signature(path, expires)}"
+
+
+def url_signature_valid(path, expires, signature):
+    """Whether signature was issued by sign_url for path and has not expired."""
+    if not expires or not signature or expires < time.time():
+        return False
+    return hmac.compare_digest(signature, _url_signature(path, expires))
+
+
+class StorageBackend:
+    name = None
+
+    def __init__(self, max_connections=STORAGE_MAX_CONNECTIONS):
+        self._pool = BoundedExecutor(f"storage-{self.name}", max_workers=max_connections, max_queue=STORAGE_MAX_QUEUE)
+
+    # Blocking primitives
+
+    def write_file(self, key, src_path):
+        """Stores the file at src_path under key, consuming src_path."""
+        raise NotImplementedError
+
+    def write_bytes(self, key, data):
+        raise NotImplementedError
+
+    def read(self, key, start=None, end=None):
+        """The object's bytes, or bytes start..end inclusive. Raises FileNotFoundError."""
+        raise NotImplementedError
+
+    def remove(self, key):
+        """Deletes key; a missing key is not an error."""
+        raise NotImplementedError
+
+    def remove_prefix(self, prefix):
+        """Deletes every key under prefix, which must end in "/" (e.g. "annotated/<scan id>/")."""
+        raise NotImplementedError
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def url(self, key):
+        raise NotImplementedError
+
+    def signed_url(self, key, expires=S3_PRESIGN_SECONDS):
+        return self.url(key)
+
+    def key_for_url(self, url):
+        """The key a URL from url() refers to, or None if it is not one of ours."""
+        for prefix in self._url_prefixes():
+            if url and url.startswith(prefix):
+                return url[len(prefix):]
+        return None
+
+    def _url_prefixes(self):
+        return [f"{PUBLIC_API_URL}{STORAGE_ROUTE}"]
+
+    # Async API
+
+    async def put(self, key, data):
+        await self._pool.run(self.write_bytes, key, data)
+        return self.url(key)
+
+    async def put_file(self, key, src_path):
+        await self._pool.run(self.write_file, key, src_path)
+        return self.url(key)
+
+    async def get(self, key, start=None, end=None):
+        return await self._pool.run(self.read, key, start, end)
+
+    async def delete(self, key):
+        await self._pool.run(self.remove, key)
+
+    def stats(self):
+        return {"backend": self.name, "pool": self._pool.stats()}
+
+
+class LocalStorage(StorageBackend):
+    """Files under root, served by the /uploads static mount."""
+
+    name = "local"
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        path = os.path.abspath(os.path.join(self.root, *key.split("/")))
+        if os.path.commonpath([os.path.abspath(self.root), path]) != os.path.abspath(self.root):
+            raise ValueError(f"Key outside the storage root: {key}")
+        return path
+
+    def write_file(self, key, src_path):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(src_path, path)
+        except OSError:
+            # Spool directory on another filesystem
+            shutil.move(src_path, path)
+
+    def write_bytes(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, key, start=None, end=None):
+        with open(self.path(key), "rb") as f:
+            if start is None:
+                return f.read()
+            f.seek(start)
+            return f.read(-1 if end is None else end - start + 1)
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def remove_prefix(self, prefix):
+        shutil.rmtree(self.path(_check_prefix(prefix).rstrip("/")), ignore_errors=True)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def url(self, key):
+        return f"{PUBLIC_API_URL}/uploads/{key}"
+
+    def _url_prefixes(self):
+        # Records written before PUBLIC_API_URL existed always used localhost
+        return [f"{PUBLIC_API_URL}/uploads/", "http://localhost:8000/uploads/"]
+
+
+class S3Storage(StorageBackend):
+    """
+    An S3 bucket through boto3. The client is thread-safe and shared by the
+    pool's threads; botocore keeps up to max_connections HTTP connections
+    alive, matching the pool size so no call waits for a connection.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, region=S3_REGION,
+                 access_key_id=S3_ACCESS_KEY_ID, secret_access_key=S3_SECRET_ACCESS_KEY,
+                 public_url=S3_PUBLIC_URL, max_connections=STORAGE_MAX_CONNECTIONS):
+        super().__init__(max_connections=max_connections)
+        # Imported here so the local backend does not need boto3 installed
+        import boto3
+        from botocore.config import Config
+
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set for the s3 storage backend")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_url = public_url
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=Config(
+                max_pool_connections=max_connections,
+                retries={"max_attempts": 3, "mode": "standard"},
+                # Path-style addressing works with MinIO and other stand-ins
+                s3={"addressing_style": "path"} if endpoint_url else None,
+            ),
+        )
+        self._missing = (self.client.exceptions.NoSuchKey,)
+
+    def write_file(self, key, src_path):
+        self.client.upload_file(src_path, self.bucket, key, ExtraArgs={"ContentType": content_type_for(key)})
+        os.remove(src_path)
+
+    def write_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type_for(key))
+
+    def read(self, key, start=None, end=None):
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if start is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self.client.get_object(**kwargs)
+        except self._missing:
+            raise FileNotFoundError(key)
+        with response["Body"] as body:
+            return body.read()
+
+    def remove(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def remove_prefix(self, prefix):
+        # Listing pages and delete_objects both top out at 1000 keys
+        pages = self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=_check_prefix(prefix))
+        for page in pages:
+            objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": objects, "Quiet": True})
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        return f"{PUBLIC_API_URL}{STORAGE_ROUTE}{key}"
+
+    def signed_url(self, key, expires=S3_PRESIGN_SECONDS):
+        if self.public_url:
+            return self.url(key)
+        return self.client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=expires
+        )
+
+    def _url_prefixes(self):
+        prefixes = super()._url_prefixes()
+        if self.public_url:
+            prefixes.insert(0, f"{self.public_url}/")
+        return prefixes
+
+
+class GCSStorage(StorageBackend):
+    """The Firebase Storage bucket, through firebase_admin."""
+
+    name = "gcs"
+
+    def __init__(self, bucket=GCS_BUCKET, **kwargs):
+        super().__init__(**kwargs)
+        self.bucket_name = bucket
+        self._bucket = None
+
+    def _get_bucket(self):
+        if self._bucket is None:
+            from firebase_config import ensure_firebase, storage
+            if storage is None or not ensure_firebase():
+                raise RuntimeError("Firebase Storage is not available")
+            self._bucket = storage.bucket(name=self.bucket_name)
+        return self._bucket
+
+    def _blob(self, key):
+        return self._get_bucket().blob(key)
+
+    def write_file(self, key, src_path):
+        self._blob(key).upload_from_filename(src_path, content_type=content_type_for(key))
+        os.remove(src_path)
+
+    def write_bytes(self, key, data):
+        self._blob(key).upload_from_string(data, content_type=content_type_for(key))
+
+    def read(self, key, start=None, end=None):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self._blob(key).download_as_bytes(start=start, end=end)
+        except NotFound:
+            raise FileNotFoundError(key)
+
+    def remove(self, key):
+        from google.api_core.exceptions import NotFound
+        try:
+            self._blob(key).delete()
+        except NotFound:
+            pass
+
+    def remove_prefix(self, prefix):
+        from google.api_core.exceptions import NotFound
+        for blob in self._get_bucket().list_blobs(prefix=_check_prefix(prefix)):
+            try:
+                blob.delete()
+            except NotFound:
+                pass
+
+    def exists(self, key):
+        return self._blob(key).exists()
+
+    def url(self, key):
+        return f"https://storage.googleapis.com/{self.bucket_name}/{key}"
+
+    def key_for_url(self, url):
+        # Legacy records may name any bucket: https://storage.googleapis.com/<bucket>/<key>
+        if not url or "storage.googleapis.com/" not in url:
+            return None
+        bucket, _, key = url.split("storage.googleapis.com/", 1)[1].partition("/")
+        return key if bucket == self.bucket_name and key else None
+
+
+class MemoryStorage(StorageBackend):
+    """
+    Objects in a dict, for tests that need a backend without a disk or a
+    bucket. URLs look like a private bucket's; signed_url returns memory://
+    URLs, which nothing fetches, so it is not offered as a STORAGE_BACKEND.
+    """
+
+    name = "memory"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def write_file(self, key, src_path):
+        with open(src_path, "rb") as f:
+            self.write_bytes(key, f.read())
+        os.remove(src_path)
+
+    def write_bytes(self, key, data):
+        with self._lock:
+            self.objects[key] = bytes(data)
+
+    def read(self, key, start=None, end=None):
+        with self._lock:
+            if key not in self.objects:
+                raise FileNotFoundError(key)
+            data = self.objects[key]
+        if start is None:
+            return data
+        return data[start:None if end is None else end + 1]
+
+    def remove(self, key):
+        with self._lock:
+            self.objects.pop(key, None)
+
+    def remove_prefix(self, prefix):
+        _check_prefix(prefix)
+        with self._lock:
+            for key in [key for key in self.objects if key.startswith(prefix)]:
+                del self.objects[key]
+
+    def exists(self, key):
+        with self._lock:
+            return key in self.objects
+
+    def url(self, key):
+        return f"{PUBLIC_API_URL}{STORAGE_ROUTE}{key}"
+
+    def signed_url(self, key, expires=S3_PRESIGN_SECONDS):
+        return f"memory://{key}?expires={int(time.time()) + expires}"
+
+
+_BACKENDS = {"local": LocalStorage, "s3": S3Storage, "gcs": GCSStorage}
+
+
+def create_storage(name=STORAGE_BACKEND):
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; expected one of {', '.join(_BACKENDS)}")
+    return _BACKENDS[name]()
+
+
+object_storage = create_storage()
+# Records written before a backend switch still point at the old location;
+# backends for those are created lazily, the first time such a URL is seen.
+_legacy_backends = {}
+
+
+def _legacy(name, factory):
+    if name not in _legacy_backends:
+        _legacy_backends[name] = factory()
+    return _legacy_backends[name]
+
+
+def resolve_url(url):
+    """(backend, key) for a stored image URL, or (None, None) if no backend owns it."""
+    if not url:
+        return None, None
+    key = object_storage.key_for_url(url)
+    if key is not None:
+        return object_storage, key
+    if "storage.googleapis.com/" in url:
+        bucket = url.split("storage.googleapis.com/", 1)[1].partition("/")[0]
+        backend = _legacy(f"gcs:{bucket}", lambda: GCSStorage(bucket=bucket))
+    else:
+        backend = _legacy("local", LocalStorage)
+    key = backend.key_for_url(url)
+    return (backend, key) if key is not None else (None, None)
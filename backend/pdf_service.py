@@ -5,13 +5,13 @@ from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.pdfgen import canvas
 from io import BytesIO
-from PIL import Image as PILImage, ImageDraw
-import requests
-import os
+from PIL import Image as PILImage
+from annotated import annotated_images
 from datetime import datetime
 
 class ReportGenerator:
-    def __init__(self):
+    def __init__(self, annotations=annotated_images):
+        self.annotations = annotations
         self.width, self.height = A4
         self.styles = getSampleStyleSheet()
         self._create_custom_styles()
@@ -66,82 +66,6 @@ class ReportGenerator:
         canvas.drawRightString(self.width - 0.5 * inch, 0.5 * inch, f"Page {doc.page}")
         canvas.restoreState()
 
-    def _annotate_image(self, image_path, detections):
-        """
-        Draws bounding boxes on a local image using PIL.
-        Returns a PIL Image object.
-        """
-        try:
-            # Handle local paths or URLs
-            if image_path.startswith("http"):
-                # If it's a localhost URL, try to map it to local file system if possible
-                if "localhost" in image_path and "uploads" in image_path:
-                    filename = image_path.split("/")[-1]
-                    local_path = os.path.join("uploads", filename)
-                    if os.path.exists(local_path):
-                        img = PILImage.open(local_path)
-                    else:
-                        print(f"Local file not found: {local_path}")
-                        # Fallback to requests
-                        response = requests.get(image_path, stream=True)
-                        img = PILImage.open(response.raw)
-                else:
-                    # Fetch from remote URL
-                    response = requests.get(image_path, stream=True)
-                    img = PILImage.open(response.raw)
-            else:
-                img = PILImage.open(image_path)
-
-            img = img.convert("RGB")
-            draw = ImageDraw.Draw(img)
-            
-            # Try to load a better font
-            try:
-                from PIL import ImageFont
-                # Try to load Arial or generic sans-serif
-                font = ImageFont.truetype("arial.ttf", 36)
-            except IOError:
-                # Fallback to default
-                font = ImageFont.load_default()
-
-            # Draw detections
-            for det in detections:
-                # Key fix: support 'bbox' (from backend) and 'box' (legacy/frontend)
-                box = det.get("bbox") or det.get("box") or []
-                label = det.get("class") or det.get("label") or "Defect"
-                conf = det.get("confidence", 0)
-
-                if box and len(box) == 4:
-                    # Ensure coordinates are integers
-                    box = [int(c) for c in box]
-                    
-                    # Draw box
-                    draw.rectangle(box, outline="#ef4444", width=5)
-                    
-                    # Draw label background
-                    text_text = f"{label.upper()} ({conf:.0%})"
-                    
-                    # Get text size
-                    left, top, right, bottom = draw.textbbox((0, 0), text_text, font=font)
-                    text_w = right - left
-                    text_h = bottom - top
-                    
-                    # Draw background rectangle for text
-                    draw.rectangle(
-                        [box[0], box[1] - text_h - 10, box[0] + text_w + 20, box[1]],
-                        fill="#ef4444"
-                    )
-                    
-                    # Draw text
-                    draw.text((box[0] + 10, box[1] - text_h - 5), text_text, fill="white", font=font)
-
-            return img
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-
     def _draw_page(self, canvas, doc):
         self._draw_header(canvas, doc)
         self._draw_footer(canvas, doc)
@@ -214,17 +138,16 @@ class ReportGenerator:
         if image_url:
             elements.append(Paragraph("Visual Evidence", self.styles['SectionHeader']))
             
-            # Process image to draw bounding boxes
-            annotated_pil = self._annotate_image(image_url, detections)
+            # Image with bounding boxes, rendered once per scan and detections
+            # (see annotated.py); the JPEG is embedded as-is
+            _key, annotated_jpeg = self.annotations.get(scan_data)
             
-            if annotated_pil:
-                # Save to temp buffer for ReportLab
-                img_buffer = BytesIO()
-                annotated_pil.save(img_buffer, format='JPEG')
-                img_buffer.seek(0)
+            if annotated_jpeg:
+                img_buffer = BytesIO(annotated_jpeg)
                 
-                # Scale image to fit page width
-                img_width, img_height = annotated_pil.size
+                # Scale image to fit page width (only the header is parsed)
+                with PILImage.open(BytesIO(annotated_jpeg)) as header:
+                    img_width, img_height = header.size
                 aspect = img_height / float(img_width)
                 
                 display_width = 6 * inch
@@ -0,0 +1,116 @@
+"""
+Builds an INT8 variant of the defect model and promotes it only if it keeps
+its accuracy.
+
+1. Export defect_model.pt to FP32 ONNX (dynamic shape, cached by backends.py).
+2. Statically quantize it with ONNX Runtime, calibrating activations on a local
+   image folder preprocessed exactly like serving (DecodedFrame.letterbox).
+3. Compare it with the FP32 model on a held-out folder (evaluate_model.py).
+4. If the gate passes and --promote is given, copy it to
+   ../model/defect_model_int8.onnx with its evaluation report next to it.
+   Serve it by setting DEFECT_MODEL_PATH=../model/defect_model_int8.onnx.
+
+Usage:
+    python quantize_model.py --calibration ../data/calibration --eval ../data/holdout --promote
+
+Requires onnx and onnxruntime.
+"""
+import argparse
+import json
+import os
+import shutil
+from backends import load_model, export_model
+from detect import decode_image, INFERENCE_SIZE
+from evaluate_model import list_images, evaluate, passes_gate
+
+MODEL_PATH = "../model/defect_model.pt"
+PROMOTED_PATH = "../model/defect_model_int8.onnx"
+
+
+class FolderCalibrationReader:
+    """Feeds letterboxed calibration images to ONNX Runtime's quantizer one at a time."""
+
+    def __init__(self, folder, input_name, inference_size, limit):
+        self.paths = list_images(folder)[:limit]
+        self.input_name = input_name
+        self.inference_size = inference_size
+        self._index = 0
+        print(f"Calibrating on {len(self.paths)} images from {folder}")
+
+    def get_next(self):
+        while self._index < len(self.paths):
+            path = self.paths[self._index]
+            self._index += 1
+            with open(path, "rb") as f:
+                frame = decode_image(f.read(), self.inference_size)
+            if frame.image is None:
+                print(f"Skipping undecodable calibration image {path}")
+                continue
+            tensor, _ratio, _pad = frame.letterbox()
+            return {self.input_name: tensor.numpy()}
+        return None
+
+    def rewind(self):
+        self._index = 0
+
+
+def quantize(fp32_path, int8_path, calibration_dir, inference_size, limit):
+    import onnxruntime
+    from onnxruntime.quantization import quantize_static, CalibrationDataReader, QuantFormat, QuantType
+
+    input_name = onnxruntime.InferenceSession(
+        fp32_path, providers=["CPUExecutionProvider"]
+    ).get_inputs()[0].name
+
+    class Reader(FolderCalibrationReader, CalibrationDataReader):
+        pass
+
+    quantize_static(
+        fp32_path,
+        int8_path,
+        Reader(calibration_dir, input_name, inference_size, limit),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    return int8_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize the defect model to INT8 with an accuracy gate.")
+    parser.add_argument("--weights", default=MODEL_PATH)
+    parser.add_argument("--calibration", required=True, help="Folder of representative images")
+    parser.add_argument("--eval", required=True, help="Held-out image folder for the accuracy gate")
+    parser.add_argument("--labels", default=None, help="Optional YOLO-format labels for the held-out folder")
+    parser.add_argument("--calibration-limit", type=int, default=300)
+    parser.add_argument("--imgsz", type=int, default=INFERENCE_SIZE)
+    parser.add_argument("--max-map-drop", type=float, default=0.02)
+    parser.add_argument("--max-recall-drop", type=float, default=0.05)
+    parser.add_argument("--output", default="../model/exported/defect_model_int8_candidate.onnx")
+    parser.add_argument("--promote", action="store_true", help="Copy to the served location if the gate passes")
+    args = parser.parse_args()
+
+    fp32_onnx = export_model(args.weights, "onnx", args.imgsz)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    quantize(fp32_onnx, args.output, args.calibration, args.imgsz, args.calibration_limit)
+    print(f"INT8 candidate written to {args.output}")
+
+    reference_model, _ = load_model(args.weights, backend="pytorch", imgsz=args.imgsz)
+    candidate_model, _ = load_model(args.output, imgsz=args.imgsz)
+    report = evaluate(reference_model, candidate_model, args.eval, args.labels, args.imgsz)
+    ok, reasons = passes_gate(report, args.max_map_drop, args.max_recall_drop)
+    report.update({"passed": ok, "reasons": reasons, "source_weights": args.weights})
+    print(json.dumps(report, indent=2))
+
+    if not ok:
+        print("Quantized model REJECTED: " + "; ".join(reasons))
+        raise SystemExit(1)
+
+    if args.promote:
+        shutil.copyfile(args.output, PROMOTED_PATH)
+        with open(os.path.splitext(PROMOTED_PATH)[0] + ".json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Promoted to {PROMOTED_PATH}. Serve it with DEFECT_MODEL_PATH={PROMOTED_PATH}")
+    else:
+        print("Gate passed. Re-run with --promote to make it servable.")
@@ -0,0 +1,176 @@
+"""
+Versioned store of defect model artifacts.
+
+Each registered artifact is copied to MODEL_REGISTRY_DIR/<version>/ next to a
+manifest.json, where version is the short content hash detect.py already
+reports as MODEL_VERSION. ACTIVE.json names the version being served; it is
+updated by the hot-reload endpoint and, when present, takes precedence over
+DEFECT_MODEL_PATH at startup so a restart keeps serving the promoted model.
+
+Usage:
+    python registry.py register ../model/defect_model.pt --notes "week 42 retrain"
+    python registry.py list
+    python registry.py activate <version>
+    python registry.py deactivate
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", os.path.join("..", "model", "registry"))
+ACTIVE_FILE = "ACTIVE.json"
+MANIFEST_FILE = "manifest.json"
+# Versions are short content hashes; names that are not plain directory
+# names (path separators, "..") are refused rather than joined into a path
+_VERSION = re.compile(r"^[A-Za-z0-9._-]+$")
+
+
+def _fingerprint(path):
+    # Same hash as detect._file_fingerprint, so registry versions and served versions match
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _version_dir(self, version):
+        """Directory of version inside the registry. Raises ValueError if version is not a valid name."""
+        if not version or not _VERSION.match(version) or version in (".", ".."):
+            raise ValueError(f"Invalid model version {version!r}")
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, version))
+        # A symlinked version directory must not lead out of the registry either
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Model version {version!r} is outside the registry")
+        return path
+
+    def _manifest_path(self, version):
+        return os.path.join(self._version_dir(version), MANIFEST_FILE)
+
+    def register(self, weights_path, notes=""):
+        """
+        Copies weights_path into the registry and returns its manifest.
+        Registering the same bytes twice returns the existing entry.
+        """
+        version = _fingerprint(weights_path)
+        with self._lock:
+            existing = self.get(version)
+            if existing is not None:
+                return existing
+
+            version_dir = self._version_dir(version)
+            os.makedirs(version_dir, exist_ok=True)
+            filename = os.path.basename(weights_path)
+            shutil.copyfile(weights_path, os.path.join(version_dir, filename))
+            manifest = {
+                "version": version,
+                "filename": filename,
+                "size_bytes": os.path.getsize(weights_path),
+                "registered_at": datetime.now().isoformat(timespec="seconds"),
+                "source": os.path.abspath(weights_path),
+                "notes": notes,
+            }
+            _write_json(self._manifest_path(version), manifest)
+            print(f"Registered model version {version} ({filename})")
+            return manifest
+
+    def get(self, version):
+        """A version's manifest, or None if it is not registered. Raises ValueError for invalid names."""
+        manifest_path = self._manifest_path(version)
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path(self, version):
+        """Filesystem path of a registered artifact, or None if unknown. Raises ValueError for invalid names."""
+        manifest = self.get(version)
+        if manifest is None:
+            return None
+        return os.path.join(self._version_dir(version), os.path.basename(manifest["filename"]))
+
+    def versions(self):
+        """All manifests, newest first."""
+        if not os.path.isdir(self.root):
+            return []
+        manifests = []
+        for name in os.listdir(self.root):
+            try:
+                manifest = self.get(name)
+            except ValueError:
+                continue
+            if manifest is not None:
+                manifests.append(manifest)
+        return sorted(manifests, key=lambda m: m["registered_at"], reverse=True)
+
+    def active_version(self):
+        try:
+            with open(os.path.join(self.root, ACTIVE_FILE), "r", encoding="utf-8") as f:
+                version = json.load(f).get("version")
+            return version if self.get(version) is not None else None
+        except (OSError, ValueError):
+            return None
+
+    def set_active(self, version):
+        if self.get(version) is None:
+            raise KeyError(version)
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(os.path.join(self.root, ACTIVE_FILE), {
+            "version": version,
+            "activated_at": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def clear_active(self):
+        try:
+            os.remove(os.path.join(self.root, ACTIVE_FILE))
+        except FileNotFoundError:
+            pass
+
+
+registry = ModelRegistry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned defect model artifacts.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    register_cmd = sub.add_parser("register", help="Copy a weights file into the registry")
+    register_cmd.add_argument("weights")
+    register_cmd.add_argument("--notes", default="")
+    sub.add_parser("list", help="List registered versions")
+    activate_cmd = sub.add_parser("activate", help="Serve this version from the next startup")
+    activate_cmd.add_argument("version")
+    sub.add_parser("deactivate", help="Fall back to DEFECT_MODEL_PATH at the next startup")
+    args = parser.parse_args()
+
+    if args.command == "register":
+        print(json.dumps(registry.register(args.weights, args.notes), indent=2))
+    elif args.command == "list":
+        active = registry.active_version()
+        for manifest in registry.versions():
+            marker = "*" if manifest["version"] == active else " "
+            print(f"{marker} {manifest['version']}  {manifest['registered_at']}  {manifest['filename']}  {manifest['notes']}")
+    elif args.command == "activate":
+        registry.set_active(args.version)
+        print(f"Version {args.version} will be served from the next startup (or use the reload endpoint).")
+    else:
+        registry.clear_active()
+        print("Registry override cleared; DEFECT_MODEL_PATH is used from the next startup.")
@@ -0,0 +1,115 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+    Dynamic micro-batching for a model.
+
+    Requests submitted from any thread are queued; a single worker thread takes
+    the first waiting request, keeps collecting until max_batch_size items are
+    queued or max_wait_ms has passed, runs one batched call and fans the results
+    back out to each request's Future.
+
+    run_batch must take a list of items and return a list of results in the
+    same order.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=8, max_wait_ms=10):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Counters for tuning max_batch_size / max_wait_ms
+        self.batches_run = 0
+        self.items_run = 0
+        self.largest_batch = 0
+
+    def submit(self, item):
+        """Queues one item and returns a concurrent.futures.Future for its result."""
+        if self.max_batch_size == 1:
+            # Batching disabled: run inline on the caller's thread
+            future = Future()
+            try:
+                future.set_result(self._run([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth(),
+            "batches_run": self.batches_run,
+            "items_run": self.items_run,
+            "largest_batch": self.largest_batch,
+            "average_batch_size": (self.items_run / self.batches_run) if self.batches_run else 0.0,
+        }
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name=f"batch-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self, items):
+        results = self.run_batch(items)
+        self.batches_run += 1
+        self.items_run += len(items)
+        self.largest_batch = max(self.largest_batch, len(items))
+        return results
+
+    def _collect(self):
+        """Blocks for the first item, then gathers more until the batch is full or the wait expires."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            # Drop requests whose caller already gave up
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self._run([item for item, _future in batch])
+            except Exception as e:
+                print(f"Batch inference error in {self.name} scheduler: {e}")
+                for _item, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_item, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,302 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import detect
+from backends import load_model
+from executor import BoundedExecutor, PoolSaturated
+from evaluate_model import box_iou, IOU_THRESHOLD
+from registry import registry
+
+# Shadow evaluation: a sampled fraction of /predict requests also runs a
+# candidate defect model off the response path, and the comparison with the
+# served model is stored in SQLite. SHADOW_MODEL_VERSION names a registry
+# version; SHADOW_MODEL_PATH a weights file. SHADOW_SAMPLE_RATE=0 disables it.
+SHADOW_MODEL_VERSION = os.getenv("SHADOW_MODEL_VERSION", "")
+SHADOW_MODEL_PATH = os.getenv("SHADOW_MODEL_PATH", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0"))
+SHADOW_MAX_QUEUE = int(os.getenv("SHADOW_MAX_QUEUE", "4"))
+SHADOW_DB_PATH = os.getenv("SHADOW_DB_PATH", os.path.join("..", "model", "shadow_eval.sqlite3"))
+
+CONFIDENCE_BINS = 10
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shadow_samples (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    content_hash TEXT,
+    primary_version TEXT,
+    candidate_version TEXT NOT NULL,
+    inference_size INTEGER,
+    primary_ms REAL,
+    candidate_ms REAL,
+    comparison TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shadow_samples_candidate ON shadow_samples (candidate_version, created_at);
+"""
+
+
+def compare_detections(primary, candidate):
+    """
+    Greedily matches same-class detections at IoU >= 0.5 (highest confidence
+    first) and returns per-class counts and confidences:
+    {class: {"primary", "candidate", "matched", "primary_conf", "candidate_conf", "matched_delta"}}.
+    """
+    per_class = {}
+
+    def entry(cls):
+        return per_class.setdefault(cls, {
+            "primary": 0, "candidate": 0, "matched": 0,
+            "primary_conf": [], "candidate_conf": [], "matched_delta": [],
+        })
+
+    for det in primary:
+        e = entry(det["class"])
+        e["primary"] += 1
+        e["primary_conf"].append(det["confidence"])
+    for det in candidate:
+        e = entry(det["class"])
+        e["candidate"] += 1
+        e["candidate_conf"].append(det["confidence"])
+
+    unmatched = sorted(primary, key=lambda d: -d["confidence"])
+    for det in sorted(candidate, key=lambda d: -d["confidence"]):
+        best, best_iou = None, IOU_THRESHOLD
+        for other in unmatched:
+            if other["class"] != det["class"]:
+                continue
+            iou = box_iou(det["normalized_bbox"], other["normalized_bbox"])
+            if iou >= best_iou:
+                best, best_iou = other, iou
+        if best is not None:
+            unmatched.remove(best)
+            e = per_class[det["class"]]
+            e["matched"] += 1
+            e["matched_delta"].append(round(det["confidence"] - best["confidence"], 4))
+    return per_class
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def _histogram(values):
+    counts = [0] * CONFIDENCE_BINS
+    for v in values:
+        counts[min(CONFIDENCE_BINS - 1, int(v * CONFIDENCE_BINS))] += 1
+    return counts
+
+
+class ShadowStore:
+    """Append-only SQLite log of shadow comparisons, one row per sampled request."""
+
+    def __init__(self, path=SHADOW_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    conn.executescript(_SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def add(self, row):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO shadow_samples (created_at, content_hash, primary_version, candidate_version,"
+                " inference_size, primary_ms, candidate_ms, comparison) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    time.time(), row["content_hash"], row["primary_version"], row["candidate_version"],
+                    row["inference_size"], row["primary_ms"], row["candidate_ms"], json.dumps(row["comparison"]),
+                ),
+            )
+
+    def summary(self, candidate_version, since=None):
+        """Aggregates every sample for candidate_version (optionally since a unix time)."""
+        if not os.path.exists(self.path):
+            return {"candidate_version": candidate_version, "samples": 0}
+        query = "SELECT primary_version, primary_ms, candidate_ms, comparison FROM shadow_samples WHERE candidate_version = ?"
+        params = [candidate_version]
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        primary_ms, candidate_ms, primary_versions = [], [], set()
+        classes = {}
+        for primary_version, p_ms, c_ms, comparison in rows:
+            primary_versions.add(primary_version)
+            if p_ms is not None:
+                primary_ms.append(p_ms)
+            candidate_ms.append(c_ms)
+            for cls, stats in json.loads(comparison).items():
+                agg = classes.setdefault(cls, {
+                    "primary": 0, "candidate": 0, "matched": 0,
+                    "primary_conf": [], "candidate_conf": [], "matched_delta": [],
+                })
+                for key, value in stats.items():
+                    agg[key] += value
+
+        per_class = {}
+        for cls, agg in sorted(classes.items()):
+            union = agg["primary"] + agg["candidate"] - agg["matched"]
+            deltas = agg["matched_delta"]
+            per_class[cls] = {
+                "primary": agg["primary"],
+                "candidate": agg["candidate"],
+                "matched": agg["matched"],
+                # Matched boxes over all distinct boxes either model produced
+                "agreement": agg["matched"] / union if union else 1.0,
+                "mean_confidence_delta": sum(deltas) / len(deltas) if deltas else None,
+                "primary_confidence_histogram": _histogram(agg["primary_conf"]),
+                "candidate_confidence_histogram": _histogram(agg["candidate_conf"]),
+            }
+
+        return {
+            "candidate_version": candidate_version,
+            "primary_versions": sorted(v for v in primary_versions if v),
+            "samples": len(rows),
+            "latency_ms": {
+                "primary_p50": _percentile(primary_ms, 0.5),
+                "primary_p95": _percentile(primary_ms, 0.95),
+                "candidate_p50": _percentile(candidate_ms, 0.5),
+                "candidate_p95": _percentile(candidate_ms, 0.95),
+            },
+            "per_class": per_class,
+        }
+
+
+class ShadowEvaluator:
+    """
+    Runs a candidate defect model on a sample of served requests.
+
+    Sampled frames go to a single-thread pool with a small backlog; a frame
+    is dropped (counted as shed) instead of queued whenever the primary model
+    pool or batch scheduler is busy or that backlog is full, so shadow work
+    never competes with live traffic. The candidate model is loaded on the
+    shadow thread the first time it is needed.
+    """
+
+    def __init__(self, sample_rate=SHADOW_SAMPLE_RATE, version=SHADOW_MODEL_VERSION,
+                 path=SHADOW_MODEL_PATH, store=None):
+        self.store = store or ShadowStore()
+        self._pool = BoundedExecutor("shadow", max_workers=1, max_queue=SHADOW_MAX_QUEUE)
+        self._lock = threading.Lock()
+        self._model = None
+        self._model_version = None
+        self.candidate_path = None
+        self.sample_rate = 0.0
+        self.sampled = 0
+        self.shed = 0
+        self.failed = 0
+        self.configure(sample_rate=sample_rate, version=version, path=path)
+
+    def configure(self, sample_rate=None, version=None, path=None):
+        """Switches the candidate (registry version or weights path) and/or the sample rate."""
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+            if version:
+                path = registry.path(version)
+                if path is None:
+                    raise KeyError(version)
+            if path and path != self.candidate_path:
+                self.candidate_path = path
+                self._model = None
+                self._model_version = None
+                self.sampled = 0
+                self.shed = 0
+                self.failed = 0
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 and bool(self.candidate_path)
+
+    def _candidate(self):
+        with self._lock:
+            if self._model is not None:
+                return self._model, self._model_version
+            path = self.candidate_path
+        # Loaded without the lock so configure() never waits on it; the
+        # shadow pool has a single thread, so loads cannot overlap
+        model, _backend = load_model(path, imgsz=detect.INFERENCE_SIZE)
+        version = detect._file_fingerprint(path)
+        with self._lock:
+            # Unless configure() switched candidates meanwhile
+            if path == self.candidate_path:
+                self._model, self._model_version = model, version
+        print(f"Shadow candidate {version} loaded from {path}")
+        return model, version
+
+    def maybe_submit(self, frame, inspection, content_hash, busy):
+        """
+        Samples one served request. busy is whether the primary path has work
+        queued. Never blocks and never raises.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            return
+        detections = inspection["detections"]
+        if not isinstance(detections, list):
+            return
+        if busy:
+            self.shed += 1
+            return
+        try:
+            self._pool.submit(self._evaluate, frame, inspection, content_hash)
+            self.sampled += 1
+        except PoolSaturated:
+            self.shed += 1
+
+    def _evaluate(self, frame, inspection, content_hash):
+        try:
+            candidate_model, candidate_version = self._candidate()
+            started = time.perf_counter()
+            candidate = detect.predict_images([frame], defect_model=candidate_model)[0]
+            candidate_ms = round((time.perf_counter() - started) * 1000, 1)
+            if not isinstance(candidate, list):
+                raise RuntimeError(candidate.get("error", "candidate inference failed"))
+            self.store.add({
+                "content_hash": content_hash,
+                "primary_version": inspection.get("model_version"),
+                "candidate_version": candidate_version,
+                "inference_size": frame.inference_size,
+                "primary_ms": inspection.get("defect_ms"),
+                "candidate_ms": candidate_ms,
+                "comparison": compare_detections(inspection["detections"], candidate),
+            })
+        except Exception as e:
+            self.failed += 1
+            print(f"Shadow evaluation failed: {e}")
+
+    def summary(self, since=None):
+        if not self.candidate_path:
+            return {"enabled": False, **self.stats()}
+        version = self._model_version or detect._file_fingerprint(self.candidate_path)
+        return {**self.store.summary(version, since), **self.stats()}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "candidate_path": self.candidate_path,
+            "sample_rate": self.sample_rate,
+            "sampled": self.sampled,
+            "shed": self.shed,
+            "failed": self.failed,
+            "pool": self._pool.stats(),
+        }
+
+
+shadow = ShadowEvaluator()
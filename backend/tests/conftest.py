@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules are imported as top-level modules, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Clock:
+    """
+    Stand-in for time.time / time.monotonic: returns now, which tests move by
+    hand, and advances it by step on every reading (step=1 keeps readings
+    strictly increasing).
+    """
+
+    def __init__(self, now=1000.0, step=0.0):
+        self.now = now
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
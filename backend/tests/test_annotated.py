@@ -0,0 +1,61 @@
+import pytest
+from PIL import Image
+
+from annotated import AnnotatedImageCache, annotated_key
+from objectstore import MemoryStorage
+
+
+@pytest.fixture
+def scan(tmp_path):
+    path = tmp_path / "scan.jpg"
+    Image.new("RGB", (200, 100), "white").save(path)
+    return {
+        "id": "scan1",
+        "image_url": str(path),
+        "model_version": "abc123",
+        "detections": [{"class": "dent", "confidence": 0.9, "bbox": [10, 10, 60, 60]}],
+    }
+
+
+@pytest.fixture
+def cache():
+    return AnnotatedImageCache(backend=MemoryStorage(), memory_entries=4, memory_ttl=60)
+
+
+def stored(cache):
+    return sorted(cache.backend.objects)
+
+
+def test_rendered_once_then_served(cache, scan):
+    key, data = cache.get(scan)
+    assert data[:3] == b"\xff\xd8\xff"
+    assert stored(cache) == [key]
+    assert cache.get(scan) == (key, data)
+    # A fresh process finds it in storage
+    other = AnnotatedImageCache(backend=cache.backend)
+    assert other.get(scan) == (key, data)
+    assert (cache.rendered, other.rendered, other.stored_hits) == (1, 0, 1)
+
+
+def test_new_detections_replace_the_old_rendering(cache, scan):
+    old_key, _ = cache.get(scan)
+    changed = {**scan, "detections": []}
+    new_key, _ = cache.get(changed)
+    assert new_key != old_key
+    assert stored(cache) == [new_key]
+
+
+def test_invalidate_removes_every_rendering(cache, scan):
+    cache.get(scan)
+    # A rendering of earlier detections left behind by an older version
+    cache.backend.write_bytes("annotated/scan1/old-0000.jpg", b"stale")
+    cache.backend.write_bytes("annotated/scan10/x.jpg", b"other scan")
+    cache.invalidate(scan)
+    assert stored(cache) == ["annotated/scan10/x.jpg"]
+    assert cache._memory.get(annotated_key(scan)) is None
+
+
+def test_missing_image_is_not_cached(cache, scan):
+    broken = {**scan, "image_url": "/nonexistent/scan.jpg"}
+    assert cache.get(broken)[1] is None
+    assert cache.failed == 1 and stored(cache) == []
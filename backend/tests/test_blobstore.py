@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from blobstore import BlobStore, blob_key, is_blob_key
+from objectstore import MemoryStorage
+
+SHA = "ab" * 32
+
+
+def companions(key):
+    return [f"derived/thumbnail/{key}"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(MemoryStorage(), db_path=str(tmp_path / "blobs.sqlite3"), companions=companions)
+
+
+def test_blob_keys():
+    key = blob_key(SHA, "jpeg")
+    assert key == f"blobs/ab/ab/{SHA}.jpg"
+    assert is_blob_key(key)
+    assert not is_blob_key(f"derived/thumbnail/{key}")
+    assert not is_blob_key("blobs/ab/ab/../../profile.jpg")
+
+
+def test_same_bytes_are_stored_once_and_counted(store):
+    key = store.put_bytes(b"image", SHA, "jpeg", "doc-1")
+    assert store.put_bytes(b"image", SHA, "jpeg", "doc-2") == key
+    # A ref is only counted once per key
+    store.put_bytes(b"image", SHA, "jpeg", "doc-2")
+    assert store.references(key) == 2
+    assert sorted(store.refs(key)) == ["doc-1", "doc-2"]
+    assert store.stats()["blobs"] == 1
+    assert (store.stored, store.deduplicated) == (1, 2)
+
+
+def test_last_release_deletes_blob_and_companions(store):
+    key = store.put_bytes(b"image", SHA, "jpeg", "doc-1")
+    store.put_bytes(b"image", SHA, "jpeg", "doc-2")
+    store.backend.write_bytes(companions(key)[0], b"thumb")
+
+    assert store.release(key, "doc-1") is False
+    assert store.backend.exists(key)
+    assert store.release(key, "doc-2") is True
+    assert not store.backend.exists(key)
+    assert not store.backend.exists(companions(key)[0])
+    assert store.stats()["blobs"] == 0
+
+
+def test_put_file_consumes_the_source(store, tmp_path):
+    first, second = tmp_path / "a.part", tmp_path / "b.part"
+    first.write_bytes(b"image")
+    second.write_bytes(b"image")
+    key = store.put_file(str(first), SHA, "jpeg", "doc-1")
+    store.put_file(str(second), SHA, "jpeg", "doc-2")
+    assert not first.exists() and not second.exists()
+    assert store.backend.read(key) == b"image"
+
+
+def test_upload_runs_without_the_write_lock(store):
+    def place():
+        # Another process taking the write lock must not wait on the upload
+        conn = sqlite3.connect(store.db_path, timeout=0, isolation_level=None)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("ROLLBACK")
+        conn.close()
+        store.backend.write_bytes(key, b"image")
+
+    key = blob_key(SHA, "jpeg")
+    assert store._add(key, "doc-1", 5, place) is True
+    assert store.references(key) == 1
+
+
+def test_failed_upload_drops_its_reference(store):
+    def place():
+        raise OSError("bucket unavailable")
+
+    key = blob_key(SHA, "jpeg")
+    with pytest.raises(OSError):
+        store._add(key, "doc-1", 5, place)
+    assert store.references(key) == 0
+    assert store.stats()["blobs"] == 0
@@ -0,0 +1,79 @@
+import os
+import time
+
+import pytest
+
+import cache as cache_module
+from cache import InferenceCache, TTLCache
+
+
+@pytest.fixture(autouse=True)
+def frozen_monotonic(monkeypatch, clock):
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(max_entries=2, ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(max_entries=10, ttl_seconds=60)
+    cache.set("a", 1)
+    clock.now += 59
+    assert cache.get("a") == 1
+    clock.now += 2
+    assert cache.get("a", "gone") == "gone"
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_pop_returns_live_entries_only(clock):
+    cache = TTLCache(ttl_seconds=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+    clock.now += 61
+    assert cache.pop("b", "expired") == "expired"
+
+
+def test_inference_keys_cover_content_and_signature():
+    key = InferenceCache.key("hash", "model-v1|640")
+    assert key == InferenceCache.key("hash", "model-v1|640")
+    assert key != InferenceCache.key("hash", "model-v2|640")
+    assert key != InferenceCache.key("other", "model-v1|640")
+
+
+def test_memory_tier_without_disk():
+    cache = InferenceCache(max_entries=4, ttl_seconds=60)
+    key = InferenceCache.key("hash", "sig")
+    assert cache.get(key) is None
+    cache.set(key, {"detections": []})
+    assert cache.get(key) == {"detections": []}
+    assert cache.stats()["hit_rate"] == 0.5
+
+
+def test_disk_tier_survives_a_restart_until_it_expires(tmp_path):
+    key = InferenceCache.key("hash", "sig")
+    InferenceCache(ttl_seconds=60, disk_dir=str(tmp_path)).set(key, {"detections": [1]})
+
+    restarted = InferenceCache(ttl_seconds=60, disk_dir=str(tmp_path))
+    assert restarted.get(key) == {"detections": [1]}
+    assert restarted.disk_hits == 1
+    # Served from memory from then on
+    assert restarted.get(key) == {"detections": [1]}
+    assert restarted.disk_hits == 1
+
+    path = restarted._disk_path(key)
+    old = time.time() - 120
+    os.utime(path, (old, old))
+    expired = InferenceCache(ttl_seconds=60, disk_dir=str(tmp_path))
+    assert expired.get(key) is None
+    assert not os.path.exists(path)
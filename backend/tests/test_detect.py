@@ -0,0 +1,88 @@
+from concurrent.futures import Future
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("cv2")
+
+import detect  # noqa: E402
+from detect import decode_image, inspect_image  # noqa: E402
+
+
+def encoded(size, image_format="JPEG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, "gray").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def test_large_jpegs_are_decoded_at_a_reduced_scale():
+    frame = decode_image(encoded((2560, 1920)), inference_size=640)
+    assert frame.shape == (480, 640)
+    assert frame.decode_scale == 4.0
+    assert frame.original_shape == (1920, 2560)
+
+
+def test_reduced_decode_still_covers_the_inference_size():
+    frame = decode_image(encoded((2560, 1920)), inference_size=1280)
+    assert frame.shape == (960, 1280)
+
+
+def test_tiling_and_other_formats_decode_at_full_size():
+    assert decode_image(encoded((2560, 1920)), inference_size=640, full_resolution=True).shape == (1920, 2560)
+    assert decode_image(encoded((2560, 1920), "PNG"), inference_size=640).shape == (1920, 2560)
+    assert decode_image(b"not an image").image is None
+
+
+def test_letterbox_and_boxes_back_to_the_original():
+    pytest.importorskip("torch")
+    frame = decode_image(encoded((2560, 1920)), inference_size=640)
+    tensor, ratio, pad = frame.letterbox()
+    assert tuple(tensor.shape) == (1, 3, 640, 640)
+    assert ratio == 1.0 and pad == (0.0, 80.0)
+    # A box over the decoded 640 x 480 image's centre, in letterbox space
+    box = frame.scale_boxes([[160, 200, 480, 440]], ratio, pad)
+    np.testing.assert_allclose(box, [[640, 480, 1920, 1440]])
+
+
+def completed(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+@pytest.fixture
+def models(monkeypatch):
+    """Stubs the defect model and vehicle gate; returns the calls made to the gate."""
+    gate_calls = []
+    detections = []
+    monkeypatch.setattr(detect, "submit_prediction", lambda frame: completed(detections))
+    monkeypatch.setattr(detect, "submit_analysis", lambda frame: gate_calls.append(frame) or completed({"is_vehicle": True}))
+    return detections, gate_calls
+
+
+def test_cascade_skips_the_gate_for_confident_defects(models):
+    detections, gate_calls = models
+    detections.append({"class": "dent", "confidence": detect.CASCADE_CONFIDENCE, "normalized_bbox": [0, 0, 1, 1]})
+    inspection = inspect_image(encoded((64, 64)), cascade=True)
+    assert inspection["analysis"] is None
+    assert inspection["stages"] == ["defect"]
+    assert gate_calls == []
+
+
+def test_cascade_runs_the_gate_without_confident_defects(models):
+    detections, gate_calls = models
+    detections.append({"class": "dent", "confidence": detect.CASCADE_CONFIDENCE / 2, "normalized_bbox": [0, 0, 1, 1]})
+    inspection = inspect_image(encoded((64, 64)), cascade=True)
+    assert inspection["analysis"] == {"is_vehicle": True}
+    assert inspection["stages"] == ["defect", "vehicle_gate"]
+    assert len(gate_calls) == 1
+
+
+def test_without_cascade_both_models_run(models):
+    detections, gate_calls = models
+    detections.append({"class": "dent", "confidence": 0.99, "normalized_bbox": [0, 0, 1, 1]})
+    inspection = inspect_image(encoded((64, 64)), cascade=False)
+    assert inspection["analysis"] == {"is_vehicle": True}
+    assert len(gate_calls) == 1
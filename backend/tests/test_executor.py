@@ -0,0 +1,54 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import executor  # noqa: E402
+from executor import BoundedExecutor, PoolSaturated  # noqa: E402
+
+
+@pytest.fixture
+def blocked_pool():
+    """A pool with one worker and one queue slot, both taken until release is set."""
+    pool = BoundedExecutor("test", max_workers=1, max_queue=1, retry_after=7)
+    release = threading.Event()
+    futures = [pool.submit(release.wait, 5) for _ in range(2)]
+    yield pool
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+
+
+def test_full_pool_rejects_with_503_and_retry_after(blocked_pool):
+    with pytest.raises(PoolSaturated) as raised:
+        blocked_pool.submit(lambda: None)
+    assert raised.value.status_code == 503
+    assert raised.value.headers == {"Retry-After": "7"}
+    assert raised.value.detail["pool"] == "test"
+    assert blocked_pool.stats()["rejected"] == 1
+    assert blocked_pool.is_busy()
+
+
+def test_run_raises_in_the_awaiting_handler(blocked_pool):
+    with pytest.raises(PoolSaturated):
+        asyncio.run(blocked_pool.run(lambda: None))
+
+
+def test_slots_are_freed_when_jobs_finish():
+    pool = BoundedExecutor("test", max_workers=1, max_queue=0)
+    assert asyncio.run(pool.run(sum, [1, 2, 3])) == 6
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(lambda: 1 / 0).result(timeout=5)
+    assert pool.submit(lambda: "again").result(timeout=5) == "again"
+    stats = pool.stats()
+    assert (stats["in_flight"], stats["completed"], stats["rejected"]) == (0, 3, 0)
+
+
+def test_model_pool_has_a_thread_per_batch_slot(monkeypatch):
+    monkeypatch.setattr(executor, "MODEL_POOL_MIN_WORKERS", 8)
+    monkeypatch.setenv("MODEL_POOL_WORKERS", "2")
+    assert executor._model_pool_workers() == 8
+    monkeypatch.setenv("MODEL_POOL_WORKERS", "12")
+    assert executor._model_pool_workers() == 12
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import struct
+import zlib
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("fastapi")
+pytest.importorskip("aiofiles")
+
+from fastapi import HTTPException  # noqa: E402
+
+from ingest import PART_SUFFIX, UploadSizeLimit, ingest_upload, remove_partial_uploads  # noqa: E402
+
+
+class FakeUpload:
+    """Just enough of starlette's UploadFile for ingest_upload."""
+
+    def __init__(self, data, filename="scan.jpg"):
+        self.filename = filename
+        self._body = BytesIO(data)
+
+    async def read(self, size=-1):
+        return self._body.read(size)
+
+
+def ingest(data, **kwargs):
+    return asyncio.run(ingest_upload(FakeUpload(data), **kwargs))
+
+
+def encoded(size=(64, 48), image_format="JPEG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, "white").save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def png_header(width, height):
+    """A PNG declaring width x height: signature, IHDR and the start of an IDAT chunk."""
+    ihdr = b"IHDR" + struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    idat = struct.pack(">I", 1024) + b"IDAT"
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + ihdr + struct.pack(">I", zlib.crc32(ihdr)) + idat
+
+
+def status_of(data, **kwargs):
+    with pytest.raises(HTTPException) as excinfo:
+        ingest(data, **kwargs)
+    return excinfo.value.status_code
+
+
+def test_reads_format_dimensions_and_hash():
+    data = encoded()
+    upload = ingest(data)
+    assert (upload.format, upload.width, upload.height) == ("jpeg", 64, 48)
+    assert upload.size == len(data)
+    assert upload.contents == data
+    assert len(upload.sha256) == 64
+
+
+def test_rejects_oversized_body():
+    assert status_of(encoded(), max_bytes=100) == 413
+
+
+def test_rejects_too_many_pixels():
+    assert status_of(encoded((100, 100)), max_pixels=9999) == 413
+
+
+def test_rejects_decompression_bomb_header():
+    # 40000 x 40000 makes Pillow raise DecompressionBombError from Image.open
+    with pytest.raises(HTTPException) as excinfo:
+        ingest(png_header(40000, 40000) + b"\x00" * 64)
+    assert excinfo.value.status_code == 413
+    assert "larger than the limit" in excinfo.value.detail
+
+
+def test_rejects_unreadable_dimensions():
+    # JPEG magic, but no frame header anywhere
+    assert status_of(b"\xff\xd8\xff\xe0" + b"\x00" * 4096) == 413
+
+
+def test_rejects_unknown_format_and_empty_body():
+    assert status_of(b"%PDF-1.7 not an image at all") == 415
+    assert status_of(b"") == 400
+
+
+def test_spools_to_disk_and_discards_on_rejection(tmp_path):
+    upload = ingest(encoded(), keep_contents=False, spool_dir=str(tmp_path))
+    assert upload.contents is None
+    assert os.path.exists(upload.path) and upload.path.endswith(PART_SUFFIX)
+    assert asyncio.run(upload.read()) == encoded()
+
+    upload.discard()
+    with pytest.raises(HTTPException):
+        ingest(encoded(), keep_contents=False, spool_dir=str(tmp_path), max_bytes=100)
+    assert os.listdir(tmp_path) == []
+
+
+def test_remove_partial_uploads(tmp_path):
+    (tmp_path / f".abc{PART_SUFFIX}").write_bytes(b"partial")
+    (tmp_path / "kept.jpg").write_bytes(b"image")
+    remove_partial_uploads(str(tmp_path))
+    assert os.listdir(tmp_path) == ["kept.jpg"]
+
+
+async def echo_app(scope, receive, send):
+    """Reads the whole body and answers 200 with its length."""
+    size = 0
+    while True:
+        message = await receive()
+        size += len(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(size).encode()})
+
+
+def request(path, chunks, method="POST", content_length=None):
+    """Status and body of a request through UploadSizeLimit (100 bytes, 1000 under /big)."""
+    middleware = UploadSizeLimit(echo_app, default_limit=100, limits={"/big": 1000})
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": method, "path": path, "headers": headers}
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+def test_declared_oversized_bodies_are_refused_unread():
+    assert request("/api/v1/predict", [b"x" * 10], content_length=101)[0] == 413
+
+
+def test_streamed_bodies_are_cut_off_at_the_limit():
+    status, body = request("/api/v1/predict", [b"x" * 60, b"x" * 60])
+    assert status == 413
+    assert b"100 bytes" in body
+
+
+def test_bodies_within_their_path_limit_pass():
+    assert request("/api/v1/predict", [b"x" * 50, b"x" * 50], content_length=100) == (200, b"100")
+    assert request("/big/upload", [b"x" * 600, b"x" * 300]) == (200, b"900")
+    assert request("/api/v1/history", [b"x" * 500], method="GET") == (200, b"500")
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+import jobs
+from jobs import JobRunner, JobStore
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch, clock):
+    # Strictly increasing, so jobs created back to back are ordered
+    clock.step = 1
+    monkeypatch.setattr(jobs.time, "time", clock)
+    return JobStore(path=str(tmp_path / "jobs.sqlite3"))
+
+
+def items(prefix, count):
+    return [(f"{prefix}{i}.jpg", f"/data/{prefix}{i}.jpg") for i in range(count)]
+
+
+def claim_all(store, lanes=("interactive", "bulk")):
+    claimed = []
+    while (item := store.claim(lanes)) is not None:
+        claimed.append(item["filename"])
+    return claimed
+
+
+def test_claim_order_is_lane_then_job_age_then_image(store):
+    store.create("u1", items("bulk-old", 2), lane="bulk")
+    store.create("u1", items("bulk-new", 1), lane="bulk")
+    store.create("u2", items("urgent", 2), lane="interactive")
+    assert claim_all(store) == ["urgent0.jpg", "urgent1.jpg", "bulk-old0.jpg", "bulk-old1.jpg", "bulk-new0.jpg"]
+
+
+def test_claim_is_limited_to_the_given_lanes(store):
+    store.create("u1", items("bulk", 1), lane="bulk")
+    assert store.claim(["interactive"]) is None
+    assert store.claim(["bulk"])["filename"] == "bulk0.jpg"
+
+
+def test_cancelled_jobs_are_not_claimed(store):
+    job_id = store.create("u1", items("a", 3), lane="bulk")
+    store.claim(["bulk"])
+    assert store.cancel(job_id) == 1  # one item still running
+    assert store.claim(["bulk"]) is None
+    assert store.get(job_id)["status"] == "cancelled"
+
+
+def test_job_is_done_once_every_item_finished(store):
+    job_id = store.create("u1", items("a", 2), lane="bulk")
+    first, second = store.claim(["bulk"]), store.claim(["bulk"])
+    store.finish_item(job_id, first["idx"], result={"status": "ok"})
+    assert store.get(job_id)["status"] == "running"
+    store.finish_item(job_id, second["idx"], error="Could not decode image")
+    job = store.get(job_id)
+    assert (job["status"], job["completed"], job["failed"]) == ("done", 1, 1)
+    assert [item["status"] for item in store.items(job_id)] == ["done", "failed"]
+
+
+def test_interrupted_items_are_requeued(store):
+    job_id = store.create("u1", items("a", 2), lane="bulk")
+    store.claim(["bulk"])
+    # A new store over the same file (a restart) leaves running items alone...
+    restarted = JobStore(path=store.path)
+    assert restarted.queue_depth() == {"bulk": 1}
+    # ...until the runner recovers them
+    assert restarted.requeue_interrupted() == 1
+    assert restarted.queue_depth() == {"bulk": 2}
+    assert [item["idx"] for item in (restarted.claim(["bulk"]), restarted.claim(["bulk"]))] == [0, 1]
+    assert store.get(job_id)["status"] == "running"
+
+
+def test_runner_drains_the_queue(store):
+    store.create("u1", items("a", 3), lane="bulk")
+    done = threading.Event()
+    processed = []
+
+    def process(path, inference_size):
+        processed.append(path)
+        if len(processed) == 3:
+            done.set()
+        return {"status": "ok"}
+
+    runner = JobRunner(store, process, interactive_busy=lambda: False, workers=1, poll_seconds=0.01)
+    runner.start()
+    try:
+        assert done.wait(5)
+    finally:
+        runner.stop()
+    assert processed == ["/data/a0.jpg", "/data/a1.jpg", "/data/a2.jpg"]
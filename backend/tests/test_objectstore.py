@@ -0,0 +1,94 @@
+import asyncio
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from objectstore import (
+    PUBLIC_API_URL, STORAGE_ROUTE, LocalStorage, MemoryStorage, sign_url, url_signature_valid,
+)
+
+KEY = "blobs/ab/cd/abcd.jpg"
+
+
+def exercise(storage, tmp_path):
+    """put/get/delete through the async API and the blocking primitives."""
+    async def run():
+        url = await storage.put(KEY, b"0123456789")
+        assert storage.key_for_url(url) == KEY
+        assert await storage.get(KEY) == b"0123456789"
+        assert await storage.get(KEY, 2, 4) == b"234"
+        await storage.delete(KEY)
+
+    asyncio.run(run())
+    assert not storage.exists(KEY)
+    with pytest.raises(FileNotFoundError):
+        storage.read(KEY)
+    # Deleting a missing key is not an error
+    storage.remove(KEY)
+
+    src = tmp_path / "spooled.part"
+    src.write_bytes(b"spooled")
+    storage.write_file(KEY, str(src))
+    assert storage.read(KEY) == b"spooled"
+    assert not src.exists()
+
+    # remove_prefix takes a whole "directory" and nothing next to it
+    for key in ("annotated/scan1/a.jpg", "annotated/scan1/b.jpg", "annotated/scan10/a.jpg"):
+        storage.write_bytes(key, b"x")
+    storage.remove_prefix("annotated/scan1/")
+    assert not storage.exists("annotated/scan1/a.jpg") and not storage.exists("annotated/scan1/b.jpg")
+    assert storage.exists("annotated/scan10/a.jpg") and storage.exists(KEY)
+    for prefix in ("", "/", "annotated", "annotated//", "/annotated/"):
+        with pytest.raises(ValueError):
+            storage.remove_prefix(prefix)
+
+
+def test_memory_storage(tmp_path):
+    storage = MemoryStorage()
+    exercise(storage, tmp_path)
+    assert storage.url(KEY) == f"{PUBLIC_API_URL}{STORAGE_ROUTE}{KEY}"
+    assert storage.signed_url(KEY).startswith(f"memory://{KEY}?expires=")
+
+
+def test_local_storage(tmp_path):
+    storage = LocalStorage(root=str(tmp_path / "store"))
+    exercise(storage, tmp_path)
+    with pytest.raises(ValueError):
+        storage.path("../outside.jpg")
+
+
+def test_s3_storage_against_moto(tmp_path, monkeypatch):
+    pytest.importorskip("boto3")
+    moto = pytest.importorskip("moto")
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(name, "testing")
+
+    from objectstore import S3Storage
+
+    with moto.mock_aws():
+        storage = S3Storage(bucket="scans", endpoint_url=None, public_url="",
+                            access_key_id="testing", secret_access_key="testing")
+        storage.client.create_bucket(Bucket="scans")
+        exercise(storage, tmp_path)
+
+        before = time.time()
+        presigned = urlparse(storage.signed_url(KEY, expires=60))
+        assert presigned.path.endswith(f"/{KEY}")
+        query = parse_qs(presigned.query)
+        assert "Signature" in query
+        assert before + 59 <= int(query["Expires"][0]) <= time.time() + 61
+
+
+def test_signed_api_urls():
+    url = sign_url(f"{PUBLIC_API_URL}{STORAGE_ROUTE}{KEY}", ttl=60)
+    parsed = urlparse(url)
+    query = parse_qs(parsed.query)
+    expires, signature = int(query["expires"][0]), query["signature"][0]
+    assert expires >= time.time() + 60
+    assert url_signature_valid(parsed.path, expires, signature)
+    assert not url_signature_valid(f"{STORAGE_ROUTE}blobs/ab/cd/other.jpg", expires, signature)
+    assert not url_signature_valid(parsed.path, expires - 1, signature)
+    assert not url_signature_valid(parsed.path, int(time.time()) - 1, signature)
+    # URLs the API does not serve are left alone
+    assert sign_url("https://cdn.example.com/x.jpg") == "https://cdn.example.com/x.jpg"
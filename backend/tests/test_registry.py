@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from registry import ModelRegistry
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(root=str(tmp_path / "registry"))
+
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / "defect_model.pt"
+    path.write_bytes(b"weights")
+    return str(path)
+
+
+def test_register_and_look_up(registry, weights):
+    manifest = registry.register(weights, notes="retrain")
+    version = manifest["version"]
+    assert registry.register(weights) == manifest
+    assert registry.get(version)["notes"] == "retrain"
+    assert os.path.isfile(registry.path(version))
+    assert [m["version"] for m in registry.versions()] == [version]
+    assert registry.path("0123456789ab") is None
+
+
+@pytest.mark.parametrize("version", ["..", ".", "../registry", "a/b", "..\\x", "", None, "v1 beta"])
+def test_invalid_versions_are_refused(registry, version):
+    with pytest.raises(ValueError):
+        registry.path(version)
+    with pytest.raises(ValueError):
+        registry.set_active(version)
+
+
+def test_symlinked_version_cannot_leave_the_registry(registry, weights, tmp_path):
+    registry.register(weights)
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "manifest.json").write_text('{"version": "escape", "filename": "x.pt", "registered_at": "0"}')
+    os.symlink(outside, os.path.join(registry.root, "escape"))
+    with pytest.raises(ValueError):
+        registry.path("escape")
+    # Listing skips it instead of failing
+    assert len(registry.versions()) == 1
+
+
+def test_active_version(registry, weights):
+    version = registry.register(weights)["version"]
+    assert registry.active_version() is None
+    registry.set_active(version)
+    assert registry.active_version() == version
+    registry.clear_active()
+    assert registry.active_version() is None
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from scheduler import BatchScheduler
+
+
+class Recorder:
+    """run_batch that doubles each item and remembers the batches it was given."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.threads = []
+        self.error = error
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.threads.append(threading.current_thread())
+        if self.error is not None:
+            raise self.error
+        return [item * 2 for item in items]
+
+
+def test_concurrent_requests_share_one_batch():
+    run = Recorder()
+    # A long wait: the batch is only run early because it fills up
+    scheduler = BatchScheduler("test", run, max_batch_size=4, max_wait_ms=5000)
+    futures = [scheduler.submit(i) for i in range(4)]
+    assert [future.result(timeout=2) for future in futures] == [0, 2, 4, 6]
+    assert run.batches == [[0, 1, 2, 3]]
+    assert scheduler.stats()["largest_batch"] == 4
+
+
+def test_partial_batch_runs_after_the_wait():
+    run = Recorder()
+    scheduler = BatchScheduler("test", run, max_batch_size=8, max_wait_ms=20)
+    assert scheduler.submit(5).result(timeout=2) == 10
+    assert run.batches == [[5]]
+
+
+def test_batches_are_capped_at_max_batch_size():
+    run = Recorder()
+    scheduler = BatchScheduler("test", run, max_batch_size=2, max_wait_ms=5000)
+    futures = [scheduler.submit(i) for i in range(5)]
+    # The fifth request's batch waits out max_wait_ms for a partner, so it is not checked
+    assert [future.result(timeout=2) for future in futures[:4]] == [0, 2, 4, 6]
+    assert run.batches[:2] == [[0, 1], [2, 3]]
+
+
+def test_batch_errors_reach_every_request():
+    error = RuntimeError("CUDA out of memory")
+    scheduler = BatchScheduler("test", Recorder(error=error), max_batch_size=3, max_wait_ms=5000)
+    futures = [scheduler.submit(i) for i in range(3)]
+    for future in futures:
+        with pytest.raises(RuntimeError) as raised:
+            future.result(timeout=2)
+        assert raised.value is error
+
+
+def test_scheduler_keeps_serving_after_a_failed_batch():
+    run = Recorder(error=ValueError("bad batch"))
+    scheduler = BatchScheduler("test", run, max_batch_size=2, max_wait_ms=10)
+    with pytest.raises(ValueError):
+        scheduler.submit(1).result(timeout=2)
+    run.error = None
+    assert scheduler.submit(2).result(timeout=2) == 4
+
+
+def test_batch_size_one_runs_inline():
+    run = Recorder()
+    scheduler = BatchScheduler("test", run, max_batch_size=1)
+    assert scheduler.submit(3).result(timeout=0) == 6
+    assert run.threads == [threading.current_thread()]
+    failing = BatchScheduler("test", Recorder(error=KeyError("x")), max_batch_size=1)
+    with pytest.raises(KeyError):
+        failing.submit(1).result(timeout=0)
@@ -0,0 +1,65 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from shadow import ShadowStore, compare_detections  # noqa: E402
+
+
+def det(cls, confidence, box):
+    return {"class": cls, "confidence": confidence, "normalized_bbox": box}
+
+
+def test_overlapping_same_class_detections_match():
+    primary = [det("dent", 0.8, [0.1, 0.1, 0.3, 0.3]), det("scratch", 0.6, [0.5, 0.5, 0.7, 0.7])]
+    candidate = [det("dent", 0.9, [0.11, 0.1, 0.31, 0.3]), det("dent", 0.4, [0.5, 0.5, 0.7, 0.7])]
+    comparison = compare_detections(primary, candidate)
+    assert comparison["dent"]["primary"] == 1 and comparison["dent"]["candidate"] == 2
+    assert comparison["dent"]["matched"] == 1
+    assert comparison["dent"]["matched_delta"] == [0.1]
+    # Same place, other class: no match
+    assert comparison["scratch"]["matched"] == 0
+
+
+def test_boxes_below_the_iou_threshold_do_not_match():
+    comparison = compare_detections([det("dent", 0.8, [0.0, 0.0, 0.2, 0.2])], [det("dent", 0.8, [0.1, 0.1, 0.3, 0.3])])
+    assert comparison["dent"]["matched"] == 0
+
+
+def test_each_primary_detection_matches_once_highest_confidence_first():
+    primary = [det("dent", 0.7, [0.1, 0.1, 0.3, 0.3])]
+    candidate = [det("dent", 0.5, [0.1, 0.1, 0.3, 0.3]), det("dent", 0.9, [0.1, 0.1, 0.3, 0.29])]
+    comparison = compare_detections(primary, candidate)
+    assert comparison["dent"]["matched"] == 1
+    assert comparison["dent"]["matched_delta"] == [0.2]
+
+
+def sample(comparison, primary_ms, candidate_ms):
+    return {
+        "content_hash": "hash",
+        "primary_version": "v1",
+        "candidate_version": "v2",
+        "inference_size": 640,
+        "primary_ms": primary_ms,
+        "candidate_ms": candidate_ms,
+        "comparison": comparison,
+    }
+
+
+def test_summary_aggregates_samples(tmp_path):
+    store = ShadowStore(path=str(tmp_path / "shadow.sqlite3"))
+    assert store.summary("v2")["samples"] == 0
+
+    box = [0.1, 0.1, 0.3, 0.3]
+    store.add(sample(compare_detections([det("dent", 0.8, box)], [det("dent", 0.9, box)]), 10.0, 20.0))
+    store.add(sample(compare_detections([det("dent", 0.8, box)], []), 30.0, 40.0))
+
+    summary = store.summary("v2")
+    assert summary["samples"] == 2
+    assert summary["primary_versions"] == ["v1"]
+    assert summary["latency_ms"]["candidate_p95"] == 40.0
+    dent = summary["per_class"]["dent"]
+    assert (dent["primary"], dent["candidate"], dent["matched"]) == (2, 1, 1)
+    assert dent["agreement"] == 0.5
+    assert dent["mean_confidence_delta"] == pytest.approx(0.1)
+    assert sum(dent["primary_confidence_histogram"]) == 2
+    assert store.summary("other")["samples"] == 0
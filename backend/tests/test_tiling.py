@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import tiling
+from tiling import TILE_ALIGN, merge_boxes, tile_grid, tile_origins
+
+
+def test_configured_tile_size_is_aligned():
+    assert tiling.TILE_SIZE % TILE_ALIGN == 0
+    assert tiling._aligned(640, "TILE_SIZE") == 640
+    assert tiling._aligned(650, "TILE_SIZE") == 672
+    assert tiling._aligned(1, "TILE_SIZE") == TILE_ALIGN
+
+
+def test_stride_is_aligned_and_last_tile_is_flush():
+    # 640 * (1 - 0.03125) = 620, rounded down to 608
+    origins = tile_origins(2000, 640, 0.03125)
+    assert all(b - a == 608 for a, b in zip(origins, origins[1:-1]))
+    assert origins[-1] == 2000 - 640
+
+
+@pytest.mark.parametrize("height, width", [(1000, 1500), (640, 641), (3000, 4000)])
+def test_grid_covers_the_image_with_full_edge_tiles(height, width):
+    windows = tile_grid(height, width, tile=640, overlap=0.2)
+    covered = np.zeros((height, width), dtype=bool)
+    for x0, y0, x1, y1 in windows:
+        # Every tile is full size, including the ones flush with the right and bottom edges
+        assert (x1 - x0, y1 - y0) == (640, 640)
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    assert max(x1 for _, _, x1, _ in windows) == width
+    assert max(y1 for _, _, _, y1 in windows) == height
+
+
+def test_image_smaller_than_a_tile_is_one_window():
+    assert tile_grid(300, 500, tile=640, overlap=0.2) == [(0, 0, 500, 300)]
+
+
+# Two overlapping "dent" boxes, a "scratch" on top of them, and a separate dent
+BOXES = [[0, 0, 100, 100], [10, 0, 110, 100], [0, 0, 100, 100], [500, 500, 600, 600]]
+SCORES = [0.9, 0.6, 0.8, 0.5]
+CLASSES = ["dent", "dent", "scratch", "dent"]
+
+
+def test_nms_keeps_the_top_box_of_each_cluster():
+    boxes, scores, classes = merge_boxes(BOXES, SCORES, CLASSES, method="nms", metric="iou", threshold=0.5)
+    assert list(classes) == ["dent", "scratch", "dent"]
+    np.testing.assert_allclose(scores, [0.9, 0.8, 0.5])
+    np.testing.assert_allclose(boxes[0], [0, 0, 100, 100])
+
+
+def test_wbf_fuses_each_cluster_by_confidence():
+    boxes, scores, classes = merge_boxes(BOXES, SCORES, CLASSES, method="wbf", metric="iou", threshold=0.5)
+    assert list(classes) == ["dent", "scratch", "dent"]
+    np.testing.assert_allclose(boxes[0], [4, 0, 104, 100])  # (0 * 0.9 + 10 * 0.6) / 1.5
+    np.testing.assert_allclose(scores[0], 0.75)
+    np.testing.assert_allclose(boxes[2], [500, 500, 600, 600])
+
+
+def test_ios_merges_a_box_cut_off_by_a_tile_edge():
+    # The partial box lies inside the complete one: IoU 0.3, IoS 1.0
+    boxes = [[0, 0, 100, 100], [70, 0, 100, 100]]
+    assert len(merge_boxes(boxes, [0.9, 0.8], ["dent", "dent"], metric="iou", threshold=0.5)[0]) == 2
+    assert len(merge_boxes(boxes, [0.9, 0.8], ["dent", "dent"], metric="ios", threshold=0.5)[0]) == 1
+
+
+def test_merge_of_no_boxes():
+    boxes, scores, classes = merge_boxes([], [], [])
+    assert boxes.shape == (0, 4) and scores.size == 0 and classes.size == 0
@@ -0,0 +1,104 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("cv2")
+
+from tracking import THUMBNAIL_SCALE, StreamTracker, frame_size  # noqa: E402
+
+FRAME = (640, 480)
+THUMB_SHAPE = (FRAME[1] // THUMBNAIL_SCALE, FRAME[0] // THUMBNAIL_SCALE)
+
+
+def detection(bbox):
+    w, h = FRAME
+    return {
+        "class": "dent",
+        "confidence": 0.9,
+        "bbox": bbox,
+        "normalized_bbox": [bbox[0] / w, bbox[1] / h, bbox[2] / w, bbox[3] / h],
+    }
+
+
+def shift(detections, dx, dy):
+    return StreamTracker._shift(detections, dx, dy, THUMB_SHAPE, FRAME)
+
+
+def test_boxes_move_with_the_frame():
+    (moved,) = shift([detection([100, 100, 200, 200])], 2, -1)
+    assert moved["bbox"] == [116, 92, 216, 192]
+    np.testing.assert_allclose(moved["normalized_bbox"], [116 / 640, 92 / 480, 216 / 640, 192 / 480])
+
+
+def test_boxes_are_clamped_to_the_frame():
+    (moved,) = shift([detection([560, 400, 630, 470])], 2, 2)
+    assert moved["bbox"] == [576, 416, 640, 480]
+    assert max(moved["normalized_bbox"]) <= 1.0
+
+
+def test_boxes_moved_out_of_view_are_dropped():
+    kept = detection([300, 300, 400, 400])
+    gone = detection([600, 10, 630, 60])
+    # 10 thumbnail px = 80 frame px to the right: the second box leaves the frame
+    assert [d["bbox"] for d in shift([kept, gone], 10, 0)] == [[380, 300, 480, 400]]
+
+
+def test_errors_and_still_frames_pass_through():
+    error = {"error": "model failed"}
+    assert shift(error, 3, 3) is error
+    detections = [detection([1, 2, 3, 4])]
+    assert shift(detections, 0, 0) is detections
+
+
+def test_frame_size_comes_from_the_header():
+    buffer = BytesIO()
+    Image.new("RGB", (643, 481)).save(buffer, format="JPEG")
+    thumb = np.zeros((61, 81), dtype=np.float32)
+    assert frame_size(buffer.getvalue(), thumb) == (643, 481)
+    assert frame_size(b"not an image", thumb) == (81 * THUMBNAIL_SCALE, 61 * THUMBNAIL_SCALE)
+
+
+def jpeg_frame(offset):
+    """A smooth texture, moved offset pixels to the right."""
+    x = np.arange(FRAME[0] + 200) - 100
+    y = np.arange(FRAME[1])[:, None]
+    texture = 127 + 60 * np.sin(x / 37.0) + 60 * np.cos(y / 29.0) * np.sin(x / 53.0)
+    pixels = texture[:, 100 - offset:100 - offset + FRAME[0]].astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(pixels).convert("RGB").save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def run_stream(analysis):
+    inferred = []
+
+    def infer(contents):
+        inferred.append(contents)
+        return {
+            "detections": [detection([600, 10, 630, 60])],
+            "analysis": analysis,
+            "stages": ["defect"],
+            "model_version": "v1",
+        }
+
+    tracker = StreamTracker(keyframe_interval=100, change_threshold=1.0)
+    first = tracker.step(jpeg_frame(0), infer)
+    second = tracker.step(jpeg_frame(80), infer)
+    return first, second, len(inferred)
+
+
+def test_frame_without_tracked_boxes_runs_the_skipped_vehicle_gate():
+    # The cascade skipped the gate on the keyframe, so analysis is None
+    first, second, inferred = run_stream(analysis=None)
+    assert first["keyframe"] and second["keyframe"]
+    assert inferred == 2
+
+
+def test_frame_without_tracked_boxes_keeps_a_known_analysis():
+    analysis = {"is_vehicle": True, "has_forbidden": False, "forbidden_label": None}
+    _first, second, inferred = run_stream(analysis=analysis)
+    assert not second["keyframe"]
+    assert second["detections"] == [] and second["analysis"] == analysis
+    assert inferred == 1
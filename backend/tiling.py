@@ -0,0 +1,112 @@
+import os
+import numpy as np
+
+# Sliced inference for high-resolution images (see detect.predict_tiled): the
+# full-resolution frame is cut into overlapping TILE_SIZE tiles that the defect
+# model sees at native resolution, so small scratches are not lost to the
+# downscale to INFERENCE_SIZE. Tiles go through the batch scheduler together.
+TILED_INFERENCE = os.getenv("TILED_INFERENCE", "false").lower() in ("1", "true", "yes")
+# YOLO downsamples by up to 32, so tile sizes (rounded up here) and the
+# stride between tiles (rounded down in tile_origins) are multiples of it
+TILE_ALIGN = 32
+
+
+def _aligned(value, name):
+    aligned = max(TILE_ALIGN, -(-value // TILE_ALIGN) * TILE_ALIGN)
+    if aligned != value:
+        print(f"{name}={value} is not a multiple of {TILE_ALIGN}; using {aligned}.")
+    return aligned
+
+
+TILE_SIZE = _aligned(int(os.getenv("TILE_SIZE", "640")), "TILE_SIZE")
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.2"))
+if not 0 <= TILE_OVERLAP < 1:
+    raise ValueError(f"TILE_OVERLAP must be at least 0 and below 1, got {TILE_OVERLAP}")
+# Also run the whole frame at the normal inference size, for defects larger than a tile
+TILE_FULL_FRAME = os.getenv("TILE_FULL_FRAME", "true").lower() in ("1", "true", "yes")
+# How detections from overlapping tiles are merged: "nms" keeps the most
+# confident box of each cluster, "wbf" fuses the cluster into one box
+TILE_MERGE = os.getenv("TILE_MERGE", "nms").strip().lower()
+# Overlap measure and threshold for clustering. "ios" (intersection over the
+# smaller box) also merges the partial box a tile edge cuts off a defect with
+# the complete box from the neighbouring tile, which IoU would keep apart.
+TILE_MATCH_METRIC = os.getenv("TILE_MATCH_METRIC", "ios").strip().lower()
+TILE_MATCH_THRESHOLD = float(os.getenv("TILE_MATCH_THRESHOLD", "0.5"))
+
+
+def tile_origins(length, tile, overlap):
+    """Start offsets of tiles covering [0, length), the last one flush with the edge."""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    if stride >= TILE_ALIGN:
+        # Rounding down only adds overlap, so no pixel is left uncovered
+        stride -= stride % TILE_ALIGN
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+def tile_grid(height, width, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """(x0, y0, x1, y1) windows covering an image, row by row."""
+    return [
+        (x, y, min(x + tile, width), min(y + tile, height))
+        for y in tile_origins(height, tile, overlap)
+        for x in tile_origins(width, tile, overlap)
+    ]
+
+
+def _area(boxes):
+    return np.clip(boxes[..., 2] - boxes[..., 0], 0, None) * np.clip(boxes[..., 3] - boxes[..., 1], 0, None)
+
+
+def _overlap(box, boxes, metric):
+    ix1 = np.maximum(box[0], boxes[:, 0])
+    iy1 = np.maximum(box[1], boxes[:, 1])
+    ix2 = np.minimum(box[2], boxes[:, 2])
+    iy2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    if metric == "ios":
+        denom = np.minimum(_area(box), _area(boxes))
+    else:
+        denom = _area(box) + _area(boxes) - inter
+    return np.divide(inter, denom, out=np.zeros_like(inter), where=denom > 0)
+
+
+def merge_boxes(boxes, scores, classes, method=TILE_MERGE, metric=TILE_MATCH_METRIC,
+                threshold=TILE_MATCH_THRESHOLD):
+    """
+    Class-aware clustering of N x 4 boxes, most confident first. Each cluster
+    is the top box plus every same-class box overlapping it by >= threshold.
+    Returns (boxes, scores, classes) with one row per cluster: the top box for
+    "nms", or for "wbf" the confidence-weighted mean box with the mean score.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    classes = np.asarray(classes)
+
+    out_boxes, out_scores, out_classes = [], [], []
+    remaining = np.argsort(-scores, kind="stable")
+    while remaining.size:
+        top = remaining[0]
+        members = (classes[remaining] == classes[top]) & (
+            _overlap(boxes[top], boxes[remaining], metric) >= threshold
+        )
+        members[0] = True
+        cluster = remaining[members]
+        remaining = remaining[~members]
+
+        if method == "wbf":
+            weights = scores[cluster]
+            out_boxes.append((boxes[cluster] * weights[:, None]).sum(axis=0) / weights.sum())
+            out_scores.append(weights.mean())
+        else:
+            out_boxes.append(boxes[top])
+            out_scores.append(scores[top])
+        out_classes.append(classes[top])
+
+    return (
+        np.array(out_boxes, dtype=np.float64).reshape(-1, 4),
+        np.array(out_scores, dtype=np.float64),
+        np.array(out_classes),
+    )
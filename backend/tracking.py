@@ -0,0 +1,153 @@
+import os
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Live-stream frame skipping (see StreamTracker)
+STREAM_TRACKING = os.getenv("STREAM_TRACKING", "true").lower() in ("1", "true", "yes")
+STREAM_KEYFRAME_INTERVAL = int(os.getenv("STREAM_KEYFRAME_INTERVAL", "10"))
+STREAM_CHANGE_THRESHOLD = float(os.getenv("STREAM_CHANGE_THRESHOLD", "0.08"))
+
+# Thumbnails are decoded at 1/8 scale straight from the JPEG DCT, which costs a
+# small fraction of a full decode.
+THUMBNAIL_SCALE = 8
+
+
+def thumbnail(contents):
+    """Grayscale 1/8-scale decode as float32 in [0, 1], or None if undecodable."""
+    nparr = np.frombuffer(contents, np.uint8)
+    gray = cv2.imdecode(nparr, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    return gray.astype(np.float32) / 255.0
+
+
+def frame_size(contents, thumb):
+    """(width, height) of the full frame, read from the image header without decoding it."""
+    try:
+        with Image.open(BytesIO(contents)) as img:
+            return img.size
+    except Exception:
+        # Reduced decodes round up, so this is at most THUMBNAIL_SCALE - 1 too large
+        return thumb.shape[1] * THUMBNAIL_SCALE, thumb.shape[0] * THUMBNAIL_SCALE
+
+
+def frame_change(reference, current):
+    """Mean absolute pixel difference between two thumbnails (0 = identical)."""
+    return float(np.mean(np.abs(reference - current)))
+
+
+class StreamTracker:
+    """
+    Per-connection keyframe scheduler for the live camera stream.
+
+    Full inference runs on a keyframe: the first frame, every
+    keyframe_interval frames, and whenever the thumbnail differs from the last
+    keyframe's by more than change_threshold. In between, the keyframe's
+    detections are carried forward, shifted by the global motion that phase
+    correlation measures between the keyframe and current thumbnails. A frame
+    whose carried boxes have all left the view is a keyframe too when the
+    keyframe's vehicle gate was skipped, since the gate has to run then.
+    """
+
+    def __init__(self, keyframe_interval=STREAM_KEYFRAME_INTERVAL, change_threshold=STREAM_CHANGE_THRESHOLD):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.change_threshold = change_threshold
+
+        self._reference = None
+        self._inspection = None
+        self._frame_size = None
+        self._since_keyframe = 0
+
+        self.keyframes = 0
+        self.tracked_frames = 0
+
+    def _needs_keyframe(self, thumb):
+        if self._reference is None or self._inspection is None:
+            return True
+        if self._reference.shape != thumb.shape:
+            return True
+        if self._since_keyframe + 1 >= self.keyframe_interval:
+            return True
+        return frame_change(self._reference, thumb) > self.change_threshold
+
+    def step(self, contents, infer):
+        """
+        Processes one frame. infer(contents) runs full inference and returns an
+        inspect_image dict (or None if undecodable). Returns an inspection dict
+        with an extra "keyframe" flag, or None if the frame cannot be decoded.
+        """
+        thumb = thumbnail(contents)
+        if thumb is None:
+            return None
+
+        if self._needs_keyframe(thumb):
+            return self._keyframe(contents, thumb, infer)
+
+        (dx, dy), _response = cv2.phaseCorrelate(self._reference, thumb)
+        detections = self._shift(self._inspection["detections"], dx, dy, thumb.shape, self._frame_size)
+        if not detections and self._inspection["analysis"] is None:
+            # Without detections there is nothing to skip the vehicle gate for
+            return self._keyframe(contents, thumb, infer)
+
+        self._since_keyframe += 1
+        self.tracked_frames += 1
+        return {
+            "detections": detections,
+            "analysis": self._inspection["analysis"],
+            "stages": ["tracked"],
+            "model_version": self._inspection.get("model_version"),
+            "keyframe": False,
+        }
+
+    def _keyframe(self, contents, thumb, infer):
+        inspection = infer(contents)
+        if inspection is None:
+            return None
+        self._reference = thumb
+        self._inspection = inspection
+        # Tracked frames match the keyframe's thumbnail shape, so its size too
+        self._frame_size = frame_size(contents, thumb)
+        self._since_keyframe = 0
+        self.keyframes += 1
+        return {**inspection, "keyframe": True}
+
+    @staticmethod
+    def _shift(detections, dx, dy, thumb_shape, frame_size):
+        """
+        Moves detections by the thumbnail motion (dx, dy), clamped to the
+        frame (width, height). Boxes that end up with no area inside the
+        frame, i.e. defects that moved out of view, are dropped.
+        """
+        if not isinstance(detections, list) or (dx == 0 and dy == 0):
+            return detections
+        thumb_h, thumb_w = thumb_shape
+        frame_w, frame_h = frame_size
+        ndx, ndy = dx / thumb_w, dy / thumb_h
+        fdx, fdy = dx * THUMBNAIL_SCALE, dy * THUMBNAIL_SCALE
+
+        def clamp(value, upper):
+            return min(max(value, 0), upper)
+
+        shifted = []
+        for det in detections:
+            x1, y1, x2, y2 = det["normalized_bbox"]
+            bx1, by1, bx2, by2 = det["bbox"]
+            bbox = [
+                round(clamp(bx1 + fdx, frame_w)),
+                round(clamp(by1 + fdy, frame_h)),
+                round(clamp(bx2 + fdx, frame_w)),
+                round(clamp(by2 + fdy, frame_h)),
+            ]
+            normalized = [clamp(x1 + ndx, 1.0), clamp(y1 + ndy, 1.0), clamp(x2 + ndx, 1.0), clamp(y2 + ndy, 1.0)]
+            if bbox[2] <= bbox[0] or bbox[3] <= bbox[1]:
+                continue
+            if normalized[2] <= normalized[0] or normalized[3] <= normalized[1]:
+                continue
+            shifted.append({**det, "bbox": bbox, "normalized_bbox": normalized})
+        return shifted
+
+    def stats(self):
+        return {"keyframes": self.keyframes, "tracked_frames": self.tracked_frames}
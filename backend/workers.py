@@ -0,0 +1,335 @@
+import contextlib
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Worker processes are recognised by name (see detect.py), so they load the
+# models themselves while the API process does not.
+WORKER_PROCESS_PREFIX = "inference-worker"
+
+
+class PoolClosed(RuntimeError):
+    """Raised by submit() once the pool is draining or shut down."""
+
+
+def worker_count_from_env():
+    """
+    INFERENCE_WORKERS: 0 (default) runs inference in the API process,
+    N starts N worker processes, "auto" scales with the CPU count.
+    """
+    value = os.getenv("INFERENCE_WORKERS", "0").strip().lower()
+    if value == "auto":
+        # Leave two cores per worker for PyTorch's intra-op threads
+        return max(1, (os.cpu_count() or 2) // 2)
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(f"Invalid INFERENCE_WORKERS={value!r}, running in-process.")
+        return 0
+
+
+def is_worker_process():
+    return mp.current_process().name.startswith(WORKER_PROCESS_PREFIX)
+
+
+_spawn_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _main_script_hidden():
+    """
+    The spawn start method re-runs the parent's __main__ script in each child
+    (as __mp_main__) so that pickled references into it resolve. Workers only
+    need this module and detect.py, and when the API is started with
+    `python main.py` re-running the script would build a whole second app,
+    with its start-up side effects, in every worker. Hiding the script's path
+    while a process starts makes the child skip it.
+    """
+    with _spawn_lock:
+        main = sys.modules.get("__main__")
+        path = getattr(main, "__file__", None)
+        if path is None:
+            yield
+            return
+        del main.__file__
+        try:
+            yield
+        finally:
+            main.__file__ = path
+
+
+def _worker_main(task_queue, result_queue, max_batch_size, torch_threads, model_path=None):
+    """
+    Worker process loop. Tasks are (task_id, kind, shm_name, shape, dtype,
+    original_shape, inference_size); the decoded frame is read straight out of
+    the shared-memory block. model_path overrides the defect model the worker
+    loads (used by hot reload to start a pool on a new version).
+    """
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    import detect
+    if model_path:
+        detect.MODEL_PATH = model_path
+    detect.load_models()
+    if os.getenv("WARMUP_ON_START", "true").lower() in ("1", "true", "yes"):
+        detect.warm_up()
+    # task_id None announces that this worker's models are loaded
+    result_queue.put((None, True, {"ready": mp.current_process().name}))
+
+    runners = {
+        "prediction": detect.predict_images,
+        "analysis": detect.analyze_images,
+    }
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        # Greedily take whatever else is already waiting, up to a batch
+        tasks = [task]
+        while len(tasks) < max_batch_size:
+            try:
+                task = task_queue.get_nowait()
+            except queue.Empty:
+                break
+            if task is None:
+                task_queue.put(None)
+                break
+            tasks.append(task)
+
+        # Attach each shared frame once; tasks on the same frame share its letterbox
+        blocks = {}
+        frames = {}
+        try:
+            for _task_id, _kind, shm_name, shape, dtype, original_shape, inference_size in tasks:
+                if shm_name not in frames:
+                    block = shared_memory.SharedMemory(name=shm_name)
+                    blocks[shm_name] = block
+                    frames[shm_name] = detect.DecodedFrame.from_array(
+                        np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf),
+                        original_shape=original_shape,
+                        inference_size=inference_size,
+                    )
+
+            for kind, run in runners.items():
+                selected = [t for t in tasks if t[1] == kind]
+                if not selected:
+                    continue
+                try:
+                    outputs = run([frames[t[2]] for t in selected])
+                    for t, output in zip(selected, outputs):
+                        result_queue.put((t[0], True, output))
+                except Exception as e:
+                    for t in selected:
+                        result_queue.put((t[0], False, f"{type(e).__name__}: {e}"))
+        finally:
+            # Views into the blocks must be gone before they can be closed
+            frames.clear()
+            for block in blocks.values():
+                try:
+                    block.close()
+                except BufferError:
+                    pass
+
+
+class _Worker:
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.task_queue = None
+        self.in_flight = set()
+        self.restarts = 0
+
+
+class InferenceWorkerPool:
+    """
+    N worker processes, each holding its own copy of both models.
+
+    Decoded frames are copied once into a shared-memory block and only the
+    block name travels over the task queue; results come back over a single
+    result queue. Tasks go to the worker with the fewest in flight. A monitor
+    thread restarts crashed workers and fails the requests they were holding.
+    """
+
+    def __init__(self, num_workers, max_batch_size=8, model_path=None):
+        self.num_workers = num_workers
+        self.max_batch_size = max_batch_size
+        self.model_path = model_path
+        self.torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+        self._ctx = mp.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}  # task_id -> (future, worker, shm_name)
+        self._blocks = {}   # shm_name -> [SharedMemory, refcount]
+        self._workers = [_Worker(i) for i in range(num_workers)]
+        self._ready = set()
+        self._closed = False
+
+        for worker in self._workers:
+            self._start(worker)
+
+        threading.Thread(target=self._collect_results, name="inference-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="inference-monitor", daemon=True).start()
+
+    def _start(self, worker):
+        worker.task_queue = self._ctx.Queue()
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker.task_queue, self._result_queue, self.max_batch_size, self.torch_threads, self.model_path),
+            name=f"{WORKER_PROCESS_PREFIX}-{worker.index}",
+            daemon=True,
+        )
+        with _main_script_hidden():
+            worker.process.start()
+        print(f"Started inference worker {worker.index} (pid {worker.process.pid})")
+
+    def _share(self, frame):
+        """Copies the frame's pixels into shared memory once, however many tasks use it."""
+        image = frame.image
+        shm_name = getattr(frame, "shm_name", None)
+        if shm_name is None or shm_name not in self._blocks:
+            block = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            np.ndarray(image.shape, dtype=image.dtype, buffer=block.buf)[:] = image
+            self._blocks[block.name] = [block, 0]
+            frame.shm_name = block.name
+        self._blocks[frame.shm_name][1] += 1
+        return frame.shm_name
+
+    def _release(self, shm_name):
+        entry = self._blocks.get(shm_name)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self._blocks[shm_name]
+            entry[0].close()
+            entry[0].unlink()
+
+    def submit(self, kind, frame):
+        """kind is "prediction" or "analysis". Returns a concurrent.futures.Future."""
+        future = Future()
+        image = frame.image
+        with self._lock:
+            if self._closed:
+                raise PoolClosed("Inference worker pool is shut down")
+            task_id = next(self._ids)
+            shm_name = self._share(frame)
+            worker = min(self._workers, key=lambda w: len(w.in_flight))
+            worker.in_flight.add(task_id)
+            self._pending[task_id] = (future, worker, shm_name)
+            worker.task_queue.put((
+                task_id, kind, shm_name, image.shape, image.dtype.str,
+                frame.original_shape, frame.inference_size,
+            ))
+        return future
+
+    def _finish(self, task_id):
+        """Removes a task from the books; returns its future (or None if already gone)."""
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            if entry is None:
+                return None
+            future, worker, shm_name = entry
+            worker.in_flight.discard(task_id)
+            self._release(shm_name)
+            return future
+
+    def _collect_results(self):
+        while True:
+            try:
+                task_id, ok, payload = self._result_queue.get()
+            except (EOFError, OSError):
+                return
+            if task_id is None:
+                self._ready.add(payload["ready"])
+                continue
+            future = self._finish(task_id)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(1.0)
+            for worker in self._workers:
+                if self._closed or worker.process.is_alive():
+                    continue
+                print(f"Inference worker {worker.index} exited with code {worker.process.exitcode}; restarting.")
+                for task_id in list(worker.in_flight):
+                    future = self._finish(task_id)
+                    if future is not None:
+                        future.set_exception(RuntimeError("Inference worker crashed"))
+                worker.restarts += 1
+                self._ready.discard(worker.process.name)
+                with self._lock:
+                    self._start(worker)
+
+    def is_ready(self):
+        """True once every worker has loaded its models."""
+        return len(self._ready) == self.num_workers
+
+    def stats(self):
+        return {
+            "workers": self.num_workers,
+            "ready_workers": len(self._ready),
+            "torch_threads_per_worker": self.torch_threads,
+            "in_flight": len(self._pending),
+            "shared_frames": len(self._blocks),
+            "per_worker": [
+                {
+                    "index": w.index,
+                    "pid": w.process.pid,
+                    "alive": w.process.is_alive(),
+                    "in_flight": len(w.in_flight),
+                    "restarts": w.restarts,
+                }
+                for w in self._workers
+            ],
+        }
+
+    def drain(self, timeout=60.0):
+        """
+        Stops accepting new tasks and waits up to timeout seconds for the ones
+        already submitted to finish. Returns how many were still pending.
+        """
+        with self._lock:
+            self._closed = True
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return len(self._pending)
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+            for worker in self._workers:
+                worker.task_queue.put(None)
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        with self._lock:
+            pending = [future for future, _worker, _shm in self._pending.values()]
+            self._pending.clear()
+            for block, _refs in self._blocks.values():
+                block.close()
+                block.unlink()
+            self._blocks.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Inference worker pool shut down"))
@@ -11,6 +11,8 @@ type HistoryItem = {
     date: string; // YYYY-MM-DD
     createdAt: string; // ISO or Timestamp
     image_url: string;
+    thumbnail_url?: string;
+    medium_url?: string;
     defects: number;
     status: string;
     detections: any[];
@@ -284,8 +286,9 @@ export default function AdminDashboard() {
                                             <td className="p-4 align-middle [&:has([role=checkbox])]:pr-0">
                                                 <div className="w-16 h-16 rounded-md overflow-hidden bg-muted relative group cursor-pointer" onClick={() => window.open(item.image_url, '_blank')}>
                                                     <img
-                                                        src={item.image_url}
+                                                        src={item.thumbnail_url || item.image_url}
                                                         alt="Scan"
+                                                        loading="lazy"
                                                         className="w-full h-full object-cover transition-transform group-hover:scale-110"
                                                     />
                                                 </div>
@@ -10,6 +10,8 @@ export default function CameraPage() {
     const [isScanning, setIsScanning] = useState(false);
     const [latestDetections, setLatestDetections] = useState<any[]>([]);
     const scanningIntervalRef = useRef<NodeJS.Timeout | null>(null);
+    const socketRef = useRef<WebSocket | null>(null);
+    const frameInFlightRef = useRef(false);
 
     // 16:9 Aspect Ratio for better screen fit
     const videoConstraints = {
@@ -36,34 +38,49 @@ export default function CameraPage() {
         return map[cls.toLowerCase()] || '#ef4444';
     };
 
+    // Live frames go over one WebSocket instead of a multipart POST per tick.
+    // At most one frame is in flight; the server also drops stale frames.
+    const openStream = useCallback(() => {
+        socketRef.current?.close();
+        const apiUrl = process.env.NEXT_PUBLIC_API_URL || "http://127.0.0.1:8000/api/v1";
+        const socket = new WebSocket(`${apiUrl.replace(/^http/, "ws")}/ws/predict`);
+        socket.binaryType = "arraybuffer";
+        socket.onmessage = (event) => {
+            frameInFlightRef.current = false;
+            const data = JSON.parse(event.data);
+            if (data.error) {
+                console.warn("Frame inference failed:", data.status_code, data.error);
+                return;
+            }
+            setLatestDetections(data.detections || []);
+        };
+        socket.onerror = (error) => console.error("Live detection stream error", error);
+        socket.onclose = () => {
+            frameInFlightRef.current = false;
+            if (socketRef.current === socket) socketRef.current = null;
+        };
+        socketRef.current = socket;
+    }, []);
+
+    const closeStream = useCallback(() => {
+        socketRef.current?.close();
+        socketRef.current = null;
+        frameInFlightRef.current = false;
+    }, []);
+
     const captureFrame = useCallback(async () => {
         if (!webcamRef.current) return;
+        const socket = socketRef.current;
+        if (!socket || socket.readyState !== WebSocket.OPEN || frameInFlightRef.current) return;
         const imageSrc = webcamRef.current.getScreenshot();
         if (!imageSrc) return;
 
         // Create blob from base64
         const res = await fetch(imageSrc);
         const blob = await res.blob();
-        const file = new File([blob], "frame.jpg", { type: "image/jpeg" });
 
-        const formData = new FormData();
-        formData.append("file", file);
-
-        try {
-            const apiUrl = process.env.NEXT_PUBLIC_API_URL || "http://127.0.0.1:8000/api/v1";
-            const response = await fetch(`${apiUrl}/predict`, {
-                method: "POST",
-                body: formData,
-            });
-            if (response.ok) {
-                const data = await response.json();
-                setLatestDetections(data.detections || []);
-            } else {
-                console.warn("Frame inference failed:", response.status);
-            }
-        } catch (error) {
-            console.error("Frame inference failed", error);
-        }
+        frameInFlightRef.current = true;
+        socket.send(await blob.arrayBuffer());
     }, [webcamRef]);
 
     const stopScanning = useCallback(() => {
@@ -72,8 +89,9 @@ export default function CameraPage() {
             clearInterval(scanningIntervalRef.current);
             scanningIntervalRef.current = null;
         }
+        closeStream();
         setLatestDetections([]);
-    }, []);
+    }, [closeStream]);
 
     const startScanning = useCallback(() => {
         setIsScanning(true);
@@ -82,7 +100,8 @@ export default function CameraPage() {
     // Effect to manage the interval based on isScanning state
     useEffect(() => {
         if (isScanning && !scanningIntervalRef.current) {
-            // Give camera a moment to warm up, then start polling
+            openStream();
+            // Give camera a moment to warm up, then start streaming
             const timeoutId = setTimeout(() => {
                 scanningIntervalRef.current = setInterval(captureFrame, 200);
             }, 1000); // 1 second delay to allow camera to mount
@@ -90,6 +109,7 @@ export default function CameraPage() {
         } else if (!isScanning && scanningIntervalRef.current) {
             clearInterval(scanningIntervalRef.current);
             scanningIntervalRef.current = null;
+            closeStream();
         }
 
         return () => {
@@ -97,8 +117,9 @@ export default function CameraPage() {
                 clearInterval(scanningIntervalRef.current);
                 scanningIntervalRef.current = null;
             }
+            closeStream();
         };
-    }, [isScanning, captureFrame]);
+    }, [isScanning, captureFrame, openStream, closeStream]);
 
 
     const capture = useCallback(() => {
@@ -154,6 +175,10 @@ export default function CameraPage() {
             const saveFormData = new FormData();
             saveFormData.append("file", saveFile);
             saveFormData.append("detections", JSON.stringify(detections));
+            if (predictData.scan_token) {
+                // Lets the server reuse its own /predict results instead of re-running the models
+                saveFormData.append("scan_token", predictData.scan_token);
+            }
             saveFormData.append("status", detections.length > 0 ? "Attention" : "Clean");
             saveFormData.append("user_id", currentUser.uid);
             saveFormData.append("user_email", currentUser.email || "");
@@ -179,7 +179,7 @@ export default function HistoryPage() {
                                             {item.image_url ? (
                                                 <>
                                                     {/* eslint-disable-next-line @next/next/no-img-element */}
-                                                    <img src={item.image_url} alt="Scan" className="w-full h-full object-cover" />
+                                                    <img src={item.thumbnail_url || item.image_url} alt="Scan" loading="lazy" className="w-full h-full object-cover" />
                                                     <div className="absolute inset-0 bg-black/50 opacity-0 group-hover:opacity-100 transition-opacity flex items-center justify-center">
                                                         <Eye className="w-4 h-4 text-white" />
                                                     </div>
@@ -297,7 +297,7 @@ export default function DashboardPage() {
                                                         {scan.image_url ? (
                                                             <>
                                                                 {/* eslint-disable-next-line @next/next/no-img-element */}
-                                                                <img src={scan.image_url} alt="scan" className="w-full h-full object-cover" />
+                                                                <img src={scan.thumbnail_url || scan.image_url} alt="scan" loading="lazy" className="w-full h-full object-cover" />
                                                                 <div className="absolute inset-0 bg-black/50 opacity-0 group-hover:opacity-100 transition-opacity flex items-center justify-center">
                                                                     <Eye className="w-4 h-4 text-white" />
                                                                 </div>
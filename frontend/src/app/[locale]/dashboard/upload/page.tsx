@@ -15,6 +15,7 @@ export default function UploadPage() {
 
     const [imageDimensions, setImageDimensions] = useState<{ width: number; height: number } | null>(null);
     const [detections, setDetections] = useState<any[]>([]);
+    const [scanToken, setScanToken] = useState<string | null>(null);
 
     // Color mapping for defect types
     const getColorForClass = (cls: string) => {
@@ -58,6 +59,7 @@ export default function UploadPage() {
             const objectUrl = URL.createObjectURL(selectedFile);
             setPreview(objectUrl);
             setDetections([]); // Clear previous detections
+            setScanToken(null);
 
             if (selectedFile.type.startsWith("image/")) {
                 const img = new window.Image();
@@ -117,6 +119,7 @@ export default function UploadPage() {
 
             const data = await response.json();
             setDetections(data.detections);
+            setScanToken(data.scan_token || null);
         } catch (error) {
             console.error(error);
             alert(`Error analyzing media: ${error instanceof Error ? error.message : "Unknown error"}`);
@@ -142,6 +145,10 @@ export default function UploadPage() {
             const saveFormData = new FormData();
             saveFormData.append("file", saveFile);
             saveFormData.append("detections", JSON.stringify(detections));
+            if (scanToken) {
+                // Lets the server reuse its own /predict results instead of re-running the models
+                saveFormData.append("scan_token", scanToken);
+            }
             saveFormData.append("status", detections.length > 0 ? "Attention" : "Clean");
             saveFormData.append("user_id", currentUser.uid);
             saveFormData.append("user_email", currentUser.email || "");